@@ -0,0 +1,178 @@
+"""Collection subscriptions for the CoAP PubSub broker.
+
+Observe every topic a FETCH filter matches with one observation.
+
+FETCH on /ps with Observe: 0 and the usual filter payload (conf-filter
+and property values) subscribes to the values of all matching topics,
+including those created, or reconfigured to match, later. Responses are
+CBOR sequences (application/cbor-seq) of arrays, one per topic:
+
+    [topic-data, content-format, payload]   the topic's current value
+    [topic-data, content-format, null]      the value, too big to carry:
+                                            GET the topic-data to read it
+    [topic-data]                            no value any more (topic-data
+                                            deleted, topic deleted, or it
+                                            no longer matches)
+
+The first response holds the current values of the matching topics, and
+every notification the topics that changed since the previous one. Each
+fits in one message; what doesn't fit goes in the next notification.
+Changes of a topic waiting to be sent are conflated to its latest value,
+as notifications of a single topic are.
+
+Each subscription's matching topic-data paths are indexed, so a publish
+finds its subscriptions with one dict lookup; the filters are evaluated
+only when a topic is created, reconfigured or deleted.
+"""
+
+import cbor2
+
+import aiocoap
+from aiocoap import Message
+
+from history import CT_CBOR_SEQ
+
+
+def matches(config: dict, names: list[str], values: dict) -> bool:
+    """Whether *config* passes a FETCH filter (as TopicRegistry.match)."""
+    return all(name in config for name in names) and all(
+        name in config and str(config[name]) == str(value)
+        for name, value in values.items()
+    )
+
+
+class CollectionSubscription:
+    """One observation of a FETCH filter on the collection."""
+
+    __slots__ = ("request", "observation", "names", "values", "paths", "pending")
+
+    def __init__(self, request, observation, names: list[str], values: dict):
+        self.request = request
+        self.observation = observation
+        self.names = names
+        self.values = values
+        self.paths: set[str] = set()   # topic-data paths matching now
+        # topic-data path -> its TopicDataResource, or None once it stopped
+        # matching; insertion-ordered, one entry per topic
+        self.pending: dict = {}
+
+    def changed(self, path: str, data_res) -> None:
+        if not self.pending:
+            self.observation.trigger()
+        self.pending[path] = data_res
+
+    def render(self) -> Message:
+        """The next response: as many pending topics as fit in one message."""
+        budget = self.request.remote.maximum_payload_size
+        parts = []
+        size = 0
+        pending = self.pending
+        while pending:
+            path = next(iter(pending))
+            data_res = pending[path]
+            if data_res is None or data_res._value is None:
+                entry = cbor2.dumps([path])
+            else:
+                entry = cbor2.dumps([path, data_res._content_format, data_res._value])
+                if len(entry) > budget:
+                    entry = cbor2.dumps([path, data_res._content_format, None])
+            if parts and size + len(entry) > budget:
+                break
+            parts.append(entry)
+            size += len(entry)
+            del pending[path]
+        if pending:
+            self.observation.trigger()
+        response = Message(code=aiocoap.CONTENT, payload=b"".join(parts))
+        response.opt.content_format = CT_CBOR_SEQ
+        return response
+
+
+class CollectionSubscriptions:
+    """The collection subscriptions of one broker, indexed by topic-data path."""
+
+    def __init__(self):
+        self._by_request: dict[int, CollectionSubscription] = {}
+        self._watchers: dict[str, dict[CollectionSubscription, None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_request)
+
+    def add(self, request, observation, names: list[str], values: dict,
+            matching: list) -> CollectionSubscription:
+        """Subscribe *observation*; *matching* are the TopicDataResources the
+        filter matches now, whose values make up the first response."""
+        sub = CollectionSubscription(request, observation, names, values)
+        self._by_request[id(request)] = sub
+        for data_res in matching:
+            self._watch(sub, data_res.path)
+            if data_res._value is not None:
+                sub.pending[data_res.path] = data_res
+        return sub
+
+    def remove(self, sub: CollectionSubscription) -> None:
+        self._by_request.pop(id(sub.request), None)
+        for path in sub.paths:
+            watchers = self._watchers.get(path)
+            if watchers is not None:
+                watchers.pop(sub, None)
+                if not watchers:
+                    del self._watchers[path]
+        sub.paths.clear()
+        sub.pending.clear()
+
+    def get(self, request) -> CollectionSubscription | None:
+        """The subscription *request* established, when it is rendered again."""
+        sub = self._by_request.get(id(request))
+        return sub if sub is not None and sub.request is request else None
+
+    def _watch(self, sub: CollectionSubscription, path: str) -> None:
+        sub.paths.add(path)
+        self._watchers.setdefault(path, {})[sub] = None
+
+    def _unwatch(self, sub: CollectionSubscription, path: str) -> None:
+        sub.paths.discard(path)
+        watchers = self._watchers[path]
+        del watchers[sub]
+        if not watchers:
+            del self._watchers[path]
+
+    # -- events --------------------------------------------------------------
+
+    def value_changed(self, data_res) -> None:
+        """*data_res* was published to, or its value deleted."""
+        watchers = self._watchers.get(data_res.path)
+        if watchers:
+            for sub in watchers:
+                sub.changed(data_res.path, data_res)
+
+    def topic_added(self, config: dict, data_res) -> None:
+        if not self._by_request:
+            return
+        for sub in self._by_request.values():
+            if matches(config, sub.names, sub.values):
+                self._watch(sub, data_res.path)
+                if data_res._value is not None:
+                    sub.changed(data_res.path, data_res)
+
+    def topic_changed(self, config: dict, data_res) -> None:
+        """A topic's configuration changed: it may start or stop matching."""
+        if not self._by_request:
+            return
+        path = data_res.path
+        for sub in self._by_request.values():
+            now = matches(config, sub.names, sub.values)
+            if now and path not in sub.paths:
+                self._watch(sub, path)
+                if data_res._value is not None:
+                    sub.changed(path, data_res)
+            elif not now and path in sub.paths:
+                self._unwatch(sub, path)
+                sub.changed(path, None)
+
+    def topic_removed(self, path: str) -> None:
+        watchers = self._watchers.get(path)
+        if watchers:
+            for sub in list(watchers):
+                self._unwatch(sub, path)
+                sub.changed(path, None)
@@ -0,0 +1,109 @@
+"""Slow-consumer handling for the CoAP PubSub broker.
+
+Keep one congested subscriber from piling up notification work.
+
+Notifications to an observer that asked confirmably are confirmable too,
+and aiocoap sends those one at a time per endpoint (NSTART = 1): the rest
+wait in a per-endpoint backlog, each retransmitted with back-off once it
+is sent. A subscriber behind a bad link thus collects an ever longer queue
+of notifications, all holding memory and retransmission timers.
+
+Before a notification goes to an observer, the broker looks at how many
+confirmable messages to its endpoint are unacknowledged (in flight or
+queued). At ``threshold`` or more the observer is slow, and the policy
+decides what happens:
+
+  drop        skip the notification; the observer gets later ones once
+              its endpoint has caught up
+  conflate    skip it, and send the latest value once the endpoint has
+              caught up (checked every CATCH_UP_INTERVAL seconds)
+  deregister  end the observation with 5.03 Service Unavailable
+
+Observers sharing an endpoint share its count. Every action is counted,
+and logged when an observer starts or stops lagging, or is deregistered.
+"""
+
+import logging
+
+import aiocoap
+from aiocoap import Message
+
+log = logging.getLogger("pubsub-backpressure")
+
+SLOW_CONSUMER_POLICIES = ("drop", "conflate", "deregister")
+
+# Unacknowledged confirmable messages to an endpoint that make it slow
+DEFAULT_SLOW_THRESHOLD = 8
+
+# Seconds between checks whether a conflated observer has caught up
+CATCH_UP_INTERVAL = 1.0
+
+
+def unacknowledged(remote) -> int:
+    """Confirmable messages to *remote* not yet acknowledged: the one in
+    flight and those queued behind it. 0 for transports that have no
+    confirmable messages (or keep them elsewhere)."""
+    manager = getattr(getattr(remote, "interface", None), "_ctx", None)
+    backlogs = getattr(manager, "_backlogs", None)
+    if not backlogs:
+        return 0
+    backlog = backlogs.get(remote)
+    # An endpoint has a backlog entry exactly while a message is in flight
+    return 0 if backlog is None else len(backlog) + 1
+
+
+class SlowConsumers:
+    """The slow-consumer policy of one broker, and what it has done."""
+
+    def __init__(self, policy: str = "conflate", threshold: int = DEFAULT_SLOW_THRESHOLD):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"unknown slow-consumer policy {policy!r}")
+        self.policy = policy
+        self.threshold = threshold   # 0 turns the check off
+        self.dropped = 0
+        self.conflated = 0
+        self.deregistered = 0
+
+    def admit(self, path: str, lagging: set, obs, remote) -> bool:
+        """Whether to notify *obs* now. If its endpoint is slow, apply the
+        policy and return False; *lagging* holds the resource's observers
+        that are being held back."""
+        if not self.threshold or remote is None:
+            return True
+        pending = unacknowledged(remote)
+        if pending < self.threshold:
+            if obs in lagging:
+                lagging.discard(obs)
+                log.info("Observer %s of %s caught up", remote, path)
+            return True
+
+        if self.policy == "deregister":
+            lagging.discard(obs)
+            self.deregistered += 1
+            log.warning("Deregistering observer %s of %s: %d unacknowledged notifications",
+                        remote, path, pending)
+            # Non-confirmable, so it doesn't queue behind the backlog
+            obs.trigger(Message(code=aiocoap.SERVICE_UNAVAILABLE,
+                                payload=b"Too many unacknowledged notifications",
+                                transport_tuning=aiocoap.Unreliable()),
+                        is_last=True)
+            return False
+
+        if obs not in lagging:
+            lagging.add(obs)
+            log.warning("Observer %s of %s is slow (%d unacknowledged notifications); %s",
+                        remote, path, pending,
+                        "dropping notifications" if self.policy == "drop"
+                        else "conflating to the latest value")
+        if self.policy == "drop":
+            self.dropped += 1
+        else:
+            self.conflated += 1
+        return False
+
+    def caught_up(self, path: str, remote) -> bool:
+        """Whether a conflated observer's endpoint is below the threshold again."""
+        if unacknowledged(remote) >= self.threshold:
+            return False
+        log.info("Observer %s of %s caught up", remote, path)
+        return True
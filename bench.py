@@ -0,0 +1,314 @@
+"""Load generator and benchmark scenarios for ``pubsub-client bench``.
+
+Scenarios run against a broker given on the command line, or against one
+started for the run with --spawn. Each reports the number of operations,
+throughput and p50/p99/p999 latency; the whole run is printed as one JSON
+document so results can be diffed between commits.
+
+  create   topic creation rate (POST /ps)
+  publish  publish throughput with --publishers concurrent publishers
+  fanout   publish-to-notification latency to --observers observers per topic
+  fetch    FETCH latency on /ps as the collection grows (--fetch-sizes)
+
+Only publishes the broker answers with 2.01 or 2.04 are timed; any others
+are counted under "failed", by response code.
+
+Topics created by a scenario are deleted again when it finishes.
+"""
+
+import asyncio
+import collections
+import json
+import math
+import shlex
+import subprocess
+import sys
+import time
+
+import aiocoap
+from aiocoap import Message
+
+from pubsub import PubSubClient, broker_uri
+
+SCENARIOS = ("create", "publish", "fanout", "fetch")
+
+BENCH_TOPIC_TYPE = "pubsub-bench"
+
+PUBLISHED = (aiocoap.CREATED, aiocoap.CHANGED)
+
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = math.ceil(p / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank))]
+
+
+def _result(scenario: str, params: dict, latencies: list[float], elapsed: float, **extra) -> dict:
+    latencies = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)   # noqa: E731
+    return {
+        "scenario": scenario,
+        "params": params,
+        "count": len(latencies),
+        "seconds": round(elapsed, 3),
+        "msgs_per_s": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p99": ms(percentile(latencies, 99)),
+            "p999": ms(percentile(latencies, 99.9)),
+        },
+        **extra,
+    }
+
+
+async def _timed(coro, latencies: list[float]):
+    start = time.perf_counter()
+    result = await coro
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def _publish(ps: PubSubClient, data_path: str, payload: bytes,
+                   latencies: list[float], failed: collections.Counter) -> bool:
+    """PUT one value; timed if the broker took it, else counted by response code."""
+    start = time.perf_counter()
+    r = await ps.request("PUT", data_path, payload=payload)
+    if r.code not in PUBLISHED:
+        failed[str(r.code)] += 1
+        return False
+    latencies.append(time.perf_counter() - start)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Topic helpers
+# ---------------------------------------------------------------------------
+
+async def _create(ps: PubSubClient, name: str) -> tuple[str, str]:
+    topic_url, config = await ps.create({"topic-name": name, "topic-type": BENCH_TOPIC_TYPE})
+    return topic_url, config["topic-data"]
+
+
+async def _create_many(ps: PubSubClient, count: int, latencies=None):
+    latencies = [] if latencies is None else latencies
+    return await asyncio.gather(
+        *(_timed(_create(ps, f"bench-{i}"), latencies) for i in range(count))
+    )
+
+
+async def _delete_many(ps: PubSubClient, topics) -> None:
+    await asyncio.gather(*(ps.request("DELETE", topic_url) for topic_url, _ in topics))
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+async def bench_create(broker: str, args) -> list[dict]:
+    latencies: list[float] = []
+    async with PubSubClient(broker, args.inflight) as ps:
+        start = time.perf_counter()
+        topics = await _create_many(ps, args.topics, latencies)
+        elapsed = time.perf_counter() - start
+        await _delete_many(ps, topics)
+    return [_result("create", {"topics": args.topics, "inflight": args.inflight},
+                    latencies, elapsed)]
+
+
+async def bench_publish(broker: str, args) -> list[dict]:
+    latencies: list[float] = []
+    failed: collections.Counter = collections.Counter()
+    async with PubSubClient(broker, args.inflight) as setup:
+        topics = await _create_many(setup, args.publishers)
+
+        async def publisher(data_path: str) -> None:
+            # One context per publisher, like separate devices
+            async with PubSubClient(broker, args.inflight) as ps:
+                await asyncio.gather(*(
+                    _publish(ps, data_path, b"%d" % i, latencies, failed)
+                    for i in range(args.messages)
+                ))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(publisher(data_path) for _, data_path in topics))
+        elapsed = time.perf_counter() - start
+        await _delete_many(setup, topics)
+    return [_result("publish",
+                    {"publishers": args.publishers, "messages": args.messages,
+                     "inflight": args.inflight},
+                    latencies, elapsed, failed=dict(failed))]
+
+
+async def bench_fanout(broker: str, args) -> list[dict]:
+    """Latency from sending a PUT to each observer receiving that value.
+
+    Observe is lossy by design, so notifications superseded by a later
+    value are not waited for; the delivered share of the values the broker
+    took is reported alongside.
+    """
+    latencies: list[float] = []
+    failed: collections.Counter = collections.Counter()
+    topic_count = max(1, args.fanout_topics)
+    async with PubSubClient(broker, args.inflight) as setup:
+        topics = await _create_many(setup, topic_count)
+        for _, data_path in topics:
+            await _publish(setup, data_path, b"-1", [], failed)
+
+        sent: dict[tuple[str, int], float] = {}
+        observer_ctxs = [await aiocoap.Context.create_client_context()
+                         for _ in range(args.observers)]
+        observations = []
+        tasks = []
+        last_received = 0.0
+
+        async def watch(data_path: str, obs) -> None:
+            nonlocal last_received
+            async for notification in obs:
+                try:
+                    seq = int(notification.payload)
+                except ValueError:   # an error notification, or no value yet
+                    continue
+                t = sent.get((data_path, seq))
+                if t is not None:
+                    last_received = time.perf_counter()
+                    latencies.append(last_received - t)
+
+        try:
+            for ctx in observer_ctxs:
+                for _, data_path in topics:
+                    req = ctx.request(Message(code=aiocoap.GET,
+                                              uri=f"{broker}/{data_path}", observe=0))
+                    await req.response
+                    observations.append(req)
+                    tasks.append(asyncio.create_task(watch(data_path, req.observation)))
+
+            start = time.perf_counter()
+            for seq in range(args.messages):
+                for _, data_path in topics:
+                    sent[(data_path, seq)] = time.perf_counter()
+                    if not await _publish(setup, data_path, b"%d" % seq, [], failed):
+                        del sent[(data_path, seq)]
+            await asyncio.sleep(args.settle)
+            elapsed = max(last_received, start) - start
+        finally:
+            for req in observations:
+                req.observation.cancel()
+            for task in tasks:
+                task.cancel()
+            for ctx in observer_ctxs:
+                await ctx.shutdown()
+            await _delete_many(setup, topics)
+
+    expected = len(sent) * args.observers   # values the broker took
+    return [_result("fanout",
+                    {"topics": topic_count, "observers": args.observers,
+                     "messages": args.messages},
+                    latencies, elapsed,
+                    delivered_ratio=round(len(latencies) / expected, 4) if expected else None,
+                    failed=dict(failed))]
+
+
+async def bench_fetch(broker: str, args) -> list[dict]:
+    results = []
+    topics: list[tuple[str, str]] = []
+    async with PubSubClient(broker, args.inflight) as ps:
+        try:
+            for size in sorted(args.fetch_sizes):
+                topics += await _create_many(ps, size - len(topics))
+                latencies: list[float] = []
+                start = time.perf_counter()
+                for _ in range(args.fetches):
+                    await _timed(ps.fetch(["topic-type"]), latencies)
+                elapsed = time.perf_counter() - start
+                results.append(_result("fetch", {"topics": size, "fetches": args.fetches},
+                                       latencies, elapsed))
+        finally:
+            await _delete_many(ps, topics)
+    return results
+
+
+RUNNERS = {
+    "create":  bench_create,
+    "publish": bench_publish,
+    "fanout":  bench_fanout,
+    "fetch":   bench_fetch,
+}
+
+
+# ---------------------------------------------------------------------------
+# Broker management and entry point
+# ---------------------------------------------------------------------------
+
+async def _wait_for_broker(broker: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with PubSubClient(broker) as ps:
+        while True:
+            try:
+                await asyncio.wait_for(ps.request("GET", "ps"), 1.0)
+                return
+            except (asyncio.TimeoutError, aiocoap.error.Error):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"broker at {broker} did not come up")
+                await asyncio.sleep(0.2)
+
+
+async def run(args) -> None:
+    broker_proc = None
+    if args.spawn:
+        broker = f"coap://127.0.0.1:{args.spawn_port}"
+        broker_proc = subprocess.Popen(
+            [sys.executable, "-m", "broker", "--host", "127.0.0.1",
+             "--port", str(args.spawn_port), *shlex.split(args.broker_args)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    elif args.broker:
+        broker = broker_uri(args.broker)
+    else:
+        print("bench: give a broker URI or --spawn", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        await _wait_for_broker(broker)
+        results = []
+        for scenario in args.scenario or SCENARIOS:
+            results += await RUNNERS[scenario](broker, args)
+    finally:
+        if broker_proc is not None:
+            broker_proc.terminate()
+            broker_proc.wait()
+
+    report = {"broker": broker, "spawned": args.spawn, "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+def add_parser(sub) -> None:
+    p = sub.add_parser("bench", help="Run load scenarios and report latency/throughput as JSON")
+    p.add_argument("broker", nargs="?", help="Broker to target (omit with --spawn)")
+    p.add_argument("--spawn", action="store_true",
+                   help="Start a local broker for the run")
+    p.add_argument("--spawn-port", type=int, default=56830,
+                   help="Port for the spawned broker (default: 56830)")
+    p.add_argument("--broker-args", default="",
+                   help='Extra arguments for the spawned broker, e.g. "--workers 4"')
+    p.add_argument("--scenario", action="append", choices=SCENARIOS,
+                   help="Scenario to run; repeatable (default: all)")
+    p.add_argument("--topics", type=int, default=1000, help="create: topics to create")
+    p.add_argument("--publishers", type=int, default=8, help="publish: concurrent publishers")
+    p.add_argument("--messages", type=int, default=200,
+                   help="publish/fanout: messages per publisher or topic")
+    p.add_argument("--observers", type=int, default=10, help="fanout: observers per topic")
+    p.add_argument("--fanout-topics", type=int, default=4, help="fanout: observed topics")
+    p.add_argument("--settle", type=float, default=0.5,
+                   help="fanout: seconds to wait for trailing notifications")
+    p.add_argument("--fetch-sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                   help="fetch: collection sizes to measure at")
+    p.add_argument("--fetches", type=int, default=50, help="fetch: requests per size")
+    p.add_argument("--inflight", type=int, default=16,
+                   help="Requests in flight per client context (default: 16)")
+    p.add_argument("--output", help="Also write the JSON report to this file")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Topic config codec micro-benchmark.
+#
+# Compares the per-request cost of the original codec functions (kept
+# below as the baseline) with what the broker does now: serving a topic
+# GET from the cached encoding, encoding once after a config change, and
+# decoding a POST body through the CBOR fast path.
+#
+#   python benchmarks/codec.py --number 200000
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cbor2
+
+from codec import (
+    TOPIC_KEYS, TOPIC_KEYS_REV, CT_PUBSUB_CBOR,
+    decode_topic_payload, encode_topic_config,
+)
+from broker import TopicResource
+
+
+def _baseline_decode(payload: bytes, content_format: int | None = None) -> dict:
+    if content_format == CT_PUBSUB_CBOR:
+        raw = cbor2.loads(payload)
+        result = {}
+        for k, v in raw.items():
+            name = TOPIC_KEYS_REV.get(k, str(k))
+            if name == "expiration-date" and isinstance(v, cbor2.CBORTag) and v.tag == 1:
+                v = v.value
+            result[name] = v
+        return result
+    import json
+    return json.loads(payload)
+
+
+def _baseline_encode(d: dict) -> bytes:
+    cbor_map = {}
+    for name, value in d.items():
+        if value is None:
+            continue
+        key = TOPIC_KEYS.get(name)
+        if key is None:
+            continue
+        if name == "expiration-date":
+            value = cbor2.CBORTag(1, int(value))
+        cbor_map[key] = value
+    return cbor2.dumps(cbor_map)
+
+
+CONFIG = {
+    "topic-name": "living-room-temperature",
+    "topic-data": "ps/data/1bd0d6d",
+    "resource-type": "core.ps.conf",
+    "topic-content-format": 60,
+    "topic-type": "temperature",
+    "expiration-date": 1893456000,
+    "max-subscribers": 50,
+    "observer-check": 86400,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Topic config codec micro-benchmark")
+    parser.add_argument("--number", type=int, default=100000, help="Calls per case")
+    args = parser.parse_args()
+
+    topic = TopicResource(CONFIG, "ps/1bd0d6d")
+    payload = encode_topic_config(CONFIG)
+    assert _baseline_encode(CONFIG) == payload
+
+    cases = {
+        "get_baseline":    lambda: _baseline_encode(topic.config),
+        "get_cached":      lambda: topic.encoded_config,
+        "encode":          lambda: encode_topic_config(topic.config),
+        "decode_baseline": lambda: _baseline_decode(payload, CT_PUBSUB_CBOR),
+        "decode":          lambda: decode_topic_payload(payload, CT_PUBSUB_CBOR),
+    }
+    results = {
+        name: round(timeit.timeit(fn, number=args.number) / args.number * 1e9)
+        for name, fn in cases.items()
+    }
+    print(json.dumps({"number": args.number, "ns_per_call": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
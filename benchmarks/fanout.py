@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Fan-out memory and CPU versus payload size.
+#
+# For each payload size, starts `broker.py` on a scratch port, creates one
+# topic and subscribes to it with a number of observers, then publishes
+# values of that size one at a time, each once every observer has received
+# the previous one (or --settle seconds have passed: notifications are
+# non-confirmable, so one lost on a saturated socket is not resent). Values
+# too big for one message reach the observers blockwise. Reports the
+# broker's CPU time and resident memory (from /proc, so Linux only)
+# alongside the wall time and the notifications delivered.
+#
+#   python benchmarks/fanout.py --sizes 64 1024 16384 65536 --observers 50
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pubsub import PubSubClient
+
+BROKER = os.path.join(os.path.dirname(__file__), "..", "broker.py")
+
+
+def _cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _memory_kb(pid: int) -> dict[str, int]:
+    result = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                result[name] = int(value.split()[0])
+    return result
+
+
+async def _wait_for_broker(ps: PubSubClient, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await asyncio.wait_for(ps.topics(), 1.0)
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def _fanout(pid: int, uri: str, size: int, args) -> dict:
+    async with PubSubClient(uri, inflight=args.observers) as ps:
+        await _wait_for_broker(ps)
+        _, config = await ps.create({"topic-name": f"fanout-{size}"})
+        data = config["topic-data"]
+        await ps.publish(data, b"%08d" % 0 + b"." * (size - 8))
+
+        received = 0
+        delivered = asyncio.Event()
+        expected = 0
+
+        async def observe() -> None:
+            nonlocal received
+            async for _, notification in ps.subscribe_many([data] * args.observers):
+                if notification is None or isinstance(notification, Exception):
+                    raise RuntimeError(f"observation ended: {notification!r}")
+                if int(bytes(notification.payload[:8])) == expected:
+                    received += 1
+                    if received == args.observers:
+                        delivered.set()
+
+        observers = asyncio.create_task(observe())
+        try:
+            # The first notification of every observer is the current value
+            await asyncio.wait_for(delivered.wait(), 60)
+            cpu_before = _cpu_seconds(pid)
+            start = time.perf_counter()
+            total = 0
+            for seq in range(1, args.messages + 1):
+                expected, received = seq, 0
+                delivered.clear()
+                await ps.publish(data, b"%08d" % seq + b"." * (size - 8))
+                try:
+                    await asyncio.wait_for(delivered.wait(), args.settle)
+                except asyncio.TimeoutError:
+                    pass
+                total += received
+            elapsed = time.perf_counter() - start
+            cpu = _cpu_seconds(pid) - cpu_before
+        finally:
+            observers.cancel()
+            await asyncio.gather(observers, return_exceptions=True)
+
+    notifications = args.messages * args.observers
+    memory = _memory_kb(pid)
+    return {
+        "payload": size,
+        "observers": args.observers,
+        "notifications": notifications,
+        "delivered": total,
+        "seconds": round(elapsed, 3),
+        "broker_cpu_s": round(cpu, 3),
+        "broker_cpu_us_per_notification": round(cpu / notifications * 1e6, 1),
+        "broker_rss_kb": memory.get("VmRSS"),
+        "broker_peak_rss_kb": memory.get("VmHWM"),
+    }
+
+
+def run(size: int, args) -> dict:
+    broker = subprocess.Popen(
+        [sys.executable, BROKER, "--host", "127.0.0.1", "--port", str(args.port),
+         "--max-payload", str(max(size, 8))],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        return asyncio.run(_fanout(broker.pid, f"coap://127.0.0.1:{args.port}", size, args))
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fan-out memory and CPU versus payload size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 1024, 16384, 65536])
+    parser.add_argument("--observers", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=50, help="Values published per size")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="Seconds to wait for a value to reach every observer")
+    parser.add_argument("--port", type=int, default=56840)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        print(json.dumps(run(max(size, 8), args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Publish-to-notification latency across two federated brokers on localhost.
+#
+# Starts two `broker.py` processes that name each other with --peer, creates
+# a topic on the first, and once the second mirrors it, times each value
+# published at the origin until a subscriber of the mirror has it. (What
+# federation does is checked by tests/test_federation.py.)
+#
+#   python benchmarks/federation.py --values 100
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aiocoap
+
+from pubsub import PubSubClient, PubSubError
+
+BROKER = os.path.join(os.path.dirname(__file__), "..", "broker.py")
+
+
+async def _wait_for(condition, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = await condition()
+        except (PubSubError, aiocoap.error.Error):
+            result = None
+        if result:
+            return result
+        if time.monotonic() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.1)
+
+
+async def _named(ps: PubSubClient, name: str) -> list[dict]:
+    links = await ps.fetch(values={"topic-name": name})
+    return [await ps.config(path) for path in links_of(links)]
+
+
+def links_of(links: str) -> list[str]:
+    return [link.split(">")[0].lstrip("<") for link in links.split(",") if link]
+
+
+async def _measure(a_uri: str, b_uri: str, args) -> dict:
+    async with PubSubClient(a_uri) as a, PubSubClient(b_uri) as b:
+        await _wait_for(lambda: _up(a), 10, "broker A")
+        await _wait_for(lambda: _up(b), 10, "broker B")
+        topic_a, on_a = await a.create({"topic-name": "site-a/temperature"})
+        await a.publish(on_a["topic-data"], b"%08d" % 0)
+
+        async def mirrored():
+            return [c for c in await _named(b, "site-a/temperature") if "origin" in c]
+
+        mirror = (await _wait_for(mirrored, 10, "the mirror of A's topic on B"))[0]
+
+        latencies = []
+        received = asyncio.Queue()
+
+        async def observe() -> None:
+            async for notification in b.subscribe(mirror["topic-data"]):
+                received.put_nowait((bytes(notification.payload), time.perf_counter()))
+
+        observer = asyncio.create_task(observe())
+        try:
+            while (await received.get())[0] != b"%08d" % 0:
+                pass
+            for seq in range(1, args.values + 1):
+                sent = time.perf_counter()
+                await a.publish(on_a["topic-data"], b"%08d" % seq)
+                while True:
+                    payload, at = await asyncio.wait_for(received.get(), 5)
+                    if payload == b"%08d" % seq:
+                        break
+                latencies.append(at - sent)
+        finally:
+            observer.cancel()
+            await asyncio.gather(observer, return_exceptions=True)
+        await a.delete(topic_a)
+
+    latencies.sort()
+    return {
+        "values": len(latencies),
+        "median_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def _up(ps: PubSubClient) -> bool:
+    await ps.topics()
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Publish-to-notification latency across two federated brokers")
+    parser.add_argument("--values", type=int, default=100)
+    parser.add_argument("--peer-interval", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=56860)
+    args = parser.parse_args()
+
+    ports = (args.port, args.port + 10)
+    uris = [f"coap://127.0.0.1:{port}" for port in ports]
+    brokers = [
+        subprocess.Popen(
+            [sys.executable, BROKER, "--host", "127.0.0.1", "--port", str(port),
+             "--peer", peer, "--peer-interval", str(args.peer_interval)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for port, peer in zip(ports, reversed(uris))
+    ]
+    try:
+        result = asyncio.run(_measure(*uris, args))
+    finally:
+        for broker in brokers:
+            broker.terminate()
+            broker.wait()
+    print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
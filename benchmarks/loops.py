@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+# Publish and fan-out throughput versus event loop and socket options.
+#
+# Each configuration is LOOP[:BATCH] (an --loop choice and, optionally, a
+# --recv-batch value). For each, starts `broker.py` on a scratch port and
+# measures:
+#
+#   publish  several client processes publish to a set of topics as fast as
+#            a bounded number of in-flight requests allows
+#   fan-out  one topic with a number of observers; values are published one
+#            at a time, each once every observer has it (or --settle passed)
+#
+# and reports the rates alongside the broker's CPU time per operation (from
+# /proc, so Linux only). --rcvbuf and --sndbuf are passed to every broker.
+#
+#   python benchmarks/loops.py --configs asyncio uvloop asyncio:16 uvloop:16
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aiocoap
+from aiocoap import Message
+
+from codec import CT_PUBSUB_CBOR, decode_topic_payload, encode_topic_config
+from pubsub import PubSubClient
+
+BROKER = os.path.join(os.path.dirname(__file__), "..", "broker.py")
+
+
+def _cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def _create_topics(uri: str, count: int) -> list[str]:
+    ctx = await aiocoap.Context.create_client_context()
+    data_paths = []
+    try:
+        for i in range(count):
+            msg = Message(code=aiocoap.POST, uri=f"{uri}/ps",
+                          payload=encode_topic_config({"topic-name": f"bench-{i}"}))
+            msg.opt.content_format = CT_PUBSUB_CBOR
+            r = await ctx.request(msg).response
+            data_paths.append(decode_topic_payload(r.payload, CT_PUBSUB_CBOR)["topic-data"])
+    finally:
+        await ctx.shutdown()
+    return data_paths
+
+
+async def _publish(uri: str, data_paths: list[str], messages: int, inflight: int) -> int:
+    ctx = await aiocoap.Context.create_client_context()
+    sem = asyncio.Semaphore(inflight)
+    ok = 0
+
+    async def one(i: int) -> None:
+        nonlocal ok
+        async with sem:
+            msg = Message(code=aiocoap.PUT, uri=f"{uri}/{data_paths[i % len(data_paths)]}",
+                          payload=b"%d" % i)
+            r = await ctx.request(msg).response
+            ok += r.code.is_successful()
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(messages)))
+    finally:
+        await ctx.shutdown()
+    return ok
+
+
+def _client(args: tuple) -> int:
+    return asyncio.run(_publish(*args))
+
+
+async def _wait_for_broker(uri: str, timeout: float = 10.0) -> None:
+    async with PubSubClient(uri) as ps:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await asyncio.wait_for(ps.topics(), 1.0)
+                return
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+def _publish_rate(pid: int, uri: str, args) -> dict:
+    data_paths = asyncio.run(_create_topics(uri, args.topics))
+    jobs = [(uri, data_paths, args.messages, args.inflight)] * args.clients
+    with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+        cpu_before = _cpu_seconds(pid)
+        start = time.perf_counter()
+        ok = sum(pool.map(_client, jobs))
+        elapsed = time.perf_counter() - start
+        cpu = _cpu_seconds(pid) - cpu_before
+    return {
+        "publishes": ok,
+        "publishes_per_s": round(ok / elapsed, 1),
+        "broker_cpu_us_per_publish": round(cpu / max(ok, 1) * 1e6, 1),
+    }
+
+
+async def _fanout_rate(pid: int, uri: str, args) -> dict:
+    async with PubSubClient(uri, inflight=args.observers) as ps:
+        _, config = await ps.create({"topic-name": "fanout"})
+        data = config["topic-data"]
+        await ps.publish(data, b"%08d" % 0)
+
+        received = 0
+        delivered = asyncio.Event()
+        expected = 0
+
+        async def observe() -> None:
+            nonlocal received
+            async for _, notification in ps.subscribe_many([data] * args.observers):
+                if notification is None or isinstance(notification, Exception):
+                    raise RuntimeError(f"observation ended: {notification!r}")
+                if int(bytes(notification.payload[:8])) == expected:
+                    received += 1
+                    if received == args.observers:
+                        delivered.set()
+
+        observers = asyncio.create_task(observe())
+        try:
+            await asyncio.wait_for(delivered.wait(), 60)
+            cpu_before = _cpu_seconds(pid)
+            start = time.perf_counter()
+            total = 0
+            for seq in range(1, args.values + 1):
+                expected, received = seq, 0
+                delivered.clear()
+                await ps.publish(data, b"%08d" % seq)
+                try:
+                    await asyncio.wait_for(delivered.wait(), args.settle)
+                except asyncio.TimeoutError:
+                    pass
+                total += received
+            elapsed = time.perf_counter() - start
+            cpu = _cpu_seconds(pid) - cpu_before
+        finally:
+            observers.cancel()
+            await asyncio.gather(observers, return_exceptions=True)
+    return {
+        "notifications": total,
+        "notifications_per_s": round(total / elapsed, 1),
+        "broker_cpu_us_per_notification": round(cpu / max(total, 1) * 1e6, 1),
+    }
+
+
+def run(config: str, args) -> dict:
+    loop, _, batch = config.partition(":")
+    command = [sys.executable, BROKER, "--host", "127.0.0.1", "--port", str(args.port),
+               "--loop", loop, "--recv-batch", batch or "1"]
+    if args.rcvbuf:
+        command += ["--rcvbuf", str(args.rcvbuf)]
+    if args.sndbuf:
+        command += ["--sndbuf", str(args.sndbuf)]
+    uri = f"coap://127.0.0.1:{args.port}"
+    broker = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(_wait_for_broker(uri))
+        result = {"loop": loop, "recv_batch": int(batch or 1)}
+        result.update(_publish_rate(broker.pid, uri, args))
+        result.update(asyncio.run(_fanout_rate(broker.pid, uri, args)))
+        return result
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Publish and fan-out throughput versus event loop and socket options")
+    parser.add_argument("--configs", nargs="+", default=["asyncio", "uvloop"],
+                        metavar="LOOP[:BATCH]")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000, help="Publishes per client")
+    parser.add_argument("--inflight", type=int, default=16, help="Concurrent requests per client")
+    parser.add_argument("--topics", type=int, default=64)
+    parser.add_argument("--observers", type=int, default=50)
+    parser.add_argument("--values", type=int, default=200, help="Values published for fan-out")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="Seconds to wait for a value to reach every observer")
+    parser.add_argument("--rcvbuf", type=int)
+    parser.add_argument("--sndbuf", type=int)
+    parser.add_argument("--port", type=int, default=56850)
+    args = parser.parse_args()
+
+    for config in args.configs:
+        print(json.dumps(run(config, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
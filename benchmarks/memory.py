@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Memory per topic benchmark.
+#
+# Creates topics in-process, as a POST to /ps would (config with
+# topic-type and topic-content-format, initialized with a small value),
+# and reports the Python heap they take, traced with tracemalloc, divided
+# by the topic count. No topic is observed, so no observation state is
+# allocated.
+#
+#   python benchmarks/memory.py --topics 100000 1000000
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from broker import CollectionResource
+
+
+def _measure(count: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    collection = CollectionResource()
+    for i in range(count):
+        collection._create({
+            "topic-name": f"topic-{i}",
+            "topic-type": "sensor",
+            "topic-content-format": 60,
+            "initialize": b'{"v":20.0}',
+        })
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(collection.topics) == count
+    return {
+        "topics": count,
+        "bytes": used,
+        "bytes_per_topic": round(used / count),
+        "create_s": round(elapsed, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Heap bytes per topic")
+    parser.add_argument("--topics", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+    for count in args.topics:
+        print(json.dumps(_measure(count)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Restart-time benchmark for the durable topic store.
+#
+# For each topic count, writes a snapshot plus a journal tail (one publish
+# for every tenth topic) and times how long the broker takes to rebuild its
+# CollectionResource from them.
+#
+#   python benchmarks/restart.py --topics 1000 10000 100000
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from broker import CollectionResource
+from store import TopicStore
+
+
+def _populate(data_dir: str, count: int) -> None:
+    store = TopicStore(data_dir, fsync="never")
+    store.load()
+    topics = []
+    for i in range(count):
+        config = {
+            "topic-name": f"topic-{i}",
+            "topic-data": f"ps/data/{i:06x}",
+            "resource-type": "core.ps.conf",
+            "topic-type": "sensor",
+            "topic-content-format": 60,
+            "observer-check": 86400,
+        }
+        topics.append([f"ps/{i:06x}", config, b'{"v":20.0}', 60])
+    store.write_snapshot(store.begin_snapshot(), topics)
+    for i in range(0, count, 10):
+        store.append("publish", f"ps/data/{i:06x}", b'{"v":21.5}', 60)
+    store.close()
+
+
+def _restart(data_dir: str) -> tuple[float, float, int]:
+    t0 = time.perf_counter()
+    store = TopicStore(data_dir, fsync="never")
+    snapshot, tail = store.load()
+    t1 = time.perf_counter()
+    collection = CollectionResource()
+    collection.restore(snapshot, tail)
+    t2 = time.perf_counter()
+    store.close()
+    return t1 - t0, t2 - t1, len(collection.topics)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Restart time versus topic count")
+    parser.add_argument("--topics", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    for count in args.topics:
+        with tempfile.TemporaryDirectory() as data_dir:
+            _populate(data_dir, count)
+            load_s, restore_s, restored = _restart(data_dir)
+            size = sum(
+                os.path.getsize(os.path.join(data_dir, n)) for n in os.listdir(data_dir)
+            )
+        print(json.dumps({
+            "topics": count,
+            "restored": restored,
+            "bytes_on_disk": size,
+            "load_s": round(load_s, 4),
+            "restore_s": round(restore_s, 4),
+            "total_s": round(load_s + restore_s, 4),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Publish throughput versus broker worker count.
+#
+# For each worker count, starts `broker.py --workers N` on a scratch port,
+# creates a set of topics, then runs several client processes that publish
+# to those topics as fast as a bounded number of in-flight requests allows.
+# Every client process has its own socket, so SO_REUSEPORT spreads them
+# over the workers.
+#
+#   python benchmarks/workers.py --workers 1 2 4 --clients 8
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aiocoap
+from aiocoap import Message
+
+from codec import CT_PUBSUB_CBOR, decode_topic_payload, encode_topic_config
+
+BROKER = os.path.join(os.path.dirname(__file__), "..", "broker.py")
+
+
+async def _create_topics(uri: str, count: int) -> list[str]:
+    ctx = await aiocoap.Context.create_client_context()
+    data_paths = []
+    try:
+        for i in range(count):
+            msg = Message(code=aiocoap.POST, uri=f"{uri}/ps",
+                          payload=encode_topic_config({"topic-name": f"bench-{i}"}))
+            msg.opt.content_format = CT_PUBSUB_CBOR
+            r = await ctx.request(msg).response
+            data_paths.append(decode_topic_payload(r.payload, CT_PUBSUB_CBOR)["topic-data"])
+    finally:
+        await ctx.shutdown()
+    return data_paths
+
+
+async def _publish(uri: str, data_paths: list[str], messages: int, inflight: int) -> int:
+    ctx = await aiocoap.Context.create_client_context()
+    sem = asyncio.Semaphore(inflight)
+    ok = 0
+
+    async def one(i: int) -> None:
+        nonlocal ok
+        async with sem:
+            msg = Message(code=aiocoap.PUT, uri=f"{uri}/{data_paths[i % len(data_paths)]}",
+                          payload=b"%d" % i)
+            r = await ctx.request(msg).response
+            ok += r.code.is_successful()
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(messages)))
+    finally:
+        await ctx.shutdown()
+    return ok
+
+
+def _client(args: tuple) -> int:
+    return asyncio.run(_publish(*args))
+
+
+def _wait_for_broker(uri: str, timeout: float = 10.0) -> None:
+    async def probe() -> None:
+        ctx = await aiocoap.Context.create_client_context()
+        try:
+            await asyncio.wait_for(
+                ctx.request(Message(code=aiocoap.GET, uri=f"{uri}/ps")).response, 1.0)
+        finally:
+            await ctx.shutdown()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            asyncio.run(probe())
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def run(workers: int, args) -> dict:
+    uri = f"coap://127.0.0.1:{args.port}"
+    broker = subprocess.Popen(
+        [sys.executable, BROKER, "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(workers)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for_broker(uri)
+        data_paths = asyncio.run(_create_topics(uri, args.topics))
+        jobs = [(uri, data_paths, args.messages, args.inflight)] * args.clients
+        with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+            start = time.perf_counter()
+            ok = sum(pool.map(_client, jobs))
+            elapsed = time.perf_counter() - start
+    finally:
+        broker.terminate()
+        broker.wait()
+    return {
+        "workers": workers,
+        "clients": args.clients,
+        "publishes": ok,
+        "seconds": round(elapsed, 3),
+        "publishes_per_s": round(ok / elapsed, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Publish throughput versus worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--messages", type=int, default=2000, help="Publishes per client")
+    parser.add_argument("--inflight", type=int, default=16, help="Concurrent requests per client")
+    parser.add_argument("--topics", type=int, default=64)
+    parser.add_argument("--port", type=int, default=56830)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        print(json.dumps(run(workers, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,69 +4,718 @@
 # Jaime Jiménez <jaimejim@gmail.com>
 # Built on aiocoap by Christian Amsüss
 
+import abc
 import argparse
 import asyncio
+import heapq
+import json
 import logging
+import os
 import secrets
+import signal
+import time
 
 import aiocoap
 import aiocoap.resource as resource
 import cbor2
 from aiocoap import Message
+from aiocoap.optiontypes import BlockOption
+from aiocoap.util.linkformat import Link
 
+from aggregate import CollectionSubscriptions
+from backpressure import (
+    CATCH_UP_INTERVAL, DEFAULT_SLOW_THRESHOLD, SLOW_CONSUMER_POLICIES, SlowConsumers,
+)
+from federation import DEFAULT_PEER_INTERVAL, Federation
+from history import CT_CBOR_SEQ, HistoryBudget, HistoryRing, encode_entries
+from logconfig import LOG_FORMATS, configure_logging, parse_level, parse_sample
+from metrics import Metrics, profiled, prometheus_text, serve_http, timed
+from profiling import DEFAULT_SAMPLE_INTERVAL, PROFILE_MODES, Profiler
+from ratelimit import LIMITED, Admission, parse_rate
+from store import FSYNC_POLICIES, TopicStore
+from tuning import LOOPS, loop_factory, run as run_loop, tune_context
+from workers import ShardRouter, run_workers
 from codec import (
     TOPIC_KEYS, TOPIC_KEYS_REV,
-    CT_PUBSUB_CBOR, CT_LINK_FORMAT,
+    CT_PUBSUB_CBOR, CT_LINK_FORMAT, CT_JSON, CT_CBOR,
     IMMUTABLE_FIELDS,
-    decode_topic_payload, encode_topic_config,
+    decode_topic_list, decode_topic_payload, is_topic_list,
+    encode_cbor_array, encode_created, encode_topic_config,
 )
 
+log = logging.getLogger("pubsub-broker")
+
 
 # ---------------------------------------------------------------------------
-# CollectionResource  (/ps)
+# Config validation
 # ---------------------------------------------------------------------------
 
-class CollectionResource(resource.Resource):
+# Most values a topic's history-depth may ask the broker to keep
+MAX_HISTORY_DEPTH = 4096
+
+# Properties a configuration update cannot change; origin is set by the
+# broker on the topics it mirrors (see federation)
+FIXED_FIELDS = IMMUTABLE_FIELDS | {"origin"}
+
+# Broker extension properties, the value types they accept and their maximum
+EXTENSION_FIELDS: dict[str, tuple[tuple[type, ...], float | None]] = {
+    "notify-interval": ((int, float), None),
+    "history-depth":   ((int,), MAX_HISTORY_DEPTH),
+    "suppress-duplicates": ((bool,), None),
+}
+
+
+# Every property whose type the broker relies on: the draft's numeric ones
+# (expiration-date is encoded as a CBOR epoch tag, the others drive
+# observation) and the extensions
+CHECKED_FIELDS = {
+    "expiration-date": ((int, float), None),
+    "max-subscribers": ((int,), None),
+    "observer-check":  ((int, float), None),
+    **EXTENSION_FIELDS,
+}
+
+
+def validate_fields(data: dict) -> str | None:
+    """Return an error message if a property of CHECKED_FIELDS has a bad value."""
+    for name, (types, maximum) in CHECKED_FIELDS.items():
+        value = data.get(name)
+        if value is None:
+            continue
+        if types == (bool,):
+            if not isinstance(value, bool):
+                return f"{name} must be true or false"
+            continue
+        if isinstance(value, bool) or not isinstance(value, types) or value < 0:
+            kind = "integer" if types == (int,) else "number"
+            return f"{name} must be a non-negative {kind}"
+        if maximum is not None and value > maximum:
+            return f"{name} must not exceed {maximum}"
+    return None
 
-    def __init__(self, root):
-        super().__init__()
-        self.root = root
-        self.rt = "core.ps.coll"
-        self._links: list[str] = []   # list of link strings
 
-    def get_topic_resources(self) -> dict:
-        return {
-            path: res
-            for path, res in self.root._resources.items()
-            if isinstance(res, TopicResource)
+# ---------------------------------------------------------------------------
+# Block2 helper
+# ---------------------------------------------------------------------------
+
+def block2_slice(request, response: Message) -> Message:
+    """Cut the block asked for in *request* out of a complete *response*.
+
+    Used by resources that keep their full representation cached and opt out
+    of aiocoap's blockwise assembly, so every block is a slice of the cached
+    bytes instead of a fresh rendering. The block's payload is a memoryview
+    of those bytes: nothing is copied until the message is encoded. Responses
+    that fit in one message and were not asked for blockwise are returned
+    unchanged.
+    """
+    payload = response.payload
+    block2 = request.opt.block2
+    if block2 is None:
+        if len(payload) <= request.remote.maximum_payload_size:
+            return response
+        block2 = BlockOption.BlockwiseTuple(
+            0, False, request.remote.maximum_block_size_exp,
+        )
+    if block2.size_exponent == 7:
+        start = block2.block_number * 1024
+        size = 1024 * (request.remote.maximum_payload_size // 1024)
+    else:
+        start = block2.start
+        size = block2.size
+    if start >= len(payload) and start > 0:
+        return Message(code=aiocoap.BAD_REQUEST, payload=b"Block request out of bounds")
+
+    end = min(start + size, len(payload))
+    response.payload = memoryview(payload)[start:end]
+    response.opt.block2 = (block2.block_number, end < len(payload), block2.size_exponent)
+    return response
+
+
+def first_block(response: Message, size_exponent: int = 6) -> Message:
+    """Block 0 of a *response* rendered without a request to size it by
+    (observer-check notifications); the observer fetches the rest."""
+    payload = response.payload
+    size = 2 ** (size_exponent + 4)
+    if len(payload) > size:
+        response.payload = memoryview(payload)[:size]
+        response.opt.block2 = (0, True, size_exponent)
+    return response
+
+
+# ---------------------------------------------------------------------------
+# TopicRegistry
+# ---------------------------------------------------------------------------
+
+# Properties with a value index; FETCH value filters on other properties are
+# checked against the (already narrowed) candidate topics.
+INDEXED_FIELDS = ("topic-name", "topic-type", "topic-content-format")
+
+
+class TopicRegistry:
+    """Topics of a collection, keyed by config path, with secondary indexes.
+
+    Presence of every optional property is indexed, and the values of
+    INDEXED_FIELDS are indexed by their string form (which is how FETCH
+    compares them). Index buckets are dicts used as insertion-ordered sets,
+    except that a value held by a single topic (as most topic-names are)
+    has a 1-tuple bucket instead of a dict of its own.
+    """
+
+    def __init__(self):
+        self._topics: dict[str, "TopicResource"] = {}
+        self._data: dict[str, "TopicDataResource"] = {}
+        self._present: dict[str, dict[str, None]] = {}
+        self._values: dict[str, dict[str, dict[str, None] | tuple[str]]] = {
+            name: {} for name in INDEXED_FIELDS
+        }
+
+    def __len__(self) -> int:
+        return len(self._topics)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._topics
+
+    def __iter__(self):
+        return iter(self._topics)
+
+    def get(self, path: str) -> "TopicResource | None":
+        return self._topics.get(path)
+
+    def items(self):
+        return self._topics.items()
+
+    def data(self, data_path: str) -> "TopicDataResource | None":
+        return self._data.get(data_path)
+
+    def add(self, path: str, topic: "TopicResource", data: "TopicDataResource") -> None:
+        self._topics[path] = topic
+        self._data[topic.config["topic-data"]] = data
+        self._index(path, topic.config)
+
+    def remove(self, path: str) -> "TopicResource | None":
+        topic = self._topics.pop(path, None)
+        if topic is not None:
+            self._data.pop(topic.config["topic-data"], None)
+            self._unindex(path, topic.config)
+        return topic
+
+    def reindex(self, path: str, old_config: dict, new_config: dict) -> None:
+        """Move *path* between index buckets after a config change."""
+        self._unindex(path, old_config)
+        self._index(path, new_config)
+
+    def _index(self, path: str, config: dict) -> None:
+        for name, value in config.items():
+            if name not in IMMUTABLE_FIELDS:
+                self._present.setdefault(name, {})[path] = None
+            values = self._values.get(name)
+            if values is not None:
+                key = str(value)
+                bucket = values.get(key)
+                if bucket is None:
+                    values[key] = (path,)
+                elif type(bucket) is tuple:
+                    values[key] = dict.fromkeys((*bucket, path))
+                else:
+                    bucket[path] = None
+
+    def _unindex(self, path: str, config: dict) -> None:
+        for name, value in config.items():
+            if name not in IMMUTABLE_FIELDS:
+                bucket = self._present.get(name)
+                if bucket is not None:
+                    bucket.pop(path, None)
+                    if not bucket:
+                        del self._present[name]
+            values = self._values.get(name)
+            if values is not None:
+                key = str(value)
+                bucket = values.get(key)
+                if type(bucket) is tuple:
+                    if bucket == (path,):
+                        del values[key]
+                elif bucket is not None:
+                    bucket.pop(path, None)
+                    if not bucket:
+                        del values[key]
+
+    def match(self, names: list[str], values: dict[str, object]) -> list[str]:
+        """Config paths of topics having all *names* and all *values*.
+
+        Every filter that an index can answer narrows the candidate set;
+        only value filters on unindexed properties are checked per topic.
+        """
+        candidates: list[dict[str, None] | tuple[str]] = []
+        for name in set(names) | set(values):
+            if name in values and name in self._values:
+                candidates.append(self._values[name].get(str(values[name]), {}))
+            elif name not in IMMUTABLE_FIELDS:
+                candidates.append(self._present.get(name, {}))
+        unindexed = {
+            n: str(v) for n, v in values.items() if n not in self._values
         }
 
-    def add_link(self, path: str) -> None:
-        link = f'</{path}>;rt="core.ps.conf"'
-        if link not in self._links:
-            self._links.append(link)
+        if not candidates:
+            candidates.append(self._topics)
+        candidates.sort(key=len)
+        smallest, rest = candidates[0], candidates[1:]
+
+        matching: list[str] = []
+        for path in smallest:
+            if not all(path in c for c in rest):
+                continue
+            if unindexed:
+                config = self._topics[path].config
+                if not all(
+                    n in config and str(config[n]) == v
+                    for n, v in unindexed.items()
+                ):
+                    continue
+            matching.append(path)
+        return matching
+
+
+# ---------------------------------------------------------------------------
+# Deadline schedulers
+# ---------------------------------------------------------------------------
+
+# Topics handled per loop iteration, so a burst of deadlines doesn't stall serving
+DEADLINE_BATCH = 512
+
+# How long a confirmable notification may go unacknowledged before aiocoap
+# gives up on its recipient (RFC 7252 MAX_TRANSMIT_WAIT)
+MAX_TRANSMIT_WAIT = aiocoap.Reliable().MAX_TRANSMIT_WAIT
+
+
+class DeadlineScheduler(abc.ABC):
+    """Per-topic deadlines driving one timer.
+
+    Deadlines live in a min-heap with lazy deletion: rescheduling or
+    cancelling only updates ``_deadlines``, and heap entries that no longer
+    match it are skipped when popped. One timer is armed for the earliest
+    deadline; subclasses say what happens when a topic's deadline passes.
+    """
+
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, collection: "CollectionResource"):
+        self.collection = collection
+        self._heap: list[tuple[float, str]] = []
+        self._deadlines: dict[str, float] = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._deadlines
+
+    def schedule_at(self, path: str, when: float) -> None:
+        if self._deadlines.get(path) == when:
+            return
+        self._deadlines[path] = when
+        heapq.heappush(self._heap, (when, path))
+        if self._heap[0][1] == path:
+            self.arm()
+
+    def cancel(self, path: str) -> None:
+        self._deadlines.pop(path, None)
+
+    def _drop_stale(self) -> None:
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def arm(self) -> None:
+        """Set the timer for the earliest deadline (no-op without a loop)."""
+        self._drop_stale()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._heap:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        delay = max(0.0, self._heap[0][0] - self.clock())
+        self._timer = loop.call_later(delay, self._run)
+
+    def _run(self) -> None:
+        self._timer = None
+        now = self.clock()
+        heap = self._heap
+        handled = 0
+        while heap and handled < DEADLINE_BATCH:
+            when, path = heap[0]
+            if self._deadlines.get(path) != when:
+                heapq.heappop(heap)
+                continue
+            if when > now:
+                break
+            heapq.heappop(heap)
+            del self._deadlines[path]
+            topic = self.collection.topics.get(path)
+            if topic is not None:
+                self.fire(path, topic)
+                handled += 1
+        if handled:
+            self.ran(handled)
+        self.arm()
+
+    @abc.abstractmethod
+    def fire(self, path: str, topic: "TopicResource") -> None:
+        """Act on *topic*, whose deadline has passed."""
+
+    def ran(self, handled: int) -> None:
+        """Called after a batch of *handled* topics."""
+
+
+class ExpiryScheduler(DeadlineScheduler):
+    """Removes topics once their expiration-date (epoch seconds) has passed."""
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, collection: "CollectionResource"):
+        super().__init__(collection)
+        self.expired = 0
+
+    def schedule(self, path: str, expiration) -> None:
+        """(Re)schedule *path*; a missing or non-numeric date cancels expiry."""
+        try:
+            when = float(expiration)
+        except (TypeError, ValueError):
+            self.cancel(path)
+            return
+        self.schedule_at(path, when)
+
+    def fire(self, path: str, topic: "TopicResource") -> None:
+        topic.destroy(b"Topic expired")
+
+    def ran(self, handled: int) -> None:
+        self.expired += handled
+        log.info("Expired %d topics", handled)
+
+
+class ObserverCheckScheduler(DeadlineScheduler):
+    """Sends each observed topic's observers a confirmable notification
+    every observer-check seconds.
 
-    def remove_link(self, path: str) -> None:
-        link = f'</{path}>;rt="core.ps.conf"'
-        self._links = [l for l in self._links if l != link]
+    Only topics with observers are scheduled. aiocoap ends an observation
+    whose notification is not acknowledged (or is answered with a Reset),
+    which is what drops dead observers from the fan-out; the topic counts
+    observations that end while a check is outstanding as pruned.
+    """
+
+    def __init__(self, collection: "CollectionResource"):
+        super().__init__(collection)
+        self.pruned = 0
+
+    def watch(self, path: str, interval: float) -> None:
+        """Schedule *path*'s next check unless one is already due."""
+        if path not in self:
+            self.schedule_at(path, self.clock() + interval)
+
+    def reschedule(self, path: str, interval: float) -> None:
+        if path in self:
+            self.schedule_at(path, self.clock() + interval)
+
+    def fire(self, path: str, topic: "TopicResource") -> None:
+        if topic.check_observers():
+            self.schedule_at(path, self.clock() + topic.observer_check)
+
+
+# ---------------------------------------------------------------------------
+# CollectionResource  (/ps)
+# ---------------------------------------------------------------------------
+
+# Payload bytes all topic histories together may hold (--history-budget)
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024
+
+# Most topics one array POST to the collection may create
+BULK_CREATE_LIMIT = 10000
+
+# Largest value a topic-data resource accepts (--max-payload)
+DEFAULT_MAX_PAYLOAD = 1024 * 1024
+
+# Max-Age of the 5.03 refusing a topic over --max-topics
+TOPIC_CAP_RETRY = 60
+
+
+def _bulk_error(response: Message) -> bytes:
+    return cbor2.dumps({
+        "error": response.code.dotted,
+        "message": response.payload.decode("utf-8", errors="replace"),
+    })
+
+
+def too_large(limit: int) -> Message:
+    """4.13 for a value over *limit* bytes, with the limit in Size1 (RFC 7959 §4)."""
+    response = Message(code=aiocoap.REQUEST_ENTITY_TOO_LARGE,
+                       payload=f"values are limited to {limit} bytes".encode())
+    response.opt.size1 = limit
+    return response
+
+
+def mirror_refused() -> Message:
+    """4.05 for a change to a mirrored topic, which only its origin makes."""
+    return Message(code=aiocoap.METHOD_NOT_ALLOWED,
+                   payload=b"Mirrored topic: change it at its origin")
+
+
+def body_size(request) -> int:
+    """Bytes of a request body received so far (up to the end of this
+    Block1 block), or the total announced in Size1 if that is more."""
+    size = len(request.payload)
+    block1 = request.opt.block1
+    if block1 is not None and size <= block1.size:
+        # A single block, not yet assembled with the ones before it
+        size += block1.start
+    size1 = request.opt.size1
+    return max(size, size1) if size1 is not None else size
+
+
+def request_kind(request) -> str | None:
+    """Rate-limited class of a request (publish, create or fetch), if any.
+    Only the first block of a blockwise exchange counts."""
+    for block in (request.opt.block1, request.opt.block2):
+        if block is not None and block.block_number:
+            return None
+    code, path = request.code, request.opt.uri_path
+    if code == aiocoap.PUT:
+        return "publish"
+    if code == aiocoap.POST and path == ("ps", ".publish"):
+        return "publish"
+    if path == ("ps",):
+        if code == aiocoap.POST:
+            return "create"
+        if code == aiocoap.FETCH:
+            return "fetch"
+    return None
+
+
+def _as_bytes(value) -> bytes:
+    """An ``initialize`` value as the bytes it publishes."""
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class CollectionResource(resource.Resource, aiocoap.interfaces.ObservableResource):
+
+    def __init__(self):
+        super().__init__()
+        self.rt = "core.ps.coll"
+        self._link_cache: bytes | None = None
+        self._link_version = 0
+        self.etag_epoch = secrets.token_bytes(2)   # keeps ETags unique across restarts
+        self.topics = TopicRegistry()
+        self.store = None   # TopicStore, when the broker runs with --data-dir
+        self.shard = None   # workers.Shard, when the broker runs with --workers
+        self.notify_interval = 0.0   # default for topics without notify-interval
+        self.history_budget = HistoryBudget(DEFAULT_HISTORY_BUDGET)
+        self.max_payload = DEFAULT_MAX_PAYLOAD
+        self.slow_consumers = SlowConsumers()
+        self.admission = Admission()
+        self.max_topics: int | None = None
+        self.topics_refused = 0
+        self.federation = None   # federation.Federation, when the broker has --peer
+        self.subscriptions = CollectionSubscriptions()   # FETCH + Observe on /ps
+        self.expiry = ExpiryScheduler(self)
+        self.observer_checks = ObserverCheckScheduler(self)
+        self.metrics = Metrics()
+
+    def charge(self, kind: str, request, n: int = 1) -> Message | None:
+        """4.29 if *request*'s client is over its *kind* rate limit after
+        *n* more; requests a sibling worker forwards were charged there."""
+        if self.shard is not None and self.shard.is_sibling(request.remote):
+            return None
+        return self.admission.check(kind, request.remote, n)
+
+    def charge_rest(self, kind: str, request, n: int) -> Message | None:
+        """Charge a request for *n* topics, one of which it paid at admission;
+        when it is refused, that one is given back. More than a full bucket
+        is refused with 4.13."""
+        if self.shard is not None and self.shard.is_sibling(request.remote):
+            return None
+        rejection = self.admission.too_many(kind, n) or self.charge(kind, request, n - 1)
+        if rejection is not None:
+            self.admission.refund(kind, request.remote)
+        return rejection
+
+    def admit(self, request) -> Message | None:
+        """Admission control for any incoming request, before it is decoded."""
+        kind = request_kind(request)
+        return self.charge(kind, request) if kind is not None else None
+
+    def _links_changed(self) -> None:
+        self._link_cache = None
+        self._link_version += 1
 
     @property
     def _link_payload(self) -> bytes:
-        return ",".join(self._links).encode("utf-8")
+        # Built from the registry when asked for, so topics carry no link of their own
+        if self._link_cache is None:
+            self._link_cache = ",".join(
+                f'</{path}>;rt="core.ps.conf"' for path in self.topics
+            ).encode("utf-8")
+        return self._link_cache
 
-    async def render_post(self, request):
-        ct = request.opt.content_format
-        try:
-            data = decode_topic_payload(request.payload, ct)
-        except Exception as e:
-            return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
+    @property
+    def _link_etag(self) -> bytes:
+        return self.etag_epoch + self._link_version.to_bytes(6, "big")
 
+    async def needs_blockwise_assembly(self, request):
+        # GET blocks are sliced straight out of the cached listing
+        return request.code != aiocoap.GET
+
+    def install_topic(self, topic_config_path: str, config: dict):
+        """Create the topic and topic-data resources for *config*; the
+        TopicDispatcher serves them from the registry."""
+        topic_res = TopicResource(config, topic_config_path, collection=self)
+        topic_data_res = TopicDataResource(
+            content_format=config.get("topic-content-format"),
+            path=config["topic-data"],
+            collection=self,
+        )
+        topic_data_res.topic = topic_res
+        topic_data_res.set_history_depth(topic_res.config.get("history-depth") or 0)
+        self.topics.add(topic_config_path, topic_res, topic_data_res)
+        self.subscriptions.topic_added(topic_res.config, topic_data_res)
+        self._links_changed()
+        self.expiry.schedule(topic_config_path, topic_res.config.get("expiration-date"))
+        return topic_res, topic_data_res
+
+    def metrics_report(self) -> dict:
+        """Current metrics; topic state and observer counts are gathered here."""
+        half = 0
+        observers = {}
+        for path, topic in self.topics.items():
+            data_res = self.topics.data(topic.config["topic-data"])
+            if data_res is None or not data_res.is_fully_created:
+                half += 1
+            data_observers = data_res.observer_count if data_res is not None else 0
+            if topic.observer_count or data_observers:
+                observers[path] = {"config": topic.observer_count, "data": data_observers}
+        metrics = self.metrics
+        return {
+            "uptime": round(time.monotonic() - metrics.started, 3),
+            "topics": {"half": half, "full": len(self.topics) - half},
+            "observers": observers,
+            "counters": {
+                "publishes": metrics.publishes,
+                "publishes_suppressed": metrics.publishes_suppressed,
+                "notifications": metrics.notifications,
+                "subscriptions_rejected": metrics.subscriptions_rejected,
+                "observers_pruned": self.observer_checks.pruned,
+                "topics_expired": self.expiry.expired,
+                "notifications_dropped": self.slow_consumers.dropped,
+                "notifications_conflated": self.slow_consumers.conflated,
+                "observers_deregistered": self.slow_consumers.deregistered,
+                "requests_rate_limited": self.admission.rejected,
+                "topics_refused": self.topics_refused,
+                "values_mirrored": self.federation.mirrored if self.federation is not None else 0,
+            },
+            "history_bytes": self.history_budget.used,
+            "rates": metrics.rates(),
+            "handlers": {
+                name: {"count": hist.count, "sum": hist.sum, "buckets": hist.cumulative()}
+                for name, hist in metrics.handlers.items()
+            },
+        }
+
+    def _new_path(self, prefix: str) -> str:
+        """An unused path under *prefix*, owned by this worker in --workers mode."""
+        while True:
+            path = f"{prefix}/{secrets.token_hex(3)}"
+            if path in self.topics or self.topics.data(path) is not None:
+                continue
+            if self.shard is None or self.shard.owns(path):
+                return path
+
+    def journal(self, op: str, *args) -> None:
+        if self.store is not None:
+            self.store.append(op, *args)
+
+    def dump_state(self) -> list[list]:
+        """Snapshot entries ``[config_path, config, value, content_format]``."""
+        state = []
+        for path, topic in self.topics.items():
+            data_res = self.topics.data(topic.config["topic-data"])
+            state.append([path, dict(topic.config), data_res._value, data_res._content_format])
+        return state
+
+    def restore(self, topics: list[list], journal: list[list]) -> None:
+        """Rebuild topics from a snapshot and replay the journal tail on top.
+
+        Nothing is journaled while restoring, and observers cannot exist yet,
+        so resource state is set directly instead of through the handlers.
+        """
+        for path, config, value, content_format in topics:
+            _, data_res = self.install_topic(path, config)
+            data_res._value = value
+            data_res._content_format = content_format
+
+        for seq, op, *args in journal:
+            if op == "create":
+                path, config = args
+                if path not in self.topics:
+                    self.install_topic(path, config)
+            elif op == "config":
+                path, config = args
+                topic = self.topics.get(path)
+                if topic is not None:
+                    old_config = topic.config
+                    topic.config = dict(config)
+                    topic._config_changed(old_config)
+            elif op == "delete":
+                topic = self.topics.get(args[0])
+                if topic is not None:
+                    topic.remove()
+            elif op in ("publish", "unpublish"):
+                data_res = self.topics.data(args[0])
+                if data_res is None:
+                    continue
+                if op == "publish":
+                    data_res._value, data_res._content_format = args[1], args[2]
+                else:
+                    data_res._value = None
+            else:
+                log.warning("Skipping unknown journal op %r (seq %d)", op, seq)
+
+    def _check(self, data: dict) -> Message | None:
+        """Error response for topic creation *data*, or None if acceptable."""
         if "topic-name" not in data:
             return Message(code=aiocoap.BAD_REQUEST, payload=b"topic-name required")
+        if "origin" in data:
+            return Message(code=aiocoap.BAD_REQUEST, payload=b"origin is set by the broker")
+        if self.max_topics is not None and len(self.topics) >= self.max_topics:
+            self.topics_refused += 1
+            response = Message(code=aiocoap.SERVICE_UNAVAILABLE,
+                               payload=b"topic limit reached")
+            response.opt.max_age = TOPIC_CAP_RETRY
+            return response
+        error = validate_fields(data)
+        if error:
+            return Message(code=aiocoap.BAD_REQUEST, payload=error.encode())
+        topic_data_path = data.get("topic-data")
+        if topic_data_path and self.topics.data(topic_data_path) is not None:
+            return Message(code=aiocoap.CONFLICT, payload=b"topic-data path already in use")
+        init_payload = data.get("initialize")
+        if init_payload is not None and len(_as_bytes(init_payload)) > self.max_payload:
+            return too_large(self.max_payload)
+        return None
 
+    def _foreign_owner(self, data: dict) -> int | None:
+        """The worker owning a client-chosen topic-data path, if not this one."""
+        if (
+            self.shard is not None
+            and data.get("topic-data")
+            and not self.shard.owns(data["topic-data"])
+        ):
+            return self.shard.owner(data["topic-data"])
+        return None
+
+    def _create(self, data: dict) -> tuple[str, "TopicResource"]:
+        """Create a topic from checked *data*; returns its config path."""
         # Build topic-data URI
-        topic_data_path = data.get("topic-data") or f"ps/data/{secrets.token_hex(3)}"
-        topic_config_path = f"ps/{secrets.token_hex(3)}"
+        topic_data_path = data.get("topic-data") or self._new_path("ps/data")
+        topic_config_path = self._new_path("ps")
 
         # Assemble config (draft-19 §5.2.1)
         config: dict = {
@@ -78,103 +727,492 @@ class CollectionResource(resource.Resource):
             "expiration-date":      data.get("expiration-date"),
             "max-subscribers":      data.get("max-subscribers"),
             "observer-check":       data.get("observer-check", 86400),
+            "notify-interval":      data.get("notify-interval"),
+            "history-depth":        data.get("history-depth"),
+            "suppress-duplicates":  data.get("suppress-duplicates"),
+            "origin":               data.get("origin"),
         }
 
-        topic_data_res = TopicDataResource(
-            max_subscribers=config.get("max-subscribers"),
-            content_format=config.get("topic-content-format"),
-        )
+        topic_res, topic_data_res = self.install_topic(topic_config_path, config)
+        self.journal("create", topic_config_path, topic_res.config)
 
         # Handle `initialize` — pre-populate topic-data (§5.2.1)
         init_payload = data.get("initialize")
         if init_payload is not None:
-            if isinstance(init_payload, bytes):
-                topic_data_res.set_content(init_payload)
-            else:
-                topic_data_res.set_content(str(init_payload).encode())
+            topic_data_res.set_content(_as_bytes(init_payload))
+        return topic_config_path, topic_res
+
+    def create_topic(self, data: dict, origin: str | None = None
+                     ) -> tuple[str | None, Message | None]:
+        """Check and create a topic on this broker's own behalf (a mirror
+        of *origin*); returns its config path, or the error response."""
+        error = self._check(data)
+        if error is not None:
+            return None, error
+        path, _ = self._create(dict(data, origin=origin))
+        return path, None
+
+    @timed
+    async def render_post(self, request):
+        ct = request.opt.content_format
+        if is_topic_list(request.payload, ct):
+            return await self._create_many(request, ct)
+        try:
+            data = decode_topic_payload(request.payload, ct)
+        except Exception as e:
+            return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
 
-        self.root.add_resource(
-            topic_config_path.split("/"),
-            TopicResource(config, self.root, topic_config_path.split("/")),
-        )
-        self.root.add_resource(
-            topic_data_path.split("/"),
-            topic_data_res,
-        )
+        error = self._check(data)
+        if error is not None:
+            return error
 
-        self.add_link(topic_config_path)
+        # A client-chosen topic-data path decides which worker owns the topic
+        owner = self._foreign_owner(data)
+        if owner is not None:
+            return await self.shard.forward(request, owner, uri_path=["ps"])
 
-        response = Message(
-            code=aiocoap.CREATED,
-            payload=encode_topic_config(config),
-        )
+        topic_config_path, topic_res = self._create(data)
+        response = Message(code=aiocoap.CREATED, payload=topic_res.encoded_config)
         response.opt.location_path = topic_config_path.split("/")
         response.opt.content_format = CT_PUBSUB_CBOR
         return response
 
+    async def _create_many(self, request, ct):
+        """Bulk creation: an array of configs in, an array of results out.
+
+        Each result is ``{"location": path, "config": config}`` or
+        ``{"error": code, "message": text}``, in request order.
+        """
+        try:
+            items = decode_topic_list(request.payload, ct)
+        except Exception as e:
+            return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
+        if len(items) > BULK_CREATE_LIMIT:
+            return Message(code=aiocoap.REQUEST_ENTITY_TOO_LARGE,
+                           payload=f"at most {BULK_CREATE_LIMIT} topics per request".encode())
+        rejection = self.charge_rest("create", request, len(items))
+        if rejection is not None:
+            return rejection
+
+        results: list[bytes | None] = []
+        created = 0
+        forwarded = []   # (result index, owner, config) for other workers
+        for data in items:
+            error = (
+                self._check(data) if isinstance(data, dict)
+                else Message(code=aiocoap.BAD_REQUEST, payload=b"topic configuration must be a map")
+            )
+            if error is not None:
+                results.append(_bulk_error(error))
+                continue
+            owner = self._foreign_owner(data)
+            if owner is not None:
+                forwarded.append((len(results), owner, data))
+                results.append(None)
+                continue
+            topic_config_path, topic_res = self._create(data)
+            results.append(encode_created(topic_config_path, topic_res.encoded_config))
+            created += 1
+
+        if forwarded:
+            responses = await asyncio.gather(*(
+                self._forward_create(request, owner, data) for _, owner, data in forwarded
+            ))
+            for (index, _, _), (result, ok) in zip(forwarded, responses):
+                results[index] = result
+                created += ok
+
+        response = Message(code=aiocoap.CREATED if created else aiocoap.BAD_REQUEST,
+                           payload=encode_cbor_array(results))
+        response.opt.content_format = CT_CBOR
+        return response
+
+    async def _forward_create(self, request, owner: int, data: dict) -> tuple[bytes, bool]:
+        sub_request = request.copy(payload=encode_topic_config(data))
+        sub_request.opt.content_format = CT_PUBSUB_CBOR
+        try:
+            response = await self.shard.forward(sub_request, owner, uri_path=["ps"])
+        except aiocoap.error.Error as e:
+            log.warning("Topic creation on worker %d failed: %s", owner, e)
+            return _bulk_error(Message(code=aiocoap.SERVICE_UNAVAILABLE)), False
+        if response.code == aiocoap.CREATED:
+            return encode_created("/".join(response.opt.location_path), response.payload), True
+        return _bulk_error(response), False
+
+    def _gathering(self, request) -> bool:
+        return self.shard is not None and not self.shard.is_internal(request)
+
+    @profiled
     async def render_get(self, request):
-        response = Message(payload=self._link_payload)
+        if self._gathering(request):
+            parts = [self._link_payload, *await self.shard.gather(request)]
+            response = Message(code=aiocoap.CONTENT, payload=b",".join(p for p in parts if p))
+            response.opt.content_format = CT_LINK_FORMAT
+            return block2_slice(request, response)
+
+        etag = self._link_etag
+        if etag in (request.opt.etags or ()):
+            response = Message(code=aiocoap.VALID)
+            response.opt.etag = etag
+            return response
+        response = Message(code=aiocoap.CONTENT, payload=self._link_payload)
         response.opt.content_format = CT_LINK_FORMAT
-        return response
+        response.opt.etag = etag
+        return block2_slice(request, response)
 
-    async def render_fetch(self, request):
+    @staticmethod
+    def _fetch_filter(request) -> tuple[list[str], dict[str, object]] | Message:
+        """The property names and values a FETCH asks for, or a 4.00."""
         try:
             raw = cbor2.loads(request.payload)
         except Exception as e:
             return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
 
+        if not isinstance(raw, dict):
+            return Message(code=aiocoap.BAD_REQUEST, payload=b"FETCH filter must be a CBOR map")
+
         # conf-filter (key 10): list of numeric property keys to match on
-        filter_keys_raw = raw.get(TOPIC_KEYS["conf-filter"], [])
-        # Also accept a plain map of key→value pairs for value-based filtering
-        filter_map: dict[str, object] = {}
-        if isinstance(filter_keys_raw, list):
-            filter_names = [TOPIC_KEYS_REV.get(k, str(k)) for k in filter_keys_raw]
-        else:
-            # Treat as {numeric_key: value} map
-            filter_map = {
-                TOPIC_KEYS_REV.get(k, str(k)): v for k, v in raw.items()
-                if k != TOPIC_KEYS["conf-filter"]
-            }
-            filter_names = list(filter_map.keys())
+        filter_keys_raw = raw.get(TOPIC_KEYS["conf-filter"])
+        filter_names = (
+            [TOPIC_KEYS_REV.get(k, str(k)) for k in filter_keys_raw]
+            if isinstance(filter_keys_raw, list) else []
+        )
+        # Any other {numeric_key: value} pairs filter on values
+        filter_map: dict[str, object] = {
+            TOPIC_KEYS_REV.get(k, str(k)): v for k, v in raw.items()
+            if k != TOPIC_KEYS["conf-filter"]
+        }
+        return filter_names, filter_map
+
+    async def add_observation(self, request, serverobservation):
+        # Only FETCH is observable: a subscription to the matching topics'
+        # values. With --workers the topics are spread over processes, so
+        # FETCH is answered once, without Observe.
+        parsed = (
+            self._fetch_filter(request)
+            if request.code == aiocoap.FETCH and self.shard is None else None
+        )
+        if parsed is None or isinstance(parsed, Message):
+            # Answered once, without Observe (as a bad filter is with 4.00)
+            serverobservation.accept(lambda: None)
+            serverobservation.deregister()
+            return
+        names, values = parsed
+        matching = [
+            self.topics.data(self.topics.get(path).config["topic-data"])
+            for path in self.topics.match(names, values)
+        ]
+        sub = self.subscriptions.add(request, serverobservation, names, values, matching)
+        serverobservation.accept(lambda: self.subscriptions.remove(sub))
+
+    async def render(self, request):
+        sub = self.subscriptions.get(request)
+        if sub is not None:
+            # A collection subscription's first response or notification
+            self.metrics.notifications += 1
+            return sub.render()
+        return await super().render(request)
+
+    @timed
+    async def render_fetch(self, request):
+        parsed = self._fetch_filter(request)
+        if isinstance(parsed, Message):
+            return parsed
+        filter_names, filter_map = parsed
 
-        matching: list[str] = []
-        for path, res in self.get_topic_resources().items():
-            path_str = "/".join(path)
-            config = res.config
-            if all(name in config for name in filter_names):
-                if all(
-                    str(config.get(n)) == str(v) for n, v in filter_map.items()
-                ):
-                    matching.append(f'</{path_str}>;rt="core.ps.conf"')
+        matching = [
+            f'</{path}>;rt="core.ps.conf"'
+            for path in self.topics.match(filter_names, filter_map)
+        ]
 
         payload = ",".join(matching).encode("utf-8")
+        if self._gathering(request):
+            parts = [payload, *await self.shard.gather(request)]
+            payload = b",".join(p for p in parts if p)
         response = Message(code=aiocoap.CONTENT, payload=payload)
         response.opt.content_format = CT_LINK_FORMAT
         return response
 
 
+# ---------------------------------------------------------------------------
+# CheckedResource  (observer-check)
+# ---------------------------------------------------------------------------
+
+# observer-check used when a topic has none, or an unusable one (draft-19 §5.2.1)
+DEFAULT_OBSERVER_CHECK = 86400
+
+
+class ObservationState:
+    """Observers of one topic or topic-data resource, and the bookkeeping
+    that only matters while there are any. Allocated with the first
+    observer and dropped with the last."""
+
+    __slots__ = ("observers", "checking", "check_until", "last_notify", "flush_handle",
+                 "lagging", "catch_up_handle")
+
+    def __init__(self):
+        self.observers: dict = {}   # observation -> its remote (None: not policed)
+        self.checking: set = set()   # observations sent the current check
+        self.check_until = 0.0
+        self.last_notify = 0.0   # notify-interval pacing (topic-data)
+        self.flush_handle: asyncio.TimerHandle | None = None
+        self.lagging: set = set()   # observations held back as slow consumers
+        self.catch_up_handle: asyncio.TimerHandle | None = None
+
+
+class CheckedResource(abc.ABC):
+    """Observable topic resource whose observers get confirmable
+    notifications on their topic's observer-check schedule.
+
+    Topic resources are not aiocoap resources of their own: they live in
+    the collection's TopicRegistry and the TopicDispatcher renders them,
+    so blockwise and observation plumbing exist once per broker rather
+    than once per topic.
+    """
+
+    __slots__ = ("collection", "_obs")
+
+    # Dispatch to render_<method> and default response codes, as aiocoap's Resource
+    render = resource.Resource.render
+
+    def __init__(self, collection=None):
+        self.collection = collection
+        self._obs: ObservationState | None = None
+
+    @property
+    def metrics(self) -> Metrics | None:
+        return self.collection.metrics if self.collection is not None else None
+
+    @property
+    def observer_count(self) -> int:
+        return len(self._obs.observers) if self._obs is not None else 0
+
+    def updated_state(self, response=None):
+        """Notify every observer, with *response* or a fresh rendering;
+        observers whose endpoint is slow get the slow-consumer policy."""
+        state = self._obs
+        if state is None:
+            return
+        slow = self.collection.slow_consumers if self.collection is not None else None
+        sent = 0
+        for obs, remote in state.observers.items():
+            if slow is not None and not slow.admit(self.path, state.lagging, obs, remote):
+                continue
+            obs.trigger(response)
+            sent += 1
+        if state.lagging and slow.policy == "conflate" and state.catch_up_handle is None:
+            state.catch_up_handle = asyncio.get_running_loop().call_later(
+                CATCH_UP_INTERVAL, self._catch_up)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.notifications += sent
+
+    def _catch_up(self) -> None:
+        """Send conflated observers the latest state once they have caught up."""
+        state = self._obs
+        if state is None:
+            return
+        state.catch_up_handle = None
+        slow = self.collection.slow_consumers
+        for obs in list(state.lagging):
+            if obs not in state.observers:
+                state.lagging.discard(obs)
+            elif slow.caught_up(self.path, state.observers[obs]):
+                state.lagging.discard(obs)
+                obs.trigger(None)
+                self.collection.metrics.notifications += 1
+        if state.lagging:
+            state.catch_up_handle = asyncio.get_running_loop().call_later(
+                CATCH_UP_INTERVAL, self._catch_up)
+
+    @property
+    @abc.abstractmethod
+    def checked_topic(self) -> "TopicResource | None":
+        """The topic whose observer-check schedule this resource follows."""
+
+    @abc.abstractmethod
+    def check_notification(self) -> Message | None:
+        """A confirmable notification of the current state, if there is one."""
+
+    async def add_observation(self, request, serverobservation):
+        # As aiocoap's ObservableResource, but noticing observations that
+        # end during a check
+        state = self._obs
+        if state is None:
+            state = self._obs = ObservationState()
+        shard = self.collection.shard if self.collection is not None else None
+        # Observations relayed by a sibling worker share its endpoint; the
+        # sibling's own observers are policed there
+        state.observers[serverobservation] = (
+            None if shard is not None and shard.is_sibling(request.remote) else request.remote
+        )
+
+        def _cancel(obs=serverobservation):
+            state.observers.pop(obs, None)
+            state.lagging.discard(obs)
+            if obs in state.checking:
+                state.checking.discard(obs)
+                topic = self.checked_topic
+                if topic is not None and time.monotonic() <= state.check_until:
+                    topic.observer_pruned()
+            if not state.observers and self._obs is state:
+                self._release_observations()
+            self.update_observation_count(len(state.observers))
+
+        serverobservation.accept(_cancel)
+        self.update_observation_count(len(state.observers))
+
+    def _release_observations(self) -> None:
+        if self._obs.flush_handle is not None:
+            self._obs.flush_handle.cancel()
+        if self._obs.catch_up_handle is not None:
+            self._obs.catch_up_handle.cancel()
+        self._obs = None
+
+    def update_observation_count(self, newcount):
+        topic = self.checked_topic
+        if newcount and topic is not None:
+            topic.watch_observers()
+
+    def send_checks(self) -> int:
+        """Notify every observer confirmably; returns the number of observers."""
+        state = self._obs
+        if state is None:
+            return 0
+        state.checking = set(state.observers)
+        state.check_until = time.monotonic() + MAX_TRANSMIT_WAIT
+        if self.metrics is not None:
+            self.metrics.notifications += len(state.observers)
+        for obs in state.observers:
+            response = self.check_notification()
+            if response is None:
+                break
+            obs.trigger(response)
+        return len(state.observers)
+
+    def end_observations(self, reason: bytes) -> None:
+        """End every observation with 4.04 (not counted as pruned)."""
+        state = self._obs
+        if state is None:
+            return
+        state.checking = set()
+        for obs in list(state.observers):
+            obs.trigger(Message(code=aiocoap.NOT_FOUND, payload=reason), is_last=True)
+
+
 # ---------------------------------------------------------------------------
 # TopicResource  (/ps/<id>)
 # ---------------------------------------------------------------------------
 
-class TopicResource(resource.ObservableResource):
+class TopicResource(CheckedResource):
 
-    def __init__(self, config: dict, site, path: list[str]):
-        super().__init__()
+    __slots__ = ("config", "path", "observers_pruned", "_encoded_config")
+
+    rt = "core.ps.conf"
+
+    def __init__(self, config: dict, path: str, collection=None):
+        super().__init__(collection)
         self.config = {k: v for k, v in config.items() if v is not None}
-        self.site = site
         self.path = path
-        self.rt = "core.ps.conf"
+        self.observers_pruned = 0
+        self._encoded_config: bytes | None = None
+
+    @property
+    def encoded_config(self) -> bytes:
+        """CBOR representation of the config, cached until it changes."""
+        if self._encoded_config is None:
+            self._encoded_config = encode_topic_config(self.config)
+        return self._encoded_config
+
+    # -- observer-check ------------------------------------------------------
+
+    @property
+    def checked_topic(self) -> "TopicResource":
+        return self
 
+    @property
+    def observer_check(self) -> float:
+        interval = self.config.get("observer-check")
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0:
+            return DEFAULT_OBSERVER_CHECK
+        return interval
+
+    def _data_resource(self) -> "TopicDataResource | None":
+        if self.collection is None:
+            return None
+        return self.collection.topics.data(self.config.get("topic-data"))
+
+    def watch_observers(self) -> None:
+        if self.collection is not None:
+            self.collection.observer_checks.watch(self.path, self.observer_check)
+
+    def check_observers(self) -> int:
+        """Send the observer-check notifications; returns the observer count."""
+        observers = self.send_checks()
+        data_res = self._data_resource()
+        if data_res is not None:
+            observers += data_res.send_checks()
+        return observers
+
+    def observer_pruned(self) -> None:
+        self.observers_pruned += 1
+        if self.collection is not None:
+            self.collection.observer_checks.pruned += 1
+        log.info("Pruned unresponsive observer of %s", self.path)
+
+    def check_notification(self) -> Message:
+        response = Message(code=aiocoap.CONTENT, payload=self.encoded_config,
+                           transport_tuning=aiocoap.Reliable())
+        response.opt.content_format = CT_PUBSUB_CBOR
+        return first_block(response)
+
+    # -- configuration -------------------------------------------------------
+
+    def _config_changed(self, old_config: dict) -> None:
+        self._encoded_config = None
+        if self.collection is not None:
+            path = self.path
+            self.collection.topics.reindex(path, old_config, self.config)
+            expiration = self.config.get("expiration-date")
+            if expiration != old_config.get("expiration-date"):
+                self.collection.expiry.schedule(path, expiration)
+            if self.config.get("observer-check") != old_config.get("observer-check"):
+                self.collection.observer_checks.reschedule(path, self.observer_check)
+            data_res = self._data_resource()
+            if data_res is not None:
+                data_res.set_history_depth(self.config.get("history-depth") or 0)
+                self.collection.subscriptions.topic_changed(self.config, data_res)
+
+    def _journal_config(self) -> None:
+        if self.collection is not None:
+            self.collection.journal("config", self.path, self.config)
+
+    def remove(self) -> None:
+        """Unregister this topic and its topic-data resource."""
+        collection = self.collection
+        if collection is None:
+            return
+        data_res = collection.topics.data(self.config.get("topic-data"))
+        if data_res is not None:
+            data_res.cancel_notify()
+            data_res.set_history_depth(0)
+        collection.expiry.cancel(self.path)
+        collection.observer_checks.cancel(self.path)
+        collection.topics.remove(self.path)
+        collection.subscriptions.topic_removed(self.config.get("topic-data"))
+        collection._links_changed()
+
+    @profiled
     async def render_get(self, request):
-        response = Message(
-            payload=encode_topic_config(self.config),
-        )
+        response = Message(payload=self.encoded_config)
         response.opt.content_format = CT_PUBSUB_CBOR
-        return response
+        return block2_slice(request, response)
 
+    @timed
     async def render_post(self, request):
         """Full configuration replacement (draft-19 §5.3.1, replaces PUT)."""
+        if self.mirrored:
+            return mirror_refused()
         ct = request.opt.content_format
         try:
             data = decode_topic_payload(request.payload, ct)
@@ -182,65 +1220,87 @@ class TopicResource(resource.ObservableResource):
             return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
 
         # Immutable fields cannot be changed after creation
-        if any(f in data for f in IMMUTABLE_FIELDS):
+        if any(f in data for f in FIXED_FIELDS):
             return Message(
                 code=aiocoap.BAD_REQUEST,
-                payload=b"topic-name, topic-data, resource-type are immutable",
+                payload=b"topic-name, topic-data, resource-type, origin are immutable",
             )
+        error = validate_fields(data)
+        if error:
+            return Message(code=aiocoap.BAD_REQUEST, payload=error.encode())
 
+        old_config = dict(self.config)
         mutable = {"topic-content-format", "topic-type", "expiration-date",
-                   "max-subscribers", "observer-check"}
+                   "max-subscribers", "observer-check", "notify-interval",
+                   "history-depth", "suppress-duplicates"}
         for field in mutable:
             if field in data:
                 self.config[field] = data[field]
+        self._config_changed(old_config)
+        self._journal_config()
 
         self.updated_state()
-        response = Message(code=aiocoap.CHANGED, payload=encode_topic_config(self.config))
+        response = Message(code=aiocoap.CHANGED, payload=self.encoded_config)
         response.opt.content_format = CT_PUBSUB_CBOR
         return response
 
+    @timed
     async def render_ipatch(self, request):
         """Partial update (RFC 8473 incremental PATCH)."""
+        if self.mirrored:
+            return mirror_refused()
         ct = request.opt.content_format
         try:
             data = decode_topic_payload(request.payload, ct)
         except Exception as e:
             return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
 
-        if any(f in data for f in IMMUTABLE_FIELDS):
+        if any(f in data for f in FIXED_FIELDS):
             return Message(
                 code=aiocoap.BAD_REQUEST,
-                payload=b"topic-name, topic-data, resource-type are immutable",
+                payload=b"topic-name, topic-data, resource-type, origin are immutable",
             )
+        error = validate_fields(data)
+        if error:
+            return Message(code=aiocoap.BAD_REQUEST, payload=error.encode())
 
-        for field, value in data.items():
-            if field in self.config:
-                self.config[field] = value
-            else:
-                return Message(code=aiocoap.NOT_FOUND,
-                               payload=f"unknown field: {field}".encode())
+        unknown = [field for field in data if field not in self.config]
+        if unknown:
+            return Message(code=aiocoap.NOT_FOUND,
+                           payload=f"unknown field: {unknown[0]}".encode())
+
+        old_config = dict(self.config)
+        self.config.update(data)
+        self._config_changed(old_config)
+        self._journal_config()
 
         self.updated_state()
-        response = Message(code=aiocoap.CHANGED, payload=encode_topic_config(self.config))
+        response = Message(code=aiocoap.CHANGED, payload=self.encoded_config)
         response.opt.content_format = CT_PUBSUB_CBOR
         return response
 
+    @property
+    def mirrored(self) -> bool:
+        """Whether the topic mirrors a peer broker's, which owns it."""
+        return "origin" in self.config
+
+    def destroy(self, reason: bytes) -> None:
+        """Remove the topic for good, ending all observations with 4.04."""
+        data_res = self._data_resource()
+        self.remove()
+        if self.collection is not None:
+            self.collection.journal("delete", self.path)
+
+        # Notify topic config and topic-data observers of deletion
+        self.end_observations(reason)
+        if data_res is not None:
+            data_res.end_observations(reason)
+
+    @profiled
     async def render_delete(self, request):
-        # Remove topic config resource from site
-        self.site.remove_resource(self.path)
-
-        # Remove associated topic-data resource
-        data_path = self.config.get("topic-data", "").split("/")
-        self.site.remove_resource(data_path)
-
-        # Update collection links
-        collection = self.site._resources.get(("ps",))
-        if collection:
-            collection.remove_link("/".join(self.path))
-
-        # Notify topic config observers of deletion
-        for obs in list(self._observations):
-            obs.trigger(Message(code=aiocoap.NOT_FOUND, payload=b"Topic deleted"), is_last=True)
+        if self.mirrored:
+            return mirror_refused()
+        self.destroy(b"Topic deleted")
 
         return Message(code=aiocoap.DELETED)
 
@@ -249,93 +1309,866 @@ class TopicResource(resource.ObservableResource):
 # TopicDataResource  (/ps/data/<id>)
 # ---------------------------------------------------------------------------
 
-class TopicDataResource(resource.ObservableResource):
+class TopicDataResource(CheckedResource):
 
-    def __init__(self, max_subscribers: int | None = None, content_format: int | None = None):
-        super().__init__()
+    __slots__ = ("_value", "_content_format", "_version", "path", "topic", "history")
+
+    rt = "core.ps.data"
+
+    def __init__(self, content_format: int | None = None, path: str | None = None,
+                 collection=None):
+        super().__init__(collection)
         self._value: bytes | None = None   # None = HALF CREATED state
-        self.rt = "core.ps.data"
-        self._max_subscribers = max_subscribers
         self._content_format = content_format
+        self._version = 0   # bumped by every stored value; the ETag's counter
+        self.path = path
+        self.topic = None   # the TopicResource configuring this topic-data
+        self.history: HistoryRing | None = None   # with history-depth > 0
+
+    def _journal(self, op: str, *args) -> None:
+        if self.collection is not None:
+            self.collection.journal(op, self.path, *args)
+
+    def set_history_depth(self, depth: int) -> None:
+        """Start, resize or (with 0) drop this topic's history."""
+        ring = self.history
+        if ring is not None and ring.depth == depth:
+            return
+        if not depth or self.collection is None:
+            if ring is not None:
+                ring.clear()
+            self.history = None
+        elif ring is None:
+            self.history = HistoryRing(depth, self.collection.history_budget)
+        else:
+            self.history = ring.resized(depth)
+
+    @property
+    def checked_topic(self) -> "TopicResource | None":
+        return self.topic
+
+    @property
+    def max_subscribers(self) -> int | None:
+        return self.topic.config.get("max-subscribers") if self.topic is not None else None
+
+    @property
+    def max_payload(self) -> int:
+        return self.collection.max_payload if self.collection is not None else DEFAULT_MAX_PAYLOAD
+
+    @property
+    def suppress_duplicates(self) -> bool:
+        return self.topic is not None and self.topic.config.get("suppress-duplicates") is True
+
+    @property
+    def etag(self) -> bytes:
+        """ETag of the current value: the collection's epoch and the value's
+        version, so every response and block of one value carries the same."""
+        epoch = self.collection.etag_epoch if self.collection is not None else b""
+        return epoch + self._version.to_bytes(6, "big")
+
+    @property
+    def mirrored(self) -> bool:
+        """Whether the values come from a peer broker, not from publishers here."""
+        return self.topic is not None and self.topic.mirrored
+
+    async def add_observation(self, request, serverobservation):
+        if request.opt.uri_query:
+            # A history query is answered once, not observed
+            serverobservation.accept(lambda: None)
+            serverobservation.deregister()
+            return
+        limit = self.max_subscribers
+        if limit is not None and self.observer_count >= limit:
+            # Answered with 2.05 Content but no Observe option (draft-19 §5.4.2)
+            serverobservation.accept(lambda: None)
+            serverobservation.deregister()
+            if self.metrics is not None:
+                self.metrics.subscriptions_rejected += 1
+            return
+        await super().add_observation(request, serverobservation)
+
+    def check_notification(self) -> Message | None:
+        if not self.is_fully_created:
+            return None
+        response = Message(code=aiocoap.CONTENT, payload=self._value,
+                           transport_tuning=aiocoap.Reliable())
+        if self._content_format is not None:
+            response.opt.content_format = self._content_format
+        response.opt.etag = self.etag
+        return first_block(response)
+
+    @property
+    def notify_interval(self) -> float:
+        if self.topic is not None:
+            interval = self.topic.config.get("notify-interval")
+            if interval is not None:
+                return interval
+        return self.collection.notify_interval if self.collection is not None else 0.0
+
+    def notify(self) -> None:
+        """Notify observers of a new value, at most once per notify-interval.
+
+        Notifications are rendered when they are sent, so a deferred flush
+        carries whatever value is latest by then: publishes in between are
+        conflated. (aiocoap's per-observation trigger is itself lossy, so an
+        observer whose previous notification is still queued gets collapsed
+        to the latest value as well.)
+        """
+        state = self._obs
+        if state is None or state.flush_handle is not None:
+            return
+        interval = self.notify_interval
+        if not interval:
+            self.updated_state()
+            return
+        loop = asyncio.get_running_loop()
+        due = state.last_notify + interval
+        if loop.time() >= due:
+            self._flush()
+        else:
+            state.flush_handle = loop.call_at(due, self._flush)
+
+    def _flush(self) -> None:
+        state = self._obs
+        if state is None:
+            return
+        state.flush_handle = None
+        state.last_notify = asyncio.get_running_loop().time()
+        if self.is_fully_created:
+            self.updated_state()
+
+    def cancel_notify(self) -> None:
+        state = self._obs
+        if state is not None and state.flush_handle is not None:
+            state.flush_handle.cancel()
+            state.flush_handle = None
 
     @property
     def is_fully_created(self) -> bool:
         return self._value is not None
 
     def set_content(self, content: bytes) -> None:
+        if self.collection is not None:
+            self.collection.metrics.publishes += 1
         self._value = content
-        self.updated_state()
+        self._version += 1
+        if self.history is not None:
+            self.history.append(content, self._content_format)
+        self._journal("publish", content, self._content_format)
+        self.notify()
+        if self.collection is not None:
+            self.collection.subscriptions.value_changed(self)
+
+    def _render_history(self, query: list[str]) -> Message:
+        if self.history is None:
+            return Message(code=aiocoap.BAD_REQUEST, payload=b"Topic has no history-depth")
+        try:
+            name, value = query[0].split("=", 1)
+            n = int(value)
+        except ValueError:
+            name, n = None, -1
+        if len(query) != 1 or name not in ("since", "last") or n < 0:
+            return Message(code=aiocoap.BAD_REQUEST,
+                           payload=b"Expected one query: since=<seq> or last=<n>")
+        entries = self.history.since(n) if name == "since" else self.history.last(n)
+        response = Message(code=aiocoap.CONTENT, payload=encode_entries(entries))
+        response.opt.content_format = CT_CBOR_SEQ
+        return response
 
+    @profiled
     async def render_get(self, request):
+        if request.opt.uri_query:
+            return self._render_history(list(request.opt.uri_query))
         if not self.is_fully_created:
             return Message(code=aiocoap.NOT_FOUND)
-
-        # Enforce max-subscribers when client sends Observe=0 (subscribe)
-        if (
-            request.opt.observe == 0
-            and self._max_subscribers is not None
-            and len(self._observations) >= self._max_subscribers
-        ):
-            # Respond with 2.05 Content but NO Observe option — subscription rejected
-            resp = Message(code=aiocoap.CONTENT, payload=self._value)
-            if self._content_format is not None:
-                resp.opt.content_format = self._content_format
+        etag = self.etag
+        if etag in (request.opt.etags or ()):
+            resp = Message(code=aiocoap.VALID)
+            resp.opt.etag = etag
             return resp
 
+        # Every response and notification of this value shares its bytes
         resp = Message(payload=self._value)
         if self._content_format is not None:
             resp.opt.content_format = self._content_format
-        return resp
-
-    async def render_put(self, request):
+        resp.opt.etag = etag
+        return block2_slice(request, resp)
+
+    def publish(self, payload: bytes, content_format: int | None = None):
+        """Store a published value; returns 2.01 Created, 2.04 Changed, or
+        4.13 Request Entity Too Large over max-payload. With
+        suppress-duplicates, the value held already is not stored again,
+        so its observers are not notified."""
+        if len(payload) > self.max_payload:
+            return aiocoap.REQUEST_ENTITY_TOO_LARGE
         was_created = not self.is_fully_created
-        if request.opt.content_format is not None:
-            self._content_format = request.opt.content_format
-        self.set_content(request.payload)
-        code = aiocoap.CREATED if was_created else aiocoap.CHANGED
-        resp = Message(code=code, payload=self._value)
-        if self._content_format is not None:
-            resp.opt.content_format = self._content_format
+        if (
+            not was_created
+            and self.suppress_duplicates
+            and content_format in (None, self._content_format)
+            and payload == self._value
+        ):
+            if self.collection is not None:
+                self.collection.metrics.publishes_suppressed += 1
+            return aiocoap.CHANGED
+        if content_format is not None:
+            self._content_format = content_format
+        # Kept as one immutable buffer, not copied again per observer or block
+        self.set_content(bytes(payload))
+        return aiocoap.CREATED if was_created else aiocoap.CHANGED
+
+    @timed
+    async def render_put(self, request):
+        if self.mirrored:
+            return mirror_refused()
+        if body_size(request) > self.max_payload:
+            return too_large(self.max_payload)
+        if self._precondition_failed(request):
+            return Message(code=aiocoap.PRECONDITION_FAILED)
+        code = self.publish(request.payload, request.opt.content_format)
+        if code == aiocoap.REQUEST_ENTITY_TOO_LARGE:
+            return too_large(self.max_payload)
+        # The value is echoed only while it fits in one message
+        if len(self._value) > request.remote.maximum_payload_size:
+            resp = Message(code=code)
+        else:
+            resp = Message(code=code, payload=self._value)
+            if self._content_format is not None:
+                resp.opt.content_format = self._content_format
+        resp.opt.etag = self.etag
         return resp
 
+    def _precondition_failed(self, request) -> bool:
+        """Whether If-Match or If-None-Match (RFC 7252 §5.10.8) rule out a PUT."""
+        if request.opt.if_none_match and self.is_fully_created:
+            return True
+        if_match = request.opt.if_match
+        if not if_match:
+            return False
+        if not self.is_fully_created:
+            return True
+        etag = self.etag
+        # An empty If-Match matches any current value
+        return not any(tag == b"" or tag == etag for tag in if_match)
+
+    @profiled
     async def render_delete(self, request):
         """Revert topic to HALF CREATED state (draft-19 §5.4.3)."""
+        if self.mirrored:
+            return mirror_refused()
         self._value = None
+        if self.history is not None:
+            self.history.clear()
+        self._journal("unpublish")
+        self.cancel_notify()
         # Notify existing subscribers of the state change (they get 4.04)
-        for obs in list(self._observations):
-            obs.trigger(Message(code=aiocoap.NOT_FOUND, payload=b"Topic data deleted"), is_last=True)
+        self.end_observations(b"Topic data deleted")
+        if self.collection is not None:
+            self.collection.subscriptions.value_changed(self)
         return Message(code=aiocoap.DELETED)
 
 
 # ---------------------------------------------------------------------------
-# Server setup
+# TopicDispatcher  (/ps/<id>, /ps/data/<id>)
 # ---------------------------------------------------------------------------
 
-logging.basicConfig(level=logging.INFO)
-logging.getLogger("coap-server").setLevel(logging.DEBUG)
+class TopicDispatcher(resource.Resource, aiocoap.interfaces.ObservableResource):
+    """Renders the topic and topic-data resources of a TopicRegistry.
+
+    PubSubSite hands over every request whose path names a topic (config
+    or data path, so client-chosen topic-data paths outside /ps work
+    too); the path is looked up again for each rendering, including the
+    re-renderings of an observation.
+    """
+
+    def __init__(self, collection: CollectionResource):
+        super().__init__()
+        self.collection = collection
+        self.topics = collection.topics
+
+    async def needs_blockwise_assembly(self, request):
+        if request.code == aiocoap.GET:
+            # Values and configs are sliced by block2_slice; only history
+            # queries are rendered per request and left to aiocoap
+            return bool(request.opt.uri_query)
+        # A PUT over max-payload is refused at the first block that shows it
+        # (the first, if it carries Size1), rather than assembled
+        return body_size(request) <= self.collection.max_payload
+
+    def lookup(self, uri_path) -> CheckedResource | None:
+        path = "/".join(uri_path)
+        topic = self.topics.get(path)
+        return topic if topic is not None else self.topics.data(path)
+
+    async def render(self, request):
+        topic = self.lookup(request.opt.uri_path)
+        if topic is None:
+            raise aiocoap.error.NotFound()
+        return await topic.render(request)
+
+    async def add_observation(self, request, serverobservation):
+        topic = self.lookup(request.opt.uri_path)
+        if topic is not None:
+            await topic.add_observation(request, serverobservation)
+
+    def get_link_description(self):
+        return None
+
+    def links(self) -> list[Link]:
+        """.well-known/core entries of every topic and topic-data resource."""
+        result = []
+        for path, topic in self.topics.items():
+            result.append(Link("/" + path, rt=TopicResource.rt, obs=None))
+            result.append(Link("/" + topic.config["topic-data"], rt=TopicDataResource.rt, obs=None))
+        return result
+
+
+class PubSubSite(resource.Site):
+    """Site whose paths not registered with add_resource are looked up in
+    the topic registry."""
+
+    def __init__(self):
+        super().__init__()
+        self.dispatcher: TopicDispatcher | None = None
+        self.collection: CollectionResource | None = None
+
+    def admit(self, request) -> Message | None:
+        return self.collection.admit(request) if self.collection is not None else None
 
+    async def render_to_pipe(self, pipe):
+        # Over-limit requests are refused before any resource sees them
+        rejection = self.admit(pipe.request)
+        if rejection is not None:
+            pipe.add_response(rejection, is_last=True)
+            return
+        await super().render_to_pipe(pipe)
 
-async def _run(host: str, port: int) -> None:
-    root = resource.Site()
+    def _find_child_and_pathstripped_message(self, request):
+        try:
+            return super()._find_child_and_pathstripped_message(request)
+        except KeyError:
+            dispatcher = self.dispatcher
+            if dispatcher is None or dispatcher.lookup(request.opt.uri_path) is None:
+                raise
+            # The dispatcher needs the whole path to find the topic
+            return dispatcher, request
+
+    def get_resources_as_linkheader(self):
+        links = super().get_resources_as_linkheader()
+        if self.dispatcher is not None:
+            links.links = links.links + self.dispatcher.links()
+        return links
+
+
+# ---------------------------------------------------------------------------
+# BatchPublishResource  (/ps/.publish)
+# ---------------------------------------------------------------------------
+
+
+class BatchPublishResource(resource.Resource):
+    """Publish to many topic-data resources with one request.
+
+    The POST payload is a CBOR map of topic-data path to either the payload
+    (bytes or text) or ``[payload, content_format]``. Every update is
+    applied as a PUT to that resource would be, notifying its observers;
+    the response maps each path to its result code ("2.01", "2.04",
+    "4.00", "4.04", "4.05" for a mirrored topic, "4.13").
+    """
+
+    def __init__(self, collection: CollectionResource):
+        super().__init__()
+        self.collection = collection
+
+    @property
+    def metrics(self) -> Metrics:
+        return self.collection.metrics
+
+    @staticmethod
+    def _entry(value) -> tuple[bytes, int | None] | None:
+        if isinstance(value, list) and len(value) == 2:
+            value, content_format = value
+            if content_format is not None and (
+                isinstance(content_format, bool) or not isinstance(content_format, int)
+            ):
+                return None
+        else:
+            content_format = None
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if not isinstance(value, bytes):
+            return None
+        return value, content_format
+
+    def _apply(self, updates: dict) -> dict[str, str]:
+        results = {}
+        for path, value in updates.items():
+            entry = self._entry(value)
+            data_res = self.collection.topics.data(path)
+            if entry is None:
+                results[path] = aiocoap.BAD_REQUEST.dotted
+            elif data_res is None:
+                results[path] = aiocoap.NOT_FOUND.dotted
+            elif data_res.mirrored:
+                results[path] = aiocoap.METHOD_NOT_ALLOWED.dotted
+            else:
+                results[path] = data_res.publish(*entry).dotted
+        return results
+
+    async def _forward(self, request, owner: int, updates: dict) -> dict[str, str]:
+        sub_request = request.copy(payload=cbor2.dumps(updates))
+        try:
+            response = await self.collection.shard.forward(
+                sub_request, owner, uri_path=["ps", ".publish"])
+        except aiocoap.error.Error as e:
+            log.warning("Batch publish to worker %d failed: %s", owner, e)
+            return {path: aiocoap.SERVICE_UNAVAILABLE.dotted for path in updates}
+        if response.code.is_successful():
+            return cbor2.loads(response.payload)
+        return {path: response.code.dotted for path in updates}
+
+    @timed
+    async def render_post(self, request):
+        if request.opt.content_format not in (None, CT_CBOR):
+            return Message(code=aiocoap.UNSUPPORTED_CONTENT_FORMAT)
+        try:
+            updates = cbor2.loads(request.payload)
+        except Exception as e:
+            return Message(code=aiocoap.BAD_REQUEST, payload=str(e).encode())
+        if not isinstance(updates, dict) or not all(isinstance(p, str) for p in updates):
+            return Message(code=aiocoap.BAD_REQUEST,
+                           payload=b"Expected a CBOR map of topic-data path to payload")
+        updates = {path.lstrip("/"): value for path, value in updates.items()}
+        rejection = self.collection.charge_rest("publish", request, len(updates))
+        if rejection is not None:
+            return rejection
+
+        shard = self.collection.shard
+        if shard is None:
+            results = self._apply(updates)
+        else:
+            # Updates for other workers' topics go to them as sub-batches
+            by_owner: dict[int, dict] = {}
+            for path, value in updates.items():
+                by_owner.setdefault(shard.owner(path), {})[path] = value
+            local = by_owner.pop(shard.index, {})
+            results = self._apply(local)
+            for part in await asyncio.gather(*(
+                self._forward(request, owner, part) for owner, part in by_owner.items()
+            )):
+                results.update(part)
+
+        response = Message(code=aiocoap.CHANGED, payload=cbor2.dumps(results))
+        response.opt.content_format = CT_CBOR
+        return response
+
+
+# ---------------------------------------------------------------------------
+# MetricsResource  (/ps/.metrics)
+# ---------------------------------------------------------------------------
+
+CT_TEXT = 0
+
+
+class MetricsResource(resource.Resource):
+    """Broker metrics as CBOR (default), JSON (Accept: 50) or Prometheus
+    text (Accept: 0)."""
+
+    def __init__(self, collection: CollectionResource):
+        super().__init__()
+        self.collection = collection
+
+    async def render_get(self, request):
+        report = self.collection.metrics_report()
+        accept = request.opt.accept
+        if accept == CT_TEXT:
+            payload = prometheus_text(report).encode()
+        elif accept == CT_JSON:
+            payload = json.dumps(report).encode()
+        elif accept in (None, CT_CBOR):
+            accept = CT_CBOR
+            payload = cbor2.dumps(report)
+        else:
+            return Message(code=aiocoap.NOT_ACCEPTABLE)
+        response = Message(code=aiocoap.CONTENT, payload=payload)
+        response.opt.content_format = accept
+        return response
+
+
+# ---------------------------------------------------------------------------
+# ProfileResource  (/ps/.profile)
+# ---------------------------------------------------------------------------
+
+class ProfileResource(resource.Resource):
+    """Start (POST), stop (DELETE) and inspect (GET) profiles of this broker
+    process; see profiling. Bodies are JSON."""
+
+    def __init__(self, profiler: Profiler):
+        super().__init__()
+        self.profiler = profiler
+
+    @staticmethod
+    def _json(code, body: dict) -> Message:
+        response = Message(code=code, payload=json.dumps(body).encode())
+        response.opt.content_format = CT_JSON
+        return response
+
+    async def render_get(self, request):
+        return self._json(aiocoap.CONTENT, self.profiler.status())
+
+    async def render_post(self, request):
+        mode, seconds = None, None
+        for item in request.opt.uri_query:
+            name, _, value = item.partition("=")
+            if name == "mode" and value in PROFILE_MODES:
+                mode = value
+            elif name == "seconds":
+                try:
+                    seconds = float(value)
+                except ValueError:
+                    seconds = -1.0
+                if not seconds > 0:
+                    return Message(code=aiocoap.BAD_REQUEST,
+                                   payload=b"seconds must be a positive number")
+            else:
+                return Message(code=aiocoap.BAD_REQUEST,
+                               payload=b"Expected mode=sample|deterministic and seconds=<s>")
+        try:
+            self.profiler.start(mode, seconds)
+        except RuntimeError as e:
+            return Message(code=aiocoap.CONFLICT, payload=str(e).encode())
+        return self._json(aiocoap.CHANGED, self.profiler.status())
+
+    async def render_delete(self, request):
+        try:
+            summary = self.profiler.stop()
+        except RuntimeError as e:
+            return Message(code=aiocoap.CONFLICT, payload=str(e).encode())
+        except OSError as e:
+            return Message(code=aiocoap.INTERNAL_SERVER_ERROR, payload=str(e).encode())
+        return self._json(aiocoap.DELETED, summary)
+
+
+# ---------------------------------------------------------------------------
+# Server setup
+# ---------------------------------------------------------------------------
+
+async def _persist(
+    collection: CollectionResource,
+    store: TopicStore,
+    snapshot_interval: float,
+    fsync_interval: float,
+) -> None:
+    """Periodically fsync the journal and compact it into a snapshot."""
+    loop = asyncio.get_running_loop()
+    next_snapshot = loop.time() + snapshot_interval
+    while True:
+        await asyncio.sleep(min(fsync_interval, snapshot_interval))
+        if store.fsync == "interval":
+            store.sync()
+        if loop.time() >= next_snapshot:
+            next_snapshot = loop.time() + snapshot_interval
+            if store.journal_length > 0:
+                # State is captured on the loop; encoding and I/O run off it
+                seq = store.begin_snapshot()
+                await asyncio.to_thread(store.write_snapshot, seq, collection.dump_state())
+
+
+async def _run(
+    host: str,
+    port: int,
+    data_dir: str | None = None,
+    fsync: str = "interval",
+    fsync_interval: float = 1.0,
+    snapshot_interval: float = 300.0,
+    notify_interval: float = 0.0,
+    history_budget: int = DEFAULT_HISTORY_BUDGET,
+    max_payload: int = DEFAULT_MAX_PAYLOAD,
+    slow_consumer_policy: str = "conflate",
+    slow_consumer_threshold: int = DEFAULT_SLOW_THRESHOLD,
+    rates: dict | None = None,
+    max_topics: int | None = None,
+    rcvbuf: int | None = None,
+    sndbuf: int | None = None,
+    recv_batch: int = 1,
+    peers: list[str] = (),
+    mirror: list[str] = (),
+    peer_interval: float = DEFAULT_PEER_INTERVAL,
+    metrics_port: int | None = None,
+    profile_dir: str | None = None,
+    profile_mode: str = "sample",
+    profile_interval: float = DEFAULT_SAMPLE_INTERVAL,
+    shard=None,
+) -> None:
+    root = PubSubSite()
     root.add_resource(
         [".well-known", "core"],
         resource.WKCResource(root.get_resources_as_linkheader),
     )
-    root.add_resource(["ps"], CollectionResource(root))
-
-    await aiocoap.Context.create_server_context(bind=(host, port), site=root)
-    logging.info("CoAP pubsub broker listening on coap://%s:%d/ps", host, port)
-    await asyncio.get_running_loop().create_future()
+    collection = CollectionResource()
+    root.dispatcher = TopicDispatcher(collection)
+    root.collection = collection
+    collection.shard = shard
+    collection.notify_interval = notify_interval
+    collection.history_budget.limit = history_budget
+    collection.max_payload = max_payload
+    collection.slow_consumers = SlowConsumers(slow_consumer_policy, slow_consumer_threshold)
+    collection.admission = Admission(**(rates or {}))
+    if max_topics is not None:
+        # Each worker holds its share of the cap
+        collection.max_topics = -(-max_topics // shard.count) if shard is not None else max_topics
+    root.add_resource(["ps"], collection)
+    root.add_resource(["ps", ".metrics"], MetricsResource(collection))
+    root.add_resource(["ps", ".publish"], BatchPublishResource(collection))
+    profiler = None
+    if profile_dir is not None:
+        profiler = Profiler(collection.metrics, profile_dir, profile_mode, profile_interval)
+        root.add_resource(["ps", ".profile"], ProfileResource(profiler))
+
+    store = None
+    if data_dir is not None:
+        store = TopicStore(data_dir, fsync=fsync)
+        collection.restore(*store.load())
+        collection.store = store
+        log.info("Restored %d topics from %s", len(collection.topics), data_dir)
+
+    if shard is None:
+        contexts = [await aiocoap.Context.create_server_context(bind=(host, port), site=root)]
+    else:
+        # Only UDP shares its port between workers (SO_REUSEPORT)
+        shard.context = await aiocoap.Context.create_server_context(
+            bind=(shard.internal_host, shard.internal_ports[shard.index]),
+            site=root, transports=["udp6"],
+        )
+        contexts = [shard.context, await aiocoap.Context.create_server_context(
+            bind=(host, port), site=ShardRouter(root, shard), transports=["udp6"],
+        )]
+    for context in contexts:
+        tune_context(context, rcvbuf, sndbuf, recv_batch)
+    log.info("CoAP pubsub broker listening on coap://%s:%d/ps (%s event loop)", host, port,
+             type(asyncio.get_running_loop()).__module__.partition(".")[0])
+    federation = None
+    if peers and (shard is None or shard.index == 0):
+        # One worker mirrors for all; mirrors are topics like any other
+        collection.federation = Federation(collection, peers, mirror, peer_interval)
+        federation = asyncio.create_task(collection.federation.run())
+    metrics_server = None
+    if metrics_port is not None:
+        # Each worker exports its own metrics, on consecutive ports
+        metrics_server = await serve_http(collection.metrics_report, host,
+                                          metrics_port + (shard.index if shard is not None else 0))
+    if profiler is not None:
+        # Every worker is profiled on its own: signal the process to profile
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.toggle)
+        log.info("Profiling on SIGUSR1 (pid %d) or POST /ps/.profile, into %s",
+                 os.getpid(), profile_dir)
+    try:
+        if store is not None:
+            await _persist(collection, store, snapshot_interval, fsync_interval)
+        else:
+            await asyncio.get_running_loop().create_future()
+    finally:
+        if federation is not None:
+            federation.cancel()
+            await asyncio.gather(federation, return_exceptions=True)
+        if metrics_server is not None:
+            metrics_server.close()
+        if profiler is not None and profiler.active:
+            profiler.stop()
+        if store is not None:
+            store.close()
+
+
+def _config_defaults(parser: argparse.ArgumentParser, path: str) -> tuple[dict, dict]:
+    """Option defaults from a JSON object keyed by option name
+    (``{"publish-rate": "50/100", "max-topics": 100000, "peer": [...]}``).
+
+    The values are parsed as the same options on the command line would be,
+    so types and choices are checked alike. Returns the defaults and, apart,
+    the lists of repeatable options, which options repeated on the command
+    line replace rather than extend.
+    """
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        parser.error(f"--config {path}: {e}")
+    if not isinstance(config, dict):
+        parser.error(f"--config {path}: expected a JSON object")
+    argv = []
+    for name, value in config.items():
+        option = "--" + name.lstrip("-")
+        if option in ("--help", "--config"):
+            parser.error(f"--config {path}: unknown option {name!r}")
+        if isinstance(value, bool):
+            # A flag: true sets it
+            argv += [option] if value else []
+        elif value is not None:
+            for item in value if isinstance(value, list) else [value]:
+                argv += [f"{option}={item}"]
+
+    exit_on_error, parser.exit_on_error = parser.exit_on_error, False
+    try:
+        parsed, unknown = parser.parse_known_args(argv)
+    except argparse.ArgumentError as e:
+        parser.error(f"--config {path}: {e}")
+    finally:
+        parser.exit_on_error = exit_on_error
+    if unknown:
+        parser.error(f"--config {path}: unknown option {unknown[0].partition('=')[0]!r}")
+
+    defaults, lists = {}, {}
+    for name, value in config.items():
+        dest = name.lstrip("-").replace("-", "_")
+        if not hasattr(parsed, dest):   # an abbreviation of some option
+            parser.error(f"--config {path}: unknown option {name!r}")
+        if isinstance(getattr(parsed, dest), list):
+            defaults[dest] = None
+            lists[dest] = getattr(parsed, dest)
+        else:
+            defaults[dest] = getattr(parsed, dest)
+    return defaults, lists
 
 
 def main_cli() -> None:
     parser = argparse.ArgumentParser(
         description="CoAP Publish-Subscribe Broker (draft-ietf-core-coap-pubsub-19)",
     )
+    parser.add_argument("--config", metavar="FILE",
+                        help="JSON object of option defaults keyed by option name; "
+                             "options given on the command line take precedence")
     parser.add_argument("--host", default="localhost", help="Bind host (default: localhost)")
     parser.add_argument("--port", type=int, default=5683, help="Bind port (default: 5683)")
+    parser.add_argument("--data-dir",
+                        help="Persist topics and last values in this directory")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default="interval",
+                        help="Journal fsync policy (default: interval)")
+    parser.add_argument("--fsync-interval", type=float, default=1.0,
+                        help="Seconds between journal fsyncs with --fsync interval (default: 1)")
+    parser.add_argument("--snapshot-interval", type=float, default=300.0,
+                        help="Seconds between journal compactions (default: 300)")
+    parser.add_argument("--notify-interval", type=float, default=0.0,
+                        help="Default minimum seconds between notifications per topic; "
+                             "publishes in between are conflated (default: 0, off)")
+    parser.add_argument("--history-budget", type=int, default=DEFAULT_HISTORY_BUDGET,
+                        help="Payload bytes all topic histories (history-depth) may hold "
+                             "together (default: 64 MiB)")
+    parser.add_argument("--max-payload", type=int, default=DEFAULT_MAX_PAYLOAD,
+                        help="Largest value in bytes a topic accepts; bigger publishes "
+                             "get 4.13 (default: 1 MiB)")
+    parser.add_argument("--slow-consumer-policy", choices=SLOW_CONSUMER_POLICIES,
+                        default="conflate",
+                        help="What to do with an observer whose endpoint has too many "
+                             "unacknowledged notifications (default: conflate)")
+    parser.add_argument("--slow-consumer-threshold", type=int, default=DEFAULT_SLOW_THRESHOLD,
+                        help="Unacknowledged confirmable notifications that make an observer "
+                             f"slow; 0 turns the check off (default: {DEFAULT_SLOW_THRESHOLD})")
+    for kind in LIMITED:
+        parser.add_argument(f"--{kind}-rate", type=parse_rate, metavar="RATE[/BURST]",
+                            help=f"Limit each client address to RATE {kind} requests per second, "
+                                 f"BURST at once; over it they get 4.29 (default: unlimited)")
+    parser.add_argument("--max-topics", type=int,
+                        help="Refuse topic creation with 5.03 beyond this many topics "
+                             "(default: unlimited)")
+    parser.add_argument("--peer", action="append", default=[], metavar="URI",
+                        help="Mirror the topics of this broker; repeatable")
+    parser.add_argument("--mirror", action="append", default=[], metavar="GLOB",
+                        help="Mirror only peer topics whose topic-name matches; "
+                             "repeatable (default: all)")
+    parser.add_argument("--peer-interval", type=float, default=DEFAULT_PEER_INTERVAL,
+                        help="Seconds between listings of each peer's topics "
+                             f"(default: {DEFAULT_PEER_INTERVAL:g})")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Also export metrics in Prometheus text format over HTTP "
+                             "on this port (worker i uses port + i)")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="Allow profiling on SIGUSR1 or via /ps/.profile, "
+                             "writing profiles to DIR")
+    parser.add_argument("--profile-mode", choices=PROFILE_MODES, default="sample",
+                        help="Profiler started by SIGUSR1 (default: sample)")
+    parser.add_argument("--profile-interval", type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                        metavar="SECONDS",
+                        help="Seconds between stack samples of the sample profiler "
+                             f"(default: {DEFAULT_SAMPLE_INTERVAL:g})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Broker processes sharing the port, each owning a shard of topics (default: 1)")
+    parser.add_argument("--internal-port-base", type=int,
+                        help="First loopback port for worker-to-worker forwarding (default: port + 1)")
+    parser.add_argument("--loop", choices=LOOPS, default="asyncio",
+                        help="Event loop implementation; auto picks uvloop when it is "
+                             "installed (default: asyncio)")
+    parser.add_argument("--rcvbuf", type=int, metavar="BYTES",
+                        help="UDP socket receive buffer size (default: the system's)")
+    parser.add_argument("--sndbuf", type=int, metavar="BYTES",
+                        help="UDP socket send buffer size (default: the system's)")
+    parser.add_argument("--recv-batch", type=int, default=1, metavar="N",
+                        help="Datagrams to read per socket wake-up (default: 1)")
+    parser.add_argument("--log-level", type=parse_level, action="append", default=[],
+                        metavar="LEVEL|LOGGER=LEVEL",
+                        help="Log level, or one logger's (e.g. coap-server=DEBUG); "
+                             "repeatable (default: INFO)")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text",
+                        help="Plain lines or JSON lines (default: text)")
+    parser.add_argument("--log-sample", type=parse_sample, action="append", default=[],
+                        metavar="LOGGER=RATE",
+                        help="Keep only RATE (0..1) of a logger's records below WARNING; repeatable")
+    parser.add_argument("--log-queue", action="store_true",
+                        help="Format and write log records on a background thread")
+    config_file = parser.parse_known_args()[0].config
+    config_lists = {}
+    if config_file is not None:
+        defaults, config_lists = _config_defaults(parser, config_file)
+        parser.set_defaults(**defaults)
     args = parser.parse_args()
-    asyncio.run(_run(args.host, args.port))
+    for dest, values in config_lists.items():
+        if getattr(args, dest) is None:   # not repeated on the command line
+            setattr(args, dest, values)
+    if args.profile_interval <= 0:
+        parser.error("--profile-interval must be positive")
+    if args.recv_batch < 1:
+        parser.error("--recv-batch must be at least 1")
+    if args.loop == "uvloop":
+        try:
+            loop_factory(args.loop)
+        except RuntimeError as e:
+            parser.error(str(e))
+    run_kwargs = dict(
+        host=args.host, port=args.port,
+        data_dir=args.data_dir,
+        fsync=args.fsync,
+        fsync_interval=args.fsync_interval,
+        snapshot_interval=args.snapshot_interval,
+        notify_interval=args.notify_interval,
+        history_budget=args.history_budget,
+        max_payload=args.max_payload,
+        slow_consumer_policy=args.slow_consumer_policy,
+        slow_consumer_threshold=args.slow_consumer_threshold,
+        rates={kind: getattr(args, f"{kind}_rate") for kind in LIMITED},
+        max_topics=args.max_topics,
+        rcvbuf=args.rcvbuf,
+        sndbuf=args.sndbuf,
+        recv_batch=args.recv_batch,
+        peers=args.peer,
+        mirror=args.mirror,
+        peer_interval=args.peer_interval,
+        metrics_port=args.metrics_port,
+        profile_dir=args.profile_dir,
+        profile_mode=args.profile_mode,
+        profile_interval=args.profile_interval,
+    )
+    log_options = dict(
+        levels=args.log_level, fmt=args.log_format,
+        sample=args.log_sample, use_queue=args.log_queue,
+    )
+    if args.workers > 1:
+        base = args.internal_port_base or args.port + 1
+        run_workers(args.workers, base, run_kwargs, log_options, args.loop)
+        return
+    listener = configure_logging(**log_options)
+    try:
+        run_loop(_run(**run_kwargs), args.loop)
+    finally:
+        if listener is not None:
+            listener.stop()
 
 
 if __name__ == "__main__":
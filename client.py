@@ -9,78 +9,83 @@ pubsub-client — command-line client for a CoAP pubsub broker
 
 Subcommands:
   create   <broker>  <topic-name>  [options]
+  create   <broker>  --from-file FILE  [--chunk N]
   list     <broker>
-  fetch    <broker>  --filter <key>[,key...]
+  fetch    <broker>  --filter <key>[=value][,key...]
   update   <broker>  <topic-url>   <key>=<value> ...
   patch    <broker>  <topic-url>   <key>=<value> ...
   delete   <broker>  <topic-url>
   publish  <data-url>  <payload>   [--format FORMAT]
+  publish  <data-url>  -  [--inflight N]  (one value per stdin line)
+  publish  <broker>  --batch FILE  [--format FORMAT]
   read     <data-url>
-  sub      <data-url>
+  history  <data-url>  [--since SEQ | --last N]
+  sub      <data-url> [<data-url> ...]  [--stats SECONDS]
+  sub      <broker>  --filter <key>[=value][,key...]
+  metrics  <broker>  [--prometheus]
   demo     <broker>
+  bench    [<broker>]  [--spawn]  [--scenario NAME ...]
 """
 
 import argparse
 import asyncio
 import json
 import sys
-from contextlib import asynccontextmanager
+import time
 
 import aiocoap
-import cbor2
 
-from codec import (
-    TOPIC_KEYS, TOPIC_KEYS_REV,
-    CT_PUBSUB_CBOR, CT_LINK_FORMAT,
-    decode_topic_payload as _decode,
-    encode_topic_config as _encode,
-)
+import bench
+from codec import TOPIC_KEYS
+from pubsub import PubSubClient, PubSubError, broker_uri as _broker_uri
 
 
 def _pretty(d: dict) -> str:
     return json.dumps(d, indent=2, default=str)
 
 
-def _broker_uri(addr: str) -> str:
-    return addr if addr.startswith("coap") else f"coap://{addr}"
-
-
-@asynccontextmanager
-async def _coap_ctx():
-    ctx = await aiocoap.Context.create_client_context()
-    try:
-        yield ctx
-    finally:
-        await ctx.shutdown()
-
-
-async def _req(
-    ctx,
-    method: str,
-    uri: str,
-    payload: bytes = b"",
-    content_format: int | None = None,
-) -> aiocoap.Message:
-    code = getattr(aiocoap.numbers.codes.Code, method)
-    msg = aiocoap.Message(code=code, uri=uri)
-    if payload:
-        msg.payload = payload
-    if content_format is not None:
-        msg.opt.content_format = content_format
-    return await ctx.request(msg).response
-
-
 # ---------------------------------------------------------------------------
 # Subcommand handlers
 # ---------------------------------------------------------------------------
 
 async def cmd_list(args) -> None:
-    async with _coap_ctx() as ctx:
-        r = await _req(ctx, "GET", f"{_broker_uri(args.broker)}/ps")
-        print(r.payload.decode())
+    async with PubSubClient(args.broker) as ps:
+        print(await ps.topics())
+
+
+async def cmd_create_from_file(args) -> None:
+    """Create the topics listed in a JSON array of configs, in bulk requests."""
+    with (sys.stdin if args.from_file == "-" else open(args.from_file)) as f:
+        configs = json.load(f)
+    if not isinstance(configs, list) or not all(isinstance(c, dict) for c in configs):
+        print("create: --from-file needs a JSON array of topic configurations (objects)",
+              file=sys.stderr)
+        sys.exit(2)
+    for config in configs:
+        if isinstance(config.get("initialize"), str):
+            config["initialize"] = config["initialize"].encode()
+
+    failed = 0
+    async with PubSubClient(args.broker) as ps:
+        for start in range(0, len(configs), args.chunk):
+            chunk = configs[start:start + args.chunk]
+            for config, result in zip(chunk, await ps.create_many(chunk)):
+                if "location" in result:
+                    print(f"Created: {ps.uri(result['location'])}  ({config.get('topic-name')})")
+                else:
+                    failed += 1
+                    print(f"Error: {result['error']} {result['message']}  "
+                          f"({config.get('topic-name')})", file=sys.stderr)
+    if failed:
+        sys.exit(1)
 
 
 async def cmd_create(args) -> None:
+    if args.from_file is not None:
+        return await cmd_create_from_file(args)
+    if args.topic_name is None:
+        print("create: give a topic-name, or --from-file FILE", file=sys.stderr)
+        sys.exit(2)
     config: dict = {"topic-name": args.topic_name}
     if args.type:
         config["topic-type"] = args.type
@@ -90,118 +95,280 @@ async def cmd_create(args) -> None:
         config["max-subscribers"] = args.max_subs
     if args.expires is not None:
         config["expiration-date"] = args.expires
+    if args.notify_interval is not None:
+        config["notify-interval"] = args.notify_interval
+    if args.history_depth is not None:
+        config["history-depth"] = args.history_depth
+    if args.suppress_duplicates:
+        config["suppress-duplicates"] = True
     if args.init is not None:
         init = args.init
         config["initialize"] = init.encode() if isinstance(init, str) else init
 
-    async with _coap_ctx() as ctx:
-        broker = _broker_uri(args.broker)
-        r = await _req(ctx, "POST", f"{broker}/ps",
-                       payload=_encode(config),
-                       content_format=CT_PUBSUB_CBOR)
-        if r.code == aiocoap.CREATED:
-            loc = "/".join(r.opt.location_path)
-            print(f"Created: {broker}/{loc}")
-            print(_pretty(_decode(r.payload)))
-        else:
-            print(f"Error: {r.code}", file=sys.stderr)
+    async with PubSubClient(args.broker) as ps:
+        topic_url, created = await ps.create(config)
+        print(f"Created: {topic_url}")
+        print(_pretty(created))
+
+
+def _parse_filter(spec: str) -> tuple[list[str], dict]:
+    """``key`` and ``key=value`` items of a --filter spec, as property names
+    that must be present and property values that must match."""
+    names, values = [], {}
+    for item in spec.split(","):
+        k, eq, v = (part.strip() for part in item.partition("="))
+        if k not in TOPIC_KEYS:
+            print(f"Unknown filter key: {k!r}", file=sys.stderr)
             sys.exit(1)
+        if eq:
+            values.update(_parse_kv([f"{k}={v}"]))
+        else:
+            names.append(k)
+    return names, values
 
 
 async def cmd_fetch(args) -> None:
-    filter_keys = [k.strip() for k in args.filter.split(",")]
-    unknown = [k for k in filter_keys if k not in TOPIC_KEYS]
-    if unknown:
-        print(f"Unknown filter keys: {unknown}", file=sys.stderr)
-        sys.exit(1)
-    numeric_keys = [TOPIC_KEYS[k] for k in filter_keys]
-    payload = cbor2.dumps({TOPIC_KEYS["conf-filter"]: numeric_keys})
-
-    async with _coap_ctx() as ctx:
-        broker = _broker_uri(args.broker)
-        msg = aiocoap.Message(code=aiocoap.numbers.codes.Code.FETCH,
-                              uri=f"{broker}/ps",
-                              payload=payload)
-        msg.opt.content_format = CT_PUBSUB_CBOR
-        r = await ctx.request(msg).response
-        print(r.payload.decode())
+    names, values = _parse_filter(args.filter)
+    async with PubSubClient(args.broker) as ps:
+        print(await ps.fetch(names, values))
 
 
 async def cmd_update(args) -> None:
-    updates = _parse_kv(args.fields)
-    async with _coap_ctx() as ctx:
-        r = await _req(ctx, "POST", _broker_uri(args.topic_url),
-                       payload=_encode(updates),
-                       content_format=CT_PUBSUB_CBOR)
-        if r.code == aiocoap.CHANGED:
-            print(_pretty(_decode(r.payload)))
-        else:
-            print(f"Error: {r.code}", file=sys.stderr)
-            sys.exit(1)
+    async with PubSubClient(args.broker) as ps:
+        print(_pretty(await ps.update(_broker_uri(args.topic_url), _parse_kv(args.fields))))
 
 
 async def cmd_patch(args) -> None:
-    updates = _parse_kv(args.fields)
-    async with _coap_ctx() as ctx:
-        msg = aiocoap.Message(code=aiocoap.numbers.codes.Code.iPATCH,
-                              uri=_broker_uri(args.topic_url),
-                              payload=_encode(updates))
-        msg.opt.content_format = CT_PUBSUB_CBOR
-        r = await ctx.request(msg).response
-        if r.code == aiocoap.CHANGED:
-            print(_pretty(_decode(r.payload)))
-        else:
-            print(f"Error: {r.code}", file=sys.stderr)
-            sys.exit(1)
+    async with PubSubClient(args.broker) as ps:
+        print(_pretty(await ps.patch(_broker_uri(args.topic_url), _parse_kv(args.fields))))
 
 
 async def cmd_delete(args) -> None:
-    async with _coap_ctx() as ctx:
-        r = await _req(ctx, "DELETE", _broker_uri(args.topic_url))
+    async with PubSubClient(args.broker) as ps:
+        r = await ps.request("DELETE", _broker_uri(args.topic_url))
         print(f"{r.code}")
 
 
+def _load_batch(path: str, default_format: int | None) -> dict:
+    """Read a batch file: JSON mapping topic-data path to a payload string,
+    or to ``{"payload": ..., "format": ...}``."""
+    with (sys.stdin if path == "-" else open(path)) as f:
+        entries = json.load(f)
+    updates = {}
+    for data_path, value in entries.items():
+        if isinstance(value, dict):
+            payload, fmt = value["payload"], value.get("format", default_format)
+        else:
+            payload, fmt = value, default_format
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        updates[data_path] = payload.encode() if fmt is None else [payload.encode(), fmt]
+    return updates
+
+
+async def cmd_publish_batch(args) -> None:
+    updates = _load_batch(args.batch, args.format)
+    async with PubSubClient(args.data_url) as ps:
+        results = await ps.publish_batch(updates)
+    for data_path, code in results.items():
+        print(f"{code}  {data_path}")
+    if any(not code.startswith("2.") for code in results.values()):
+        sys.exit(1)
+
+
+async def cmd_publish_stream(args) -> None:
+    """Publish each line of stdin as a value, until EOF, over one context.
+
+    Values are sent one at a time unless --inflight allows more; pipelined
+    values may reach the broker out of order.
+    """
+    loop = asyncio.get_running_loop()
+    data_url = _broker_uri(args.data_url)
+    sent = failed = 0
+    pending: set[asyncio.Task] = set()
+
+    def done(task: asyncio.Task) -> None:
+        nonlocal failed
+        pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            failed += 1
+            print(f"Error: {task.exception()}", file=sys.stderr)
+
+    async with PubSubClient(data_url, inflight=args.inflight) as ps:
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.buffer.readline)
+            if not line:
+                break
+            payload = line.rstrip(b"\r\n")
+            if not payload:
+                continue
+            if len(pending) >= args.inflight:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.create_task(ps.publish(data_url, payload, args.format))
+            task.add_done_callback(done)
+            pending.add(task)
+            sent += 1
+        if pending:
+            await asyncio.wait(pending)
+    print(f"Published {sent - failed} of {sent} values", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
 async def cmd_publish(args) -> None:
+    if args.batch is not None:
+        return await cmd_publish_batch(args)
+    if args.payload is None:
+        print("publish: give a payload, - for stdin, or --batch FILE", file=sys.stderr)
+        sys.exit(2)
+    if args.payload == "-":
+        return await cmd_publish_stream(args)
     payload = args.payload.encode() if isinstance(args.payload, str) else args.payload
-    async with _coap_ctx() as ctx:
-        r = await _req(ctx, "PUT", _broker_uri(args.data_url),
-                       payload=payload,
-                       content_format=args.format)
+    async with PubSubClient(args.data_url) as ps:
+        r = await ps.request("PUT", _broker_uri(args.data_url),
+                             payload=payload, content_format=args.format)
         print(f"{r.code}")
 
 
 async def cmd_read(args) -> None:
-    async with _coap_ctx() as ctx:
-        r = await _req(ctx, "GET", _broker_uri(args.data_url))
-        if r.code == aiocoap.CONTENT:
-            print(r.payload.decode(errors="replace"))
-        else:
-            print(f"{r.code}", file=sys.stderr)
-            sys.exit(1)
+    async with PubSubClient(args.data_url) as ps:
+        r = await ps.read(_broker_uri(args.data_url))
+        print(r.payload.decode(errors="replace"))
 
 
-async def cmd_sub(args) -> None:
-    """Subscribe to a topic-data resource, print updates until Ctrl-C."""
-    async with _coap_ctx() as ctx:
-        msg = aiocoap.Message(code=aiocoap.GET,
-                              uri=_broker_uri(args.data_url),
-                              observe=0)
-        req = ctx.request(msg)
-        r = await req.response
-        if r.opt.observe is None:
-            print("Subscription rejected (max-subscribers reached or resource not found)")
-            print(r.payload.decode(errors="replace"))
-            return
-        print(f"[subscribe] {r.payload.decode(errors='replace')}")
+async def cmd_history(args) -> None:
+    """Print a topic's retained values, one ``seq [format] payload`` line each."""
+    async with PubSubClient(args.data_url) as ps:
+        entries = await ps.history(_broker_uri(args.data_url), since=args.since, last=args.last)
+    for seq, fmt, payload in entries:
+        label = "" if fmt is None else f" [{fmt}]"
+        print(f"{seq}{label} {payload.decode(errors='replace')}")
+
+
+async def _sub_one(data_url: str) -> None:
+    async with PubSubClient(data_url) as ps:
+        label = "[subscribe]"
         try:
-            async for obs in req.observation:
-                print(f"[update]    {obs.payload.decode(errors='replace')}")
-        except aiocoap.error.NotObservable:
+            async for obs in ps.subscribe(data_url):
+                print(f"{label} {obs.payload.decode(errors='replace')}")
+                label = "[update]   "
             print("[end] Resource no longer observable")
-        except KeyboardInterrupt:
-            pass
+        except PubSubError as e:
+            print("Subscription rejected (max-subscribers reached or resource not found)")
+            print(e.response.payload.decode(errors="replace"))
+
+
+class _SubStats:
+    """Update counts and inter-arrival times of a multi-topic subscription."""
+
+    def __init__(self, targets: list[str]):
+        self.started = self.mark = time.monotonic()
+        self.updates = self.updates_at_mark = 0
+        self.drops = 0
+        self.active = 0
+        # target -> [notifications, last arrival, sum of gaps, longest gap]
+        self.topics = {target: [0, None, 0.0, 0.0] for target in targets}
+
+    def record(self, target: str, now: float) -> None:
+        topic = self.topics[target]
+        if topic[1] is not None:
+            gap = now - topic[1]
+            topic[2] += gap
+            topic[3] = max(topic[3], gap)
+        topic[0] += 1
+        topic[1] = now
+        self.updates += 1
+
+    @staticmethod
+    def mean_gap(topic: list) -> float | None:
+        return topic[2] / (topic[0] - 1) if topic[0] > 1 else None
+
+    def line(self) -> str:
+        now = time.monotonic()
+        rate = (self.updates - self.updates_at_mark) / max(now - self.mark, 1e-9)
+        self.mark, self.updates_at_mark = now, self.updates
+        gaps = sorted(g for g in map(self.mean_gap, self.topics.values()) if g is not None)
+        spread = ("  inter-arrival p50 {:.3f}s p99 {:.3f}s max {:.3f}s".format(
+                      bench.percentile(gaps, 50), bench.percentile(gaps, 99), gaps[-1])
+                  if gaps else "")
+        return (f"[stats] {rate:.1f} updates/s  {self.active}/{len(self.topics)} observed"
+                f"{spread}  drops {self.drops}")
+
+    def summary(self) -> str:
+        lines = [f"{'topic':<40} {'updates':>8} {'mean gap':>9} {'max gap':>9}"]
+        for target, topic in self.topics.items():
+            mean = self.mean_gap(topic)
+            lines.append(f"{target:<40} {topic[0]:>8} "
+                         f"{'-' if mean is None else f'{mean:.3f}s':>9} "
+                         f"{'-' if topic[0] < 2 else f'{topic[3]:.3f}s':>9}")
+        return "\n".join(lines)
+
+
+async def cmd_sub(args) -> None:
+    """Subscribe to one or many topic-data resources, print updates until Ctrl-C.
+
+    With several URLs, or --filter on a broker, all topics are observed
+    over one context and every update is one ``time topic payload`` line;
+    aggregate stats go to stderr every --stats seconds and, per topic,
+    when the subscription ends.
+    """
+    if args.filter is None and len(args.data_url) == 1:
+        return await _sub_one(_broker_uri(args.data_url[0]))
+    if args.filter is not None and len(args.data_url) != 1:
+        print("sub: --filter takes the broker as its only URI", file=sys.stderr)
+        sys.exit(2)
+
+    async with PubSubClient(args.data_url[0], inflight=args.inflight) as ps:
+        if args.filter is not None:
+            targets = await ps.topic_data(*_parse_filter(args.filter))
+            if not targets:
+                print("No topics match the filter", file=sys.stderr)
+                sys.exit(1)
+        else:
+            targets = [_broker_uri(url) for url in args.data_url]
+
+        stats = _SubStats(targets)
+        seen: set[str] = set()
+
+        async def report() -> None:
+            while True:
+                await asyncio.sleep(args.stats)
+                print(stats.line(), file=sys.stderr, flush=True)
+
+        reporter = asyncio.create_task(report()) if args.stats > 0 else None
+        try:
+            async for target, message in ps.subscribe_many(targets):
+                stamp = time.strftime("%H:%M:%S") + f".{int(time.time() * 1000) % 1000:03d}"
+                if isinstance(message, aiocoap.Message):
+                    payload = message.payload.decode(errors="replace")
+                    if not message.code.is_successful():
+                        # The broker's last word before it ends the observation
+                        print(f"{stamp} {target} [{message.code}] {payload}")
+                        continue
+                    if target not in seen:
+                        seen.add(target)
+                        stats.active += 1
+                    stats.record(target, time.monotonic())
+                    print(f"{stamp} {target} {payload}")
+                    continue
+                stats.drops += 1
+                if target in seen:
+                    stats.active -= 1
+                reason = "ended" if message is None else f"dropped: {message}"
+                print(f"{stamp} {target} [{reason}]")
         finally:
-            req.observation.cancel()
+            if reporter is not None:
+                reporter.cancel()
+            print(stats.line(), file=sys.stderr)
+            print(stats.summary(), file=sys.stderr)
+
+
+async def cmd_metrics(args) -> None:
+    async with PubSubClient(args.broker) as ps:
+        if args.prometheus:
+            print(await ps.metrics(accept=0), end="")
+        else:
+            print(_pretty(await ps.metrics()))
 
 
 async def cmd_demo(args) -> None:
@@ -209,7 +376,7 @@ async def cmd_demo(args) -> None:
     broker = _broker_uri(args.broker)
     print(f"\n=== CoAP PubSub Demo — broker: {broker} ===\n")
 
-    async with _coap_ctx() as ctx:
+    async with PubSubClient(broker) as ps:
 
         # 1. Create topic with initialize
         print("1. Create 'temperature' topic (with initialize)")
@@ -221,90 +388,73 @@ async def cmd_demo(args) -> None:
             "observer-check":       3600,
             "initialize":           b'{"v":20.0}',
         }
-        r = await _req(ctx, "POST", f"{broker}/ps",
-                       payload=_encode(config),
-                       content_format=CT_PUBSUB_CBOR)
-        if r.code != aiocoap.CREATED:
-            print(f"  Failed: {r.code}")
+        try:
+            topic_url, cfg = await ps.create(config)
+        except PubSubError as e:
+            print(f"  Failed: {e.code}")
             return
-        loc = "/".join(r.opt.location_path)
-        topic_url = f"{broker}/{loc}"
-        cfg = _decode(r.payload)
-        data_url = f"{broker}/{cfg['topic-data']}"
+        data_url = ps.uri(cfg["topic-data"])
         print(f"  Topic config : {topic_url}")
         print(f"  Topic data   : {data_url}")
 
         # 2. List topics
         print("\n2. List all topics")
-        r = await _req(ctx, "GET", f"{broker}/ps")
-        print(f"  {r.payload.decode()}")
+        print(f"  {await ps.topics()}")
 
         # 3. Read config
         print("\n3. Read topic configuration")
-        r = await _req(ctx, "GET", topic_url)
-        print(_pretty(_decode(r.payload)))
+        print(_pretty(await ps.config(topic_url)))
 
         # 4. Read pre-populated data
         print("\n4. Read topic-data (pre-populated by 'initialize')")
-        r = await _req(ctx, "GET", data_url)
+        r = await ps.request("GET", data_url)
         print(f"  {r.code}  {r.payload.decode(errors='replace')}")
 
         # 5. Publish
         print("\n5. Publish new sensor reading")
-        r = await _req(ctx, "PUT", data_url, payload=b'{"v":22.5}')
-        print(f"  {r.code}")
+        code = await ps.publish(data_url, b'{"v":22.5}')
+        print(f"  {code}")
 
         # 6. Read back
         print("\n6. Read latest value")
-        r = await _req(ctx, "GET", data_url)
+        r = await ps.read(data_url)
         print(f"  {r.payload.decode(errors='replace')}")
 
         # 7. iPATCH
         print("\n7. Patch observer-check to 7200")
-        msg = aiocoap.Message(code=aiocoap.numbers.codes.Code.iPATCH,
-                              uri=topic_url,
-                              payload=_encode({"observer-check": 7200}))
-        msg.opt.content_format = CT_PUBSUB_CBOR
-        r = await ctx.request(msg).response
-        print(f"  {r.code}")
-        if r.payload:
-            print(_pretty(_decode(r.payload)))
+        print(_pretty(await ps.patch(topic_url, {"observer-check": 7200})))
 
         # 8. FETCH
         print("\n8. FETCH topics with conf-filter [topic-name, topic-type]")
-        filt = cbor2.dumps({TOPIC_KEYS["conf-filter"]: [
-            TOPIC_KEYS["topic-name"], TOPIC_KEYS["topic-type"],
-        ]})
-        msg = aiocoap.Message(code=aiocoap.numbers.codes.Code.FETCH,
-                              uri=f"{broker}/ps",
-                              payload=filt)
-        msg.opt.content_format = CT_PUBSUB_CBOR
-        r = await ctx.request(msg).response
-        print(f"  {r.payload.decode()}")
+        print(f"  {await ps.fetch(['topic-name', 'topic-type'])}")
 
         # 9. Delete topic-data
         print("\n9. DELETE topic-data (revert to HALF CREATED)")
-        r = await _req(ctx, "DELETE", data_url)
+        r = await ps.request("DELETE", data_url)
         print(f"  {r.code}")
 
         # 10. Verify HALF CREATED
         print("\n10. GET topic-data — expect 4.04 Not Found")
-        r = await _req(ctx, "GET", data_url)
+        r = await ps.request("GET", data_url)
         print(f"  {r.code}")
 
         # 11. Re-publish
         print("\n11. Publish again — topic returns to FULLY CREATED (2.01 Created)")
-        r = await _req(ctx, "PUT", data_url, payload=b'{"v":23.1}')
-        print(f"  {r.code}")
+        code = await ps.publish(data_url, b'{"v":23.1}')
+        print(f"  {code}")
 
         # 12. Delete topic
         print("\n12. Delete topic (cascades to topic-data)")
-        r = await _req(ctx, "DELETE", topic_url)
+        r = await ps.request("DELETE", topic_url)
         print(f"  {r.code}")
 
         print("\n=== Demo complete ===\n")
 
 
+async def cmd_bench(args) -> None:
+    await bench.run(args)
+
+
 # ---------------------------------------------------------------------------
 # Argument parsing
 # ---------------------------------------------------------------------------
@@ -339,18 +489,29 @@ def main() -> None:
 
     p = sub.add_parser("create", help="Create a new topic")
     p.add_argument("broker")
-    p.add_argument("topic_name", metavar="topic-name")
+    p.add_argument("topic_name", metavar="topic-name", nargs="?")
+    p.add_argument("--from-file", dest="from_file", metavar="FILE",
+                   help='Create every topic in a JSON array of configs ("-" for stdin)')
+    p.add_argument("--chunk", type=int, default=1000,
+                   help="Topics per request with --from-file (default: 1000)")
     p.add_argument("--type", help="topic-type")
     p.add_argument("--format", type=int, dest="format",
                    help="topic-content-format (CoAP CT number)")
     p.add_argument("--max-subs", type=int, dest="max_subs")
     p.add_argument("--expires", type=int, help="expiration-date (epoch int)")
+    p.add_argument("--notify-interval", type=float, dest="notify_interval",
+                   help="notify-interval: min seconds between notifications (conflates publishes)")
+    p.add_argument("--history-depth", type=int, dest="history_depth",
+                   help="history-depth: published values the broker keeps for late joiners")
+    p.add_argument("--suppress-duplicates", action="store_true", dest="suppress_duplicates",
+                   help="suppress-duplicates: don't notify when a publish repeats the current value")
     p.add_argument("--init", help="initialize: initial payload string for topic-data")
 
     p = sub.add_parser("fetch", help="FETCH topics filtered by property keys")
     p.add_argument("broker")
     p.add_argument("--filter", required=True,
-                   help="Comma-separated property names, e.g. topic-name,topic-type")
+                   help="Comma-separated property names, or name=value to match a value, "
+                        "e.g. topic-name,topic-type=sensor")
 
     p = sub.add_parser("update", help="Full config replacement (POST) on topic resource")
     p.add_argument("broker")
@@ -367,20 +528,47 @@ def main() -> None:
     p.add_argument("topic_url", metavar="topic-url")
 
     p = sub.add_parser("publish", help="Publish data to a topic-data resource")
-    p.add_argument("data_url", metavar="data-url")
-    p.add_argument("payload")
+    p.add_argument("data_url", metavar="data-url",
+                   help="Topic-data URI, or the broker with --batch")
+    p.add_argument("payload", nargs="?",
+                   help='Value to publish; "-" publishes each line of stdin')
+    p.add_argument("--inflight", type=int, default=1,
+                   help="With -, values in flight at once (default: 1, keeps their order)")
+    p.add_argument("--batch", metavar="FILE",
+                   help='Publish to many topics in one request; FILE ("-" for stdin) is JSON '
+                        'mapping topic-data path to payload or {"payload": ..., "format": N}')
     p.add_argument("--format", type=int, dest="format",
                    help="Content-Format number")
 
     p = sub.add_parser("read", help="Read value or resource from any CoAP URI")
     p.add_argument("data_url", metavar="data-url")
 
-    p = sub.add_parser("sub", help="Subscribe to topic-data (Ctrl-C to stop)")
+    p = sub.add_parser("history", help="Read values retained by a topic with history-depth")
     p.add_argument("data_url", metavar="data-url")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--since", type=int, help="Values published after this seq")
+    group.add_argument("--last", type=int, default=10, help="The last N values (default: 10)")
+
+    p = sub.add_parser("sub", help="Subscribe to topic-data (Ctrl-C to stop)")
+    p.add_argument("data_url", metavar="data-url", nargs="+",
+                   help="Topic-data URIs to observe, or the broker with --filter")
+    p.add_argument("--filter",
+                   help="Observe the topics matching a FETCH filter, e.g. topic-type=sensor")
+    p.add_argument("--stats", type=float, default=10.0,
+                   help="Seconds between aggregate stats on stderr; 0 disables (default: 10)")
+    p.add_argument("--inflight", type=int, default=16,
+                   help="Subscriptions registered at once (default: 16)")
+
+    p = sub.add_parser("metrics", help="Show broker metrics (/ps/.metrics)")
+    p.add_argument("broker")
+    p.add_argument("--prometheus", action="store_true",
+                   help="Print the Prometheus text format instead of JSON")
 
     p = sub.add_parser("demo", help="Full walkthrough of all pubsub operations")
     p.add_argument("broker")
 
+    bench.add_parser(sub)
+
     args = parser.parse_args()
 
     handlers = {
@@ -392,11 +580,20 @@ def main() -> None:
         "delete":  cmd_delete,
         "publish": cmd_publish,
         "read":    cmd_read,
+        "history": cmd_history,
         "sub":     cmd_sub,
+        "metrics": cmd_metrics,
         "demo":    cmd_demo,
+        "bench":   cmd_bench,
     }
 
-    asyncio.run(handlers[args.cmd](args))
+    try:
+        asyncio.run(handlers[args.cmd](args))
+    except KeyboardInterrupt:
+        pass
+    except PubSubError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 """Shared CBOR codec for CoAP PubSub (draft-ietf-core-coap-pubsub-19)."""
 
+import json
+from datetime import datetime
+
 import cbor2
 
 TOPIC_KEYS: dict[str, int] = {
@@ -13,41 +16,133 @@ TOPIC_KEYS: dict[str, int] = {
     "observer-check":       7,
     "initialize":           8,
     "conf-filter":          10,
+    # Broker extensions, not part of draft-19; negative keys stay clear of
+    # the draft's registry
+    "notify-interval":      -1,
+    "history-depth":        -2,
+    "origin":               -3,
+    "suppress-duplicates":  -4,
 }
 TOPIC_KEYS_REV: dict[int, str] = {v: k for k, v in TOPIC_KEYS.items()}
 
 CT_PUBSUB_CBOR = 606
+CT_CBOR = 60
 CT_JSON = 50
 CT_LINK_FORMAT = 40
 
 IMMUTABLE_FIELDS = {"topic-name", "topic-data", "resource-type"}
 
 
+_EXPIRATION_KEY = TOPIC_KEYS["expiration-date"]
+
+
+def _epoch(value):
+    """expiration-date as epoch seconds, however cbor2 handed it over."""
+    # cbor2 turns tag 1 into a datetime by itself
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, cbor2.CBORTag) and value.tag == 1:
+        return value.value
+    return value
+
+
+def decode_topic_cbor(payload: bytes) -> dict:
+    """Decode an application/core-pubsub+cbor topic config."""
+    raw = cbor2.loads(payload)
+    if not isinstance(raw, dict):
+        raise ValueError("topic configuration must be a CBOR map")
+    return _topic_names(raw)
+
+
+def _topic_names(raw: dict) -> dict:
+    result = {}
+    for k, v in raw.items():
+        name = TOPIC_KEYS_REV.get(k)
+        if name is None:
+            name = str(k)
+        elif k == _EXPIRATION_KEY:
+            v = _epoch(v)
+        result[name] = v
+    return result
+
+
 def decode_topic_payload(payload: bytes, content_format: int | None = None) -> dict:
     """Decode a topic config payload (CBOR with numeric keys, or JSON fallback)."""
     if content_format == CT_PUBSUB_CBOR:
-        raw = cbor2.loads(payload)
-        result = {}
-        for k, v in raw.items():
-            name = TOPIC_KEYS_REV.get(k, str(k))
-            if name == "expiration-date" and isinstance(v, cbor2.CBORTag) and v.tag == 1:
-                v = v.value
-            result[name] = v
-        return result
-    import json
-    return json.loads(payload)
+        return decode_topic_cbor(payload)
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        raise ValueError("topic configuration must be a JSON object")
+    return data
+
+
+def is_topic_list(payload: bytes, content_format: int | None = None) -> bool:
+    """Whether a POST to the collection carries an array of topic configs."""
+    if content_format == CT_PUBSUB_CBOR:
+        return bool(payload) and payload[0] >> 5 == 4   # CBOR major type 4: array
+    return payload.lstrip()[:1] == b"["
+
+
+def decode_topic_list(payload: bytes, content_format: int | None = None) -> list:
+    """Decode an array of topic configs; items that are not maps are kept
+    as they are, for the caller to report."""
+    if content_format == CT_PUBSUB_CBOR:
+        items = cbor2.loads(payload)
+        if not isinstance(items, list):
+            raise ValueError("expected a CBOR array of topic configurations")
+        return [_topic_names(item) if isinstance(item, dict) else item for item in items]
+    items = json.loads(payload)
+    if not isinstance(items, list):
+        raise ValueError("expected a JSON array of topic configurations")
+    return items
+
+
+def _array_head(length: int) -> bytes:
+    if length < 24:
+        return bytes((0x80 | length,))
+    if length < 0x100:
+        return bytes((0x98, length))
+    if length < 0x10000:
+        return b"\x99" + length.to_bytes(2, "big")
+    return b"\x9a" + length.to_bytes(4, "big")
+
+
+def encode_cbor_array(encoded_items: list[bytes]) -> bytes:
+    """CBOR array of already encoded items."""
+    return _array_head(len(encoded_items)) + b"".join(encoded_items)
+
+
+def encode_created(location: str, encoded_config: bytes) -> bytes:
+    """Bulk creation result ``{"location": ..., "config": ...}`` around an
+    already encoded config."""
+    return b"\xa2" + cbor2.dumps("location") + cbor2.dumps(location) \
+        + cbor2.dumps("config") + encoded_config
+
+
+def decode_created(payload: bytes) -> list[dict]:
+    """Bulk creation results, each config's properties named as by
+    decode_topic_cbor."""
+    results = cbor2.loads(payload)
+    if not isinstance(results, list):
+        raise ValueError("bulk creation results must be a CBOR array")
+    for result in results:
+        if isinstance(result, dict) and isinstance(result.get("config"), dict):
+            result["config"] = _topic_names(result["config"])
+    return results
 
 
 def encode_topic_config(d: dict) -> bytes:
-    """Encode a topic config dict to CBOR with numeric keys."""
+    """Encode a topic config dict to CBOR with numeric keys.
+
+    Topics keep the result cached (TopicResource.encoded_config), so this
+    runs once per config change rather than once per GET.
+    """
     cbor_map = {}
     for name, value in d.items():
-        if value is None:
-            continue
         key = TOPIC_KEYS.get(name)
-        if key is None:
+        if key is None or value is None:
             continue
-        if name == "expiration-date":
+        if key == _EXPIRATION_KEY:
             value = cbor2.CBORTag(1, int(value))
         cbor_map[key] = value
     return cbor2.dumps(cbor_map)
@@ -0,0 +1,235 @@
+"""Broker-to-broker topic federation for the CoAP PubSub broker.
+
+Mirror topics of peer brokers, so subscribers at each site can use a
+nearby broker.
+
+  --peer URI          a broker whose topics to mirror (repeatable)
+  --mirror GLOB       mirror only topics whose topic-name matches
+                      (repeatable; default: all of them)
+  --peer-interval S   seconds between listings of each peer (default 10)
+
+Every peer-interval seconds each peer's /ps is listed; the request carries
+the ETag of the last listing, so an unchanged one costs a 2.03. Topics not
+seen before have their configuration read, and a selected topic gets a
+local mirror: a topic with the same topic-name, content format, type and
+history-depth, under a topic-data path of this broker. The broker observes
+the peer's topic-data and publishes every notification to the mirror, so
+a value crosses between two sites once, however many subscribers each has.
+
+Loop prevention: a mirror's configuration carries ``origin``, the URI of
+the topic-data it copies, and topics that have an origin are never
+mirrored. Two brokers peering with each other, or a ring of them, each
+hold one copy of every original topic; a broker peers with every broker
+whose topics it wants. Mirrors refuse publishes, configuration changes
+and deletes with 4.05, since those are made at the origin.
+
+A mirror whose topic disappears from the peer's listing is deleted, and
+one missing here is created again. An observation that ends otherwise
+(the topic is half created, the peer restarts) is re-established at the
+next listing.
+"""
+
+import asyncio
+import fnmatch
+import logging
+import re
+
+import aiocoap
+
+from codec import CT_LINK_FORMAT
+from pubsub import PubSubClient, PubSubError, broker_uri
+
+log = logging.getLogger("pubsub-federation")
+
+DEFAULT_PEER_INTERVAL = 10.0
+
+# Properties a mirror copies from the topic it mirrors
+MIRRORED_FIELDS = ("topic-name", "topic-content-format", "topic-type", "history-depth")
+
+_LINK_TARGET = re.compile(r"<([^>]*)>")
+
+
+class Mirror:
+    """A local topic following one topic of a peer."""
+
+    __slots__ = ("origin", "path", "task")
+
+    def __init__(self, origin: str, path: str):
+        self.origin = origin   # URI of the peer's topic-data
+        self.path = path       # config path of the local topic
+        self.task: asyncio.Task | None = None
+
+
+class Peer:
+    """What this broker knows of one peer's collection."""
+
+    __slots__ = ("client", "etag", "topics", "listed")
+
+    def __init__(self, client: PubSubClient):
+        self.client = client
+        self.etag: bytes | None = None
+        self.listed = False
+        # Peer config path -> origin URI of its mirror, or None if not mirrored
+        self.topics: dict[str, str | None] = {}
+
+
+class Federation:
+    """Keeps the mirrors of one broker in step with its peers' topics."""
+
+    def __init__(self, collection, peers: list[str], patterns: list[str] = (),
+                 interval: float = DEFAULT_PEER_INTERVAL):
+        self.collection = collection
+        self.peer_uris = [broker_uri(uri).rstrip("/") for uri in peers]
+        self.patterns = list(patterns)
+        self.interval = interval
+        self.mirrors: dict[str, Mirror] = {}   # origin -> mirror
+        self.peers: dict[str, Peer] = {}
+        self.mirrored = 0   # values published to mirrors
+        self._context: aiocoap.Context | None = None
+
+    def selected(self, config: dict) -> bool:
+        if "origin" in config:
+            return False
+        name = str(config.get("topic-name"))
+        return not self.patterns or any(fnmatch.fnmatchcase(name, p) for p in self.patterns)
+
+    def _peer_of(self, origin: str) -> str | None:
+        for uri in self.peer_uris:
+            if origin.startswith(uri + "/"):
+                return uri
+        return None
+
+    def _adopt(self) -> None:
+        """Take over the mirrors restored from --data-dir; those of brokers
+        that are no longer peers are deleted."""
+        for path, topic in list(self.collection.topics.items()):
+            origin = topic.config.get("origin")
+            if origin is None:
+                continue
+            self.mirrors[origin] = Mirror(origin, path)
+            if self._peer_of(origin) is None:
+                self._drop(origin, b"Origin no longer mirrored")
+
+    async def run(self) -> None:
+        self._context = await aiocoap.Context.create_client_context()
+        for uri in self.peer_uris:
+            self.peers[uri] = Peer(PubSubClient(uri, context=self._context))
+        self._adopt()
+        log.info("Mirroring topics of %s", ", ".join(self.peer_uris))
+        try:
+            while True:
+                for uri, peer in self.peers.items():
+                    try:
+                        await self._sync(peer)
+                    except (PubSubError, aiocoap.error.Error) as e:
+                        log.warning("Listing topics of %s failed: %s", uri, e)
+                await asyncio.sleep(self.interval)
+        finally:
+            tasks = [m.task for m in self.mirrors.values() if m.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._context.shutdown()
+
+    async def _sync(self, peer: Peer) -> None:
+        """List *peer*'s topics and bring the mirrors of its topics in line."""
+        request = aiocoap.Message(code=aiocoap.GET, uri=peer.client.uri("ps"))
+        if peer.etag is not None:
+            request.opt.etags = (peer.etag,)
+        response = await self._context.request(request).response
+        if response.code == aiocoap.CONTENT and response.opt.content_format == CT_LINK_FORMAT:
+            peer.etag = response.opt.etag
+            await self._update(peer, _LINK_TARGET.findall(response.payload.decode()))
+        elif response.code != aiocoap.VALID:
+            raise PubSubError(response)
+
+        for path, origin in list(peer.topics.items()):
+            if origin is None:
+                continue
+            mirror = self.mirrors.get(origin)
+            if mirror is None or mirror.path not in self.collection.topics:
+                # Not created (topic cap, say), or gone here since: forget
+                # the topic, so the next full listing creates it anew
+                if mirror is not None:
+                    del self.mirrors[origin]
+                    if mirror.task is not None:
+                        mirror.task.cancel()
+                del peer.topics[path]
+                peer.etag = None
+            elif mirror.task is None or mirror.task.done():
+                mirror.task = asyncio.create_task(self._follow(peer, mirror))
+
+    async def _update(self, peer: Peer, listed: list[str]) -> None:
+        listed = [path.lstrip("/") for path in listed]
+        for path in set(peer.topics) - set(listed):
+            origin = peer.topics.pop(path)
+            if origin is not None:
+                self._drop(origin, b"Topic deleted at its origin")
+
+        for path in listed:
+            if path in peer.topics:
+                continue
+            try:
+                config = await peer.client.config(path)
+            except PubSubError as e:
+                log.warning("Reading %s failed: %s", peer.client.uri(path), e)
+                continue
+            if not self.selected(config):
+                peer.topics[path] = None
+                continue
+            origin = peer.client.uri(config["topic-data"])
+            peer.topics[path] = origin
+            if origin not in self.mirrors:
+                self._create(origin, config)
+
+        if not peer.listed:
+            # Restored mirrors of topics deleted while this broker was down
+            peer.listed = True
+            kept = set(peer.topics.values())
+            for origin in [o for o in self.mirrors
+                           if self._peer_of(o) == peer.client.broker and o not in kept]:
+                self._drop(origin, b"Topic deleted at its origin")
+
+    def _create(self, origin: str, config: dict) -> None:
+        data = {name: config[name] for name in MIRRORED_FIELDS if name in config}
+        path, error = self.collection.create_topic(data, origin=origin)
+        if error is not None:
+            log.warning("Not mirroring %s: %s %s", origin, error.code,
+                        error.payload.decode(errors="replace"))
+            return
+        self.mirrors[origin] = Mirror(origin, path)
+        log.info("Mirroring %s as /%s", origin, path)
+
+    def _drop(self, origin: str, reason: bytes) -> None:
+        mirror = self.mirrors.pop(origin, None)
+        if mirror is None:
+            return
+        if mirror.task is not None:
+            mirror.task.cancel()
+        topic = self.collection.topics.get(mirror.path)
+        if topic is not None:
+            topic.destroy(reason)
+        log.info("Removed mirror /%s of %s", mirror.path, origin)
+
+    async def _follow(self, peer: Peer, mirror: Mirror) -> None:
+        """Publish the values of *mirror*'s origin to it while observing works."""
+        first = True
+        try:
+            async for notification in peer.client.subscribe(mirror.origin):
+                topic = self.collection.topics.get(mirror.path)
+                if topic is None:
+                    return
+                data_res = self.collection.topics.data(topic.config["topic-data"])
+                payload = notification.payload
+                # After a reconnect, the current value may be the one already held
+                if first and data_res._value == payload:
+                    first = False
+                    continue
+                first = False
+                code = data_res.publish(payload, notification.opt.content_format)
+                if code == aiocoap.REQUEST_ENTITY_TOO_LARGE:
+                    log.warning("Value of %s exceeds --max-payload; not mirrored", mirror.origin)
+                else:
+                    self.mirrored += 1
+        except (PubSubError, aiocoap.error.Error) as e:
+            log.debug("Observation of %s ended: %s", mirror.origin, e)
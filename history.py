@@ -0,0 +1,115 @@
+"""Per-topic publish history for the CoAP PubSub broker.
+
+A topic with ``history-depth`` N keeps its last N published values in a
+ring buffer, preallocated once at that size. Values are numbered by a
+per-topic sequence number that starts at 1 with the first publish after
+the broker starts, so subscribers that lost their connection can ask for
+what they missed:
+
+    GET /ps/data/<id>?since=<seq>   values published after <seq>
+    GET /ps/data/<id>?last=<n>      the last <n> values
+
+The answer is a CBOR sequence (application/cbor-seq) of
+``[seq, content_format, payload]`` arrays, oldest first. Sequence numbers
+are not persisted: a ``since`` ahead of the topic's latest seq means the
+broker restarted, and is answered with the whole buffer.
+
+All rings of a broker share a HistoryBudget of payload bytes. A publish
+that would exceed it evicts the topic's own oldest values first; a value
+that still doesn't fit is numbered but not kept.
+"""
+
+import cbor2
+
+CT_CBOR_SEQ = 63
+
+
+class HistoryBudget:
+    """Payload bytes held by all history rings of a broker."""
+
+    __slots__ = ("limit", "used")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+
+class HistoryRing:
+    """The last *depth* values of one topic, oldest evicted first."""
+
+    __slots__ = ("depth", "budget", "_payloads", "_formats", "_start", "_count", "seq")
+
+    def __init__(self, depth: int, budget: HistoryBudget, seq: int = 0):
+        self.depth = depth
+        self.budget = budget
+        self._payloads: list[bytes | None] = [None] * depth
+        self._formats: list[int | None] = [None] * depth
+        self._start = 0   # index of the oldest value
+        self._count = 0
+        self.seq = seq   # seq of the latest publish
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _evict_oldest(self) -> None:
+        i = self._start
+        self.budget.used -= len(self._payloads[i])
+        self._payloads[i] = None
+        self._formats[i] = None
+        self._start = (i + 1) % self.depth
+        self._count -= 1
+
+    def append(self, payload: bytes, content_format: int | None) -> int:
+        """Record a publish; returns its seq."""
+        self.seq += 1
+        if self._count == self.depth:
+            self._evict_oldest()
+        budget = self.budget
+        while self._count and budget.used + len(payload) > budget.limit:
+            self._evict_oldest()
+        if budget.used + len(payload) > budget.limit:
+            # Too big for what's left of the budget; the seq shows the gap
+            return self.seq
+        i = (self._start + self._count) % self.depth
+        self._payloads[i] = payload
+        self._formats[i] = content_format
+        self._count += 1
+        budget.used += len(payload)
+        return self.seq
+
+    def clear(self) -> None:
+        while self._count:
+            self._evict_oldest()
+
+    def resized(self, depth: int) -> "HistoryRing":
+        """A ring of *depth* holding this one's newest values; this one is emptied."""
+        ring = HistoryRing(depth, self.budget, self.seq)
+        for _, content_format, payload in self.entries(self._count - min(depth, self._count)):
+            i = ring._count
+            ring._payloads[i] = payload
+            ring._formats[i] = content_format
+            ring._count += 1
+            self.budget.used += len(payload)
+        self.clear()
+        return ring
+
+    def entries(self, skip: int = 0):
+        """``(seq, content_format, payload)`` oldest first, after *skip* values."""
+        first_seq = self.seq - self._count + 1
+        for k in range(skip, self._count):
+            i = (self._start + k) % self.depth
+            yield first_seq + k, self._formats[i], self._payloads[i]
+
+    def since(self, seq: int):
+        if seq >= self.seq:
+            return self.entries() if seq > self.seq else iter(())
+        first_seq = self.seq - self._count + 1
+        return self.entries(max(0, seq + 1 - first_seq))
+
+    def last(self, n: int):
+        return self.entries(max(0, self._count - n))
+
+
+def encode_entries(entries) -> bytes:
+    """CBOR sequence of ``[seq, content_format, payload]`` arrays."""
+    return b"".join(cbor2.dumps([seq, fmt, payload]) for seq, fmt, payload in entries)
@@ -0,0 +1,147 @@
+"""Logging setup for the CoAP PubSub broker.
+
+Log configuration for the broker's command line; importing the broker
+configures nothing, so an application embedding it keeps its own.
+
+  --log-level LEVEL | LOGGER=LEVEL   root level, or one logger's (repeatable)
+  --log-format text | json           plain lines, or one JSON object per line
+  --log-sample LOGGER=RATE           keep about RATE (0..1) of that logger's
+                                     records below WARNING (repeatable)
+  --log-queue                        format and write records on a background
+                                     thread instead of the event loop
+
+Sampling keeps every n-th record (n = 1/RATE) of a logger and its
+children, decided before the record is formatted or queued. With
+--log-queue, the event loop only puts records on a queue; a QueueListener
+thread formats and writes them.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+LOG_FORMATS = ("text", "json")
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+def parse_level(spec: str) -> tuple[str | None, int]:
+    """``LEVEL`` or ``LOGGER=LEVEL`` as (logger name or None, level)."""
+    name, _, level = spec.rpartition("=")
+    value = logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        raise ValueError(f"unknown log level {level!r}")
+    return name or None, value
+
+
+def parse_sample(spec: str) -> tuple[str, float]:
+    """``LOGGER=RATE`` as (logger name, rate)."""
+    name, sep, rate = spec.rpartition("=")
+    value = float(rate)
+    if not sep or not name or not 0 <= value <= 1:
+        raise ValueError("expected LOGGER=RATE with RATE between 0 and 1")
+    return name, value
+
+
+class SamplingFilter(logging.Filter):
+    """Keep every n-th record below WARNING of the sampled loggers."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.every = {name: (round(1 / rate) if rate else 0) for name, rate in rates.items()}
+        self.seen = dict.fromkeys(rates, 0)
+        self._resolved: dict[str, str | None] = {}   # logger name -> sampled ancestor
+
+    def _sampled_as(self, name: str) -> str | None:
+        key = self._resolved.get(name, "")
+        if key == "":
+            key = None
+            for prefix in self.every:
+                if name == prefix or name.startswith(prefix + "."):
+                    if key is None or len(prefix) > len(key):
+                        key = prefix
+            self._resolved[name] = key
+        return key
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = self._sampled_as(record.name)
+        if key is None:
+            return True
+        every = self.every[key]
+        if not every:
+            return False
+        self.seen[key] += 1
+        return (self.seen[key] - 1) % every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener's thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message (and worker)."""
+
+    def __init__(self, worker: int | None = None):
+        super().__init__()
+        self.worker = worker
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                    + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if self.worker is not None:
+            entry["worker"] = self.worker
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(
+    levels: list[tuple[str | None, int]] = (),
+    fmt: str = "text",
+    sample: list[tuple[str, float]] = (),
+    use_queue: bool = False,
+    worker: int | None = None,
+) -> logging.handlers.QueueListener | None:
+    """Set up the root logger as the command line asks; returns the started
+    QueueListener with *use_queue*, which the caller stops at exit."""
+    if fmt == "json":
+        formatter: logging.Formatter = JsonFormatter(worker)
+    elif worker is not None:
+        formatter = logging.Formatter(f"[worker {worker}] {TEXT_FORMAT}")
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+    output = logging.StreamHandler()
+    output.setFormatter(formatter)
+
+    listener = None
+    if use_queue:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        handler: logging.Handler = DeferredQueueHandler(records)
+        listener = logging.handlers.QueueListener(records, output)
+    else:
+        handler = output
+    if sample:
+        handler.addFilter(SamplingFilter(dict(sample)))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    for name, level in levels:
+        logging.getLogger(name).setLevel(level)
+    if listener is not None:
+        listener.start()
+    return listener
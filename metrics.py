@@ -0,0 +1,237 @@
+"""Broker metrics: counters, handler latency histograms and their export.
+
+Counters and latency histograms recorded on the broker's hot paths.
+
+Recording is an integer increment, or a bisect over a dozen bucket bounds
+for a latency sample, so it stays on in production. Everything derived
+(topics by state, observers per topic, rates) is computed when the metrics
+are read, from GET /ps/.metrics or the optional HTTP export:
+
+  GET /ps/.metrics                       CBOR map (default)
+  GET /ps/.metrics  Accept: 50           the same as JSON
+  GET /ps/.metrics  Accept: 0            Prometheus text format
+  http://<host>:<metrics-port>/metrics   Prometheus text format
+"""
+
+import asyncio
+import bisect
+import collections
+import functools
+import logging
+import time
+
+log = logging.getLogger("pubsub-metrics")
+
+# Upper bounds (seconds) of the handler latency buckets; one more bucket
+# catches everything slower
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+# Rates are averaged over the reads within this many seconds
+RATE_WINDOW = 60.0
+
+
+class Histogram:
+    """Latency histogram with fixed buckets (Prometheus-style on export)."""
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """``(le, count)`` pairs as in a Prometheus histogram."""
+        result = []
+        total = 0
+        for bound, n in zip((*LATENCY_BUCKETS, float("inf")), self.counts):
+            total += n
+            result.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return result
+
+
+class Metrics:
+    """Counters of one broker process."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.publishes = 0
+        self.publishes_suppressed = 0   # duplicates not stored (suppress-duplicates)
+        self.notifications = 0   # notifications triggered, one per observer
+        self.subscriptions_rejected = 0   # refused by max-subscribers
+        self.handlers: dict[str, Histogram] = {}
+        self.profile = None   # profiling.HandlerProfile while a profile runs
+        self._samples: collections.deque = collections.deque(maxlen=1024)
+
+    def record(self, handler: str, seconds: float) -> None:
+        hist = self.handlers.get(handler)
+        if hist is None:
+            hist = self.handlers[handler] = Histogram()
+        hist.record(seconds)
+
+    def rates(self) -> dict[str, float]:
+        """Publishes and notifications per second, averaged over about the
+        last RATE_WINDOW seconds of reads (since startup on the first read)."""
+        now = time.monotonic()
+        samples = self._samples
+        while len(samples) > 1 and now - samples[1][0] >= RATE_WINDOW:
+            samples.popleft()
+        since, publishes, notifications = samples[0] if samples else (self.started, 0, 0)
+        samples.append((now, self.publishes, self.notifications))
+        elapsed = now - since
+        if elapsed <= 0:
+            return {"publishes": 0.0, "notifications": 0.0}
+        return {
+            "publishes": round((self.publishes - publishes) / elapsed, 3),
+            "notifications": round((self.notifications - notifications) / elapsed, 3),
+        }
+
+
+def timed(render):
+    """Record a render method's latency in ``self.metrics``, if set, under
+    the method's qualified name (and, while a profile runs, in the profile,
+    with the topic's path for topic resources)."""
+    handler = render.__qualname__
+
+    @functools.wraps(render)
+    async def timed_render(self, request):
+        metrics = self.metrics
+        if metrics is None:
+            return await render(self, request)
+        start = time.perf_counter()
+        try:
+            return await render(self, request)
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.record(handler, seconds)
+            if metrics.profile is not None:
+                metrics.profile.record(handler, getattr(self, "path", None), seconds)
+    return timed_render
+
+
+def profiled(render):
+    """Time a render method only while a profile runs: for handlers such as
+    GET, which renders every notification too, and is not worth a
+    histogram sample each time."""
+    handler = render.__qualname__
+
+    @functools.wraps(render)
+    async def profiled_render(self, request):
+        metrics = self.metrics
+        if metrics is None or metrics.profile is None:
+            return await render(self, request)
+        start = time.perf_counter()
+        try:
+            return await render(self, request)
+        finally:
+            metrics.profile.record(handler, getattr(self, "path", None),
+                                   time.perf_counter() - start)
+    return profiled_render
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(report: dict) -> str:
+    """Render a metrics report (see CollectionResource.metrics_report)."""
+    lines = [
+        "# HELP pubsub_topics Topics by state",
+        "# TYPE pubsub_topics gauge",
+    ]
+    for state, n in report["topics"].items():
+        lines.append(f'pubsub_topics{{state="{state}"}} {n}')
+
+    lines += [
+        "# HELP pubsub_observers Observers per topic (topics without observers are omitted)",
+        "# TYPE pubsub_observers gauge",
+    ]
+    for topic, counts in report["observers"].items():
+        for kind, n in counts.items():
+            lines.append(f'pubsub_observers{{topic="{_label(topic)}",resource="{kind}"}} {n}')
+
+    for name, help_text in (
+        ("publishes", "Values published to topic-data resources"),
+        ("publishes_suppressed", "Publishes of the value held already, not stored (suppress-duplicates)"),
+        ("notifications", "Notifications triggered, one per observer"),
+        ("subscriptions_rejected", "Subscriptions refused by max-subscribers"),
+        ("observers_pruned", "Observers dropped after failing an observer-check"),
+        ("topics_expired", "Topics removed at their expiration-date"),
+        ("notifications_dropped", "Notifications skipped for slow observers (policy drop)"),
+        ("notifications_conflated", "Notifications deferred for slow observers (policy conflate)"),
+        ("observers_deregistered", "Slow observers deregistered (policy deregister)"),
+        ("requests_rate_limited", "Requests refused with 4.29 by a per-client rate limit"),
+        ("topics_refused", "Topic creations refused by --max-topics"),
+        ("values_mirrored", "Values of peer brokers' topics published to local mirrors"),
+    ):
+        lines += [
+            f"# HELP pubsub_{name}_total {help_text}",
+            f"# TYPE pubsub_{name}_total counter",
+            f"pubsub_{name}_total {report['counters'][name]}",
+        ]
+
+    lines += [
+        "# HELP pubsub_history_bytes Payload bytes held in topic histories",
+        "# TYPE pubsub_history_bytes gauge",
+        f"pubsub_history_bytes {report['history_bytes']}",
+    ]
+
+    for name, value in report["rates"].items():
+        lines += [
+            f"# TYPE pubsub_{name}_per_second gauge",
+            f"pubsub_{name}_per_second {value}",
+        ]
+
+    lines += [
+        "# HELP pubsub_handler_seconds Request handler latency",
+        "# TYPE pubsub_handler_seconds histogram",
+    ]
+    for handler, hist in report["handlers"].items():
+        for le, n in hist["buckets"]:
+            lines.append(f'pubsub_handler_seconds_bucket{{handler="{handler}",le="{le}"}} {n}')
+        lines.append(f'pubsub_handler_seconds_sum{{handler="{handler}"}} {hist["sum"]}')
+        lines.append(f'pubsub_handler_seconds_count{{handler="{handler}"}} {hist["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+async def serve_http(report, host: str, port: int) -> asyncio.AbstractServer:
+    """Serve ``prometheus_text(report())`` at /metrics over plain HTTP/1.0."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5.0)
+            while (await asyncio.wait_for(reader.readline(), 5.0)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+                status, body = b"200 OK", prometheus_text(report()).encode()
+            else:
+                status, body = b"404 Not Found", b"not found\n"
+            writer.write(
+                b"HTTP/1.0 " + status + b"\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    log.info("Metrics exported on http://%s:%d/metrics", host, port)
+    return server
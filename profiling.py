@@ -0,0 +1,287 @@
+"""On-demand profiling of the CoAP PubSub broker.
+
+Profile a running broker, started and stopped by a signal or a request.
+
+With --profile-dir DIR the broker accepts:
+
+  kill -USR1 <pid>              start a profile, or stop the running one
+                                (with --workers, the main process passes
+                                it on to every worker)
+  POST   /ps/.profile[?mode=sample|deterministic&seconds=S]
+                                start one (stopping by itself after S seconds)
+  DELETE /ps/.profile           stop it; the summary is the response (JSON)
+  GET    /ps/.profile           whether one is running, and the last summary
+
+A profile records the time of every request handler (render_*), per
+handler and per topic, and the slowest requests, together with one of:
+
+  sample         a thread reads the event loop thread's stack every
+                 --profile-interval seconds; cheap enough for production,
+                 written as collapsed stacks (flamegraph.pl, speedscope)
+  deterministic  cProfile on the event loop thread: exact call counts, at
+                 several times the cost of every Python call; written as
+                 a .pstats file (python -m pstats, snakeviz)
+
+Each profile leaves ``profile-<pid>-<time>.txt`` in DIR, with the slowest
+handlers, topics and requests and the hottest functions, next to the
+profiler's own output. Without a running profile, the handlers pay one
+attribute check each.
+"""
+
+import asyncio
+import collections
+import cProfile
+import heapq
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+log = logging.getLogger("pubsub-profiling")
+
+PROFILE_MODES = ("sample", "deterministic")
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Rows of each table in a report
+TOP = 20
+
+
+class HandlerProfile:
+    """Request handler timings recorded while a profile runs."""
+
+    __slots__ = ("handlers", "topics", "slowest")
+
+    def __init__(self):
+        self.handlers: dict[str, list] = {}   # handler -> [count, total, max]
+        self.topics: dict[str, list] = {}     # topic path -> [count, total, max]
+        self.slowest: list[tuple[float, str, str]] = []   # min-heap of TOP requests
+
+    @staticmethod
+    def _add(table: dict, key: str, seconds: float) -> None:
+        stats = table.get(key)
+        if stats is None:
+            table[key] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def record(self, handler: str, path: str | None, seconds: float) -> None:
+        """One request to *handler*, on the topic resource at *path* if any."""
+        self._add(self.handlers, handler, seconds)
+        if path is not None:
+            self._add(self.topics, path, seconds)
+        entry = (seconds, handler, path or "")
+        if len(self.slowest) < TOP:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    @staticmethod
+    def _table(stats: dict, key: str) -> list[dict]:
+        rows = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)[:TOP]
+        return [{key: name, "count": count, "total_ms": round(total * 1e3, 3),
+                 "mean_ms": round(total / count * 1e3, 3), "max_ms": round(longest * 1e3, 3)}
+                for name, (count, total, longest) in rows]
+
+    def report(self) -> dict:
+        """The handlers and topics that took the most time, and the slowest requests."""
+        return {
+            "handlers": self._table(self.handlers, "handler"),
+            "topics": self._table(self.topics, "path"),
+            "slowest": [{"ms": round(seconds * 1e3, 3), "handler": handler, "path": path}
+                        for seconds, handler, path in sorted(self.slowest, reverse=True)],
+        }
+
+
+# ---------------------------------------------------------------------------
+# Profilers
+# ---------------------------------------------------------------------------
+
+class _Sampler:
+    """Samples one thread's Python stack from a thread of its own."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self._target = threading.get_ident()
+        self._labels: dict = {}   # code object -> frame label
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pubsub-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        return label
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+                self.samples += 1
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self) -> str:
+        """The functions most samples were in, by their own code and with callees."""
+        own: collections.Counter = collections.Counter()
+        inclusive: collections.Counter = collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = max(self.samples, 1)
+        lines = [f"{self.samples} samples, every {self.interval * 1e3:g} ms", "",
+                 "  own %  with callees %  function"]
+        for frame, count in own.most_common(TOP):
+            lines.append(f"{count / total:7.1%}  {inclusive[frame] / total:14.1%}  {frame}")
+        return "\n".join(lines)
+
+
+class _Deterministic:
+    """cProfile on the calling thread."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def write(self, path: str) -> None:
+        self.profile.dump_stats(path)
+
+    def summary(self) -> str:
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(TOP)
+        stats.sort_stats("tottime").print_stats(TOP)
+        return out.getvalue().strip()
+
+
+class Profiler:
+    """Starts and stops profiles of the broker, writing each to *directory*.
+
+    *metrics* is the broker's Metrics: while a profile runs, its ``profile``
+    is the HandlerProfile the request handlers record into.
+    """
+
+    def __init__(self, metrics, directory: str, mode: str = "sample",
+                 interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.metrics = metrics
+        self.directory = directory
+        self.mode = mode
+        self.interval = interval
+        self.last: dict | None = None   # summary of the last profile
+        self._profiler = None
+        self._running_mode: str | None = None
+        self._started = 0.0
+        self._deadline = None   # TimerHandle of a profile with a duration
+
+    @property
+    def active(self) -> bool:
+        return self._profiler is not None
+
+    def status(self) -> dict:
+        status = {"active": self.active, "directory": self.directory, "last": self.last}
+        if self.active:
+            status["mode"] = self._running_mode
+            status["seconds"] = round(time.monotonic() - self._started, 3)
+        return status
+
+    def start(self, mode: str | None = None, seconds: float | None = None) -> None:
+        """Start a profile, stopped after *seconds* if given.
+        Raises RuntimeError if one is running already."""
+        if self.active:
+            raise RuntimeError("A profile is running already")
+        mode = mode or self.mode
+        os.makedirs(self.directory, exist_ok=True)
+        self._profiler = _Sampler(self.interval) if mode == "sample" else _Deterministic()
+        self._running_mode = mode
+        self._started = time.monotonic()
+        self.metrics.profile = HandlerProfile()
+        self._profiler.start()
+        if seconds is not None:
+            self._deadline = asyncio.get_running_loop().call_later(seconds, self.stop)
+        log.info("Profiling (%s)%s", mode, f" for {seconds:g} s" if seconds is not None else "")
+
+    def stop(self) -> dict:
+        """Stop the running profile and write it out; returns its summary.
+        Raises RuntimeError if none is running."""
+        if not self.active:
+            raise RuntimeError("No profile is running")
+        profiler, self._profiler = self._profiler, None
+        profiler.stop()
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+        handlers, self.metrics.profile = self.metrics.profile, None
+        elapsed = time.monotonic() - self._started
+
+        stamp = os.path.join(self.directory, "profile-%d-%s" % (
+            os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        base, n = stamp, 1
+        while os.path.exists(base + ".txt"):   # several profiles in one second
+            n += 1
+            base = f"{stamp}-{n}"
+        output = base + (".collapsed" if isinstance(profiler, _Sampler) else ".pstats")
+        profiler.write(output)
+        summary = {"mode": self._running_mode, "seconds": round(elapsed, 3),
+                   "files": [base + ".txt", output]}
+        summary.update(handlers.report())
+        with open(base + ".txt", "w") as f:
+            f.write(_format(summary, profiler.summary()))
+        self.last = summary
+        log.info("Profile of %.1f s written to %s", elapsed, base + ".txt")
+        return summary
+
+    def toggle(self) -> None:
+        """Start a profile, or stop the running one (the signal handler)."""
+        try:
+            if self.active:
+                self.stop()
+            else:
+                self.start()
+        except OSError as e:
+            log.error("Profiling failed: %s", e)
+
+
+def _format(summary: dict, profiler_summary: str) -> str:
+    lines = [f"Profile of pid {os.getpid()}: {summary['mode']}, {summary['seconds']} s", ""]
+    for title, rows, key in (("Handlers by total time", summary["handlers"], "handler"),
+                             ("Topics by total time", summary["topics"], "path")):
+        lines += [title, f"{'count':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  {key}"]
+        lines += [f"{r['count']:>8} {r['total_ms']:>10.3f} {r['mean_ms']:>9.3f} "
+                  f"{r['max_ms']:>9.3f}  {r[key]}" for r in rows]
+        lines.append("")
+    lines += ["Slowest requests", f"{'ms':>9}  handler  path"]
+    lines += [f"{r['ms']:>9.3f}  {r['handler']}  {r['path']}" for r in summary["slowest"]]
+    lines += ["", profiler_summary, ""]
+    return "\n".join(lines)
@@ -0,0 +1,309 @@
+"""CoAP Publish-Subscribe client library (draft-ietf-core-coap-pubsub-19).
+
+PubSubClient keeps one aiocoap context open for its whole lifetime, so a
+script doing thousands of operations pays for the context (sockets,
+message-ID and token state) once:
+
+    async with PubSubClient("coap://localhost") as ps:
+        topic_url, config = await ps.create({"topic-name": "temperature"})
+        await ps.publish(config["topic-data"], b'{"v":22.5}')
+        async for update in ps.subscribe(config["topic-data"]):
+            print(update.payload)
+
+Methods take absolute URIs or paths relative to the broker (the
+``topic-data`` and Location-Path values the broker hands out). At most
+*inflight* requests are outstanding at a time; start more with
+``asyncio.gather`` and they queue on the client, pipelined over the one
+context. Unexpected response codes raise PubSubError.
+"""
+
+import asyncio
+import contextlib
+import io
+import re
+
+import aiocoap
+import cbor2
+
+from codec import (
+    TOPIC_KEYS, CT_PUBSUB_CBOR, CT_CBOR,
+    encode_cbor_array, decode_created, decode_topic_payload, encode_topic_config,
+)
+
+DEFAULT_INFLIGHT = 16
+
+_LINK_TARGET = re.compile(r"<([^>]*)>")
+
+
+def broker_uri(addr: str) -> str:
+    return addr if addr.startswith("coap") else f"coap://{addr}"
+
+
+class PubSubError(Exception):
+    """A request was answered with an unexpected response code."""
+
+    def __init__(self, response: aiocoap.Message):
+        self.response = response
+        detail = response.payload.decode(errors="replace")
+        super().__init__(f"{response.code}" + (f" {detail}" if detail else ""))
+
+    @property
+    def code(self):
+        return self.response.code
+
+
+class PubSubClient:
+    """Client for one broker over a single long-lived aiocoap context."""
+
+    def __init__(self, broker: str, inflight: int = DEFAULT_INFLIGHT,
+                 context: aiocoap.Context | None = None):
+        self.broker = broker_uri(broker).rstrip("/")
+        self.context = context
+        self._own_context = context is None
+        self._slots = asyncio.Semaphore(inflight)
+
+    async def __aenter__(self) -> "PubSubClient":
+        if self.context is None:
+            self.context = await aiocoap.Context.create_client_context()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._own_context and self.context is not None:
+            await self.context.shutdown()
+            self.context = None
+
+    def uri(self, target: str) -> str:
+        """Absolute URI of *target*, a URI or a path relative to the broker."""
+        if "://" in target:
+            return target
+        return f"{self.broker}/{target.lstrip('/')}"
+
+    async def request(self, method: str, target: str, payload: bytes = b"",
+                      content_format: int | None = None,
+                      accept: int | None = None,
+                      if_match: bytes | None = None,
+                      if_none_match: bool = False) -> aiocoap.Message:
+        """Send one request and return the response, whatever its code."""
+        code = getattr(aiocoap.numbers.codes.Code, method)
+        msg = aiocoap.Message(code=code, uri=self.uri(target))
+        if payload:
+            msg.payload = payload
+        if content_format is not None:
+            msg.opt.content_format = content_format
+        if accept is not None:
+            msg.opt.accept = accept
+        if if_match is not None:
+            msg.opt.if_match = [if_match]
+        if if_none_match:
+            msg.opt.if_none_match = True
+        async with self._slots:
+            return await self.context.request(msg).response
+
+    async def _expect(self, expected, method: str, target: str, **kwargs) -> aiocoap.Message:
+        r = await self.request(method, target, **kwargs)
+        if r.code not in expected:
+            raise PubSubError(r)
+        return r
+
+    # -----------------------------------------------------------------------
+    # Topic configuration
+    # -----------------------------------------------------------------------
+
+    async def create(self, config: dict) -> tuple[str, dict]:
+        """Create a topic; returns its URI and the configuration the broker
+        settled on."""
+        r = await self._expect((aiocoap.CREATED,), "POST", "ps",
+                               payload=encode_topic_config(config),
+                               content_format=CT_PUBSUB_CBOR)
+        return (self.uri("/".join(r.opt.location_path)),
+                decode_topic_payload(r.payload, r.opt.content_format))
+
+    async def create_many(self, configs: list[dict]) -> list[dict]:
+        """Create topics in one bulk request; one ``{"location", "config"}``
+        map (the config with named properties, as from create) or
+        ``{"error", "message"}`` map per config, in order."""
+        r = await self.request("POST", "ps",
+                               payload=encode_cbor_array([encode_topic_config(c) for c in configs]),
+                               content_format=CT_PUBSUB_CBOR)
+        if r.opt.content_format != CT_CBOR:
+            raise PubSubError(r)
+        return decode_created(r.payload)
+
+    async def topics(self) -> str:
+        """The collection's topic links (application/link-format)."""
+        r = await self._expect((aiocoap.CONTENT,), "GET", "ps")
+        return r.payload.decode()
+
+    async def fetch(self, filter_keys: list[str] = (), values: dict | None = None) -> str:
+        """Links of the topics that have all of *filter_keys* and all the
+        property *values* (FETCH on /ps)."""
+        query = {TOPIC_KEYS[k]: v for k, v in (values or {}).items()}
+        if filter_keys:
+            query[TOPIC_KEYS["conf-filter"]] = [TOPIC_KEYS[k] for k in filter_keys]
+        r = await self._expect((aiocoap.CONTENT,), "FETCH", "ps",
+                               payload=cbor2.dumps(query), content_format=CT_PUBSUB_CBOR)
+        return r.payload.decode()
+
+    async def topic_data(self, filter_keys: list[str] = (), values: dict | None = None) -> list[str]:
+        """topic-data paths of the topics a FETCH filter matches."""
+        links = await self.fetch(filter_keys, values)
+        configs = await asyncio.gather(*(self.config(path) for path in _LINK_TARGET.findall(links)))
+        return [config["topic-data"] for config in configs]
+
+    async def config(self, topic: str) -> dict:
+        r = await self._expect((aiocoap.CONTENT,), "GET", topic)
+        return decode_topic_payload(r.payload, r.opt.content_format)
+
+    async def update(self, topic: str, config: dict) -> dict:
+        """Replace a topic's configuration (POST); returns the new one."""
+        r = await self._expect((aiocoap.CHANGED,), "POST", topic,
+                               payload=encode_topic_config(config),
+                               content_format=CT_PUBSUB_CBOR)
+        return decode_topic_payload(r.payload, r.opt.content_format)
+
+    async def patch(self, topic: str, fields: dict) -> dict:
+        """Change some of a topic's configuration (iPATCH); returns the new one."""
+        r = await self._expect((aiocoap.CHANGED,), "iPATCH", topic,
+                               payload=encode_topic_config(fields),
+                               content_format=CT_PUBSUB_CBOR)
+        return decode_topic_payload(r.payload, r.opt.content_format)
+
+    async def delete(self, target: str) -> None:
+        """Delete a topic, or a topic-data resource (back to half created)."""
+        await self._expect((aiocoap.DELETED,), "DELETE", target)
+
+    # -----------------------------------------------------------------------
+    # Topic data
+    # -----------------------------------------------------------------------
+
+    async def publish(self, data: str, payload: bytes,
+                      content_format: int | None = None,
+                      if_match: bytes | None = None,
+                      if_none_match: bool = False) -> aiocoap.numbers.codes.Code:
+        """PUT a value; returns 2.01 for the first value of a topic, else 2.04.
+        With *if_match* (an ETag) the value replaces only that one; with
+        *if_none_match* only a topic that has no value yet. Otherwise
+        PubSubError with 4.12 Precondition Failed."""
+        r = await self._expect((aiocoap.CREATED, aiocoap.CHANGED), "PUT", data,
+                               payload=payload, content_format=content_format,
+                               if_match=if_match, if_none_match=if_none_match)
+        return r.code
+
+    async def publish_batch(self, updates: dict) -> dict[str, str]:
+        """Publish to many topics in one request to /ps/.publish; *updates*
+        maps topic-data path to a payload or ``[payload, content_format]``.
+        Returns the dotted response code per path."""
+        r = await self.request("POST", "ps/.publish",
+                               payload=cbor2.dumps(updates), content_format=CT_CBOR)
+        if not r.code.is_successful():
+            raise PubSubError(r)
+        return cbor2.loads(r.payload)
+
+    async def read(self, target: str) -> aiocoap.Message:
+        return await self._expect((aiocoap.CONTENT,), "GET", target)
+
+    async def history(self, data: str, since: int | None = None,
+                      last: int | None = None) -> list[tuple[int, int | None, bytes]]:
+        """Retained values ``(seq, content_format, payload)``, oldest first."""
+        query = f"since={since}" if since is not None else f"last={last}"
+        r = await self._expect((aiocoap.CONTENT,), "GET", f"{self.uri(data)}?{query}")
+        decoder = cbor2.CBORDecoder(io.BytesIO(r.payload))
+        entries = []
+        while decoder.fp.tell() < len(r.payload):
+            seq, fmt, payload = decoder.decode()
+            entries.append((seq, fmt, payload))
+        return entries
+
+    async def subscribe(self, data: str):
+        """Observe a resource: yields the current value, then every
+        notification, until the broker ends the observation or the caller
+        stops iterating. Raises PubSubError if the subscription is refused."""
+        msg = aiocoap.Message(code=aiocoap.GET, uri=self.uri(data), observe=0)
+        async with self._slots:
+            req = self.context.request(msg)
+            first = await req.response
+        try:
+            if first.opt.observe is None:
+                raise PubSubError(first)
+            yield first
+            async for notification in req.observation:
+                yield notification
+        except aiocoap.error.NotObservable:
+            return
+        finally:
+            if not req.observation.cancelled:
+                req.observation.cancel()
+
+    async def watch(self, filter_keys: list[str] = (), values: dict | None = None):
+        """Observe every topic a FETCH filter matches, also those created
+        later: yields ``(topic_data, content_format, payload)`` for each
+        value change, with *content_format* and *payload* None once the
+        topic has no value any more (or no longer matches). Values too big
+        for a notification are read from the topic-data."""
+        query = {TOPIC_KEYS[k]: v for k, v in (values or {}).items()}
+        if filter_keys:
+            query[TOPIC_KEYS["conf-filter"]] = [TOPIC_KEYS[k] for k in filter_keys]
+        msg = aiocoap.Message(code=aiocoap.FETCH, uri=self.uri("ps"), observe=0,
+                              payload=cbor2.dumps(query), content_format=CT_PUBSUB_CBOR)
+        async with self._slots:
+            req = self.context.request(msg)
+            first = await req.response
+        try:
+            if first.opt.observe is None:
+                raise PubSubError(first)
+            notifications = aiter(req.observation)
+            response = first
+            while True:
+                decoder = cbor2.CBORDecoder(io.BytesIO(response.payload))
+                while decoder.fp.tell() < len(response.payload):
+                    entry = decoder.decode()
+                    if len(entry) == 1:
+                        yield entry[0], None, None
+                        continue
+                    path, content_format, payload = entry
+                    if payload is None:
+                        payload = (await self.read(path)).payload
+                    yield path, content_format, payload
+                response = await anext(notifications)
+        except (aiocoap.error.NotObservable, StopAsyncIteration):
+            return
+        finally:
+            if not req.observation.cancelled:
+                req.observation.cancel()
+
+    async def subscribe_many(self, targets):
+        """Observe many resources at once; yields ``(target, message)`` for
+        the notifications of all of them as they arrive. Once a target's
+        observation is over, *message* is None if the broker ended it, or
+        the exception it failed with (PubSubError if it was refused)."""
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump(target: str) -> None:
+            try:
+                async with contextlib.aclosing(self.subscribe(target)) as notifications:
+                    async for notification in notifications:
+                        queue.put_nowait((target, notification))
+                queue.put_nowait((target, None))
+            except (PubSubError, aiocoap.error.Error) as e:
+                queue.put_nowait((target, e))
+
+        pumps = [asyncio.create_task(pump(target)) for target in targets]
+        try:
+            active = len(pumps)
+            while active:
+                item = await queue.get()
+                if not isinstance(item[1], aiocoap.Message):
+                    active -= 1
+                yield item
+        finally:
+            for task in pumps:
+                task.cancel()
+            await asyncio.gather(*pumps, return_exceptions=True)
+
+    async def metrics(self, accept: int = CT_CBOR):
+        """The broker's /ps/.metrics: a dict, or text with ``accept=0``."""
+        r = await self._expect((aiocoap.CONTENT,), "GET", "ps/.metrics", accept=accept)
+        return r.payload.decode() if accept == 0 else cbor2.loads(r.payload)
@@ -0,0 +1,138 @@
+"""Per-client rate limiting for the CoAP PubSub broker.
+
+Token-bucket rate limits on publish, create and FETCH, per client address.
+
+Each request class has its own limit, ``RATE[/BURST]``: a client may make
+BURST requests at once and RATE per second after that. Buckets are keyed by
+the client's address without the port, so a device can't get a fresh
+bucket by changing source port. They refill lazily when used, so checking
+one is a dict lookup and some arithmetic whatever the load, and idle
+buckets are dropped once there are many.
+
+A request over its limit is answered with 4.29 Too Many Requests, with
+Max-Age set to the seconds until the client may retry. Requests that
+create or publish many at once (array POST to /ps, POST /ps/.publish) are
+charged one token per topic, and may hold at most BURST topics (4.13
+otherwise); when they are refused, the token taken as they came in is
+given back, so a refused request costs nothing.
+"""
+
+import math
+import time
+
+import aiocoap
+from aiocoap import Message
+
+LIMITED = ("publish", "create", "fetch")
+
+# Buckets kept before idle (full) ones are dropped
+PRUNE_AT = 10000
+
+
+def parse_rate(spec: str) -> tuple[float, float]:
+    """``"RATE"`` or ``"RATE/BURST"`` as (rate, burst); burst defaults to
+    the rate, and at least 1."""
+    rate, _, burst = str(spec).partition("/")
+    rate = float(rate)
+    burst = float(burst) if burst else max(rate, 1.0)
+    if rate <= 0 or burst < 1:
+        raise ValueError("rate must be positive and burst at least 1")
+    return rate, burst
+
+
+def client_key(remote) -> str:
+    """The address a client's requests are counted under."""
+    sockaddr = getattr(remote, "sockaddr", None)
+    if sockaddr is not None:
+        return sockaddr[0]
+    return remote.hostinfo
+
+
+class RateLimiter:
+    """Token buckets of one request class, one per client."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.rejected = 0
+        self._buckets: dict[str, list[float]] = {}   # key -> [tokens, updated]
+        self._prune_at = PRUNE_AT
+
+    def take(self, key: str, n: int = 1) -> float:
+        """Take *n* tokens from *key*'s bucket. Returns 0 if they were
+        there, else the seconds until they will be (nothing is taken).
+        More than a full bucket is never there (see Admission.too_many)."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune(now)
+            bucket = self._buckets[key] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= n:
+            bucket[0] = tokens - n
+            return 0.0
+        bucket[0] = tokens
+        self.rejected += 1
+        return (n - tokens) / self.rate
+
+    def give(self, key: str, n: int = 1) -> None:
+        """Return *n* tokens taken from *key*'s bucket for a request that
+        was refused after all."""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(self.burst, bucket[0] + n)
+
+    def _prune(self, now: float) -> None:
+        full = self.burst / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if now - bucket[1] < full
+        }
+        # Pruning again only after the table doubles keeps it amortized O(1)
+        self._prune_at = max(PRUNE_AT, 2 * len(self._buckets))
+
+
+class Admission:
+    """The rate limits of one broker; a class without a limit is unlimited."""
+
+    def __init__(self, **limits: tuple[float, float] | None):
+        self.limiters: dict[str, RateLimiter] = {
+            kind: RateLimiter(*limit) for kind, limit in limits.items()
+            if limit is not None
+        }
+
+    @property
+    def rejected(self) -> int:
+        return sum(limiter.rejected for limiter in self.limiters.values())
+
+    def check(self, kind: str, remote, n: int = 1) -> Message | None:
+        """4.29 if *remote* is over its *kind* limit, else None."""
+        limiter = self.limiters.get(kind)
+        if limiter is None or n <= 0:
+            return None
+        wait = limiter.take(client_key(remote), n)
+        if not wait:
+            return None
+        response = Message(code=aiocoap.TOO_MANY_REQUESTS,
+                           payload=f"{kind} rate limit exceeded".encode())
+        response.opt.max_age = math.ceil(wait)
+        return response
+
+    def too_many(self, kind: str, n: int) -> Message | None:
+        """4.13 for a request of *n* at once that even a full *kind* bucket
+        can't pay for, else None."""
+        limiter = self.limiters.get(kind)
+        if limiter is None or n <= limiter.burst:
+            return None
+        limiter.rejected += 1
+        return Message(code=aiocoap.REQUEST_ENTITY_TOO_LARGE,
+                       payload=f"at most {int(limiter.burst)} per request "
+                               f"under the {kind} rate limit".encode())
+
+    def refund(self, kind: str, remote, n: int = 1) -> None:
+        """Give back *n* tokens *remote* was charged for a refused request."""
+        limiter = self.limiters.get(kind)
+        if limiter is not None and n > 0:
+            limiter.give(client_key(remote), n)
@@ -0,0 +1,169 @@
+"""Durable topic store for the CoAP PubSub broker.
+
+State is kept as a compacted snapshot plus an append-only journal. Every
+journal record is a CBOR array ``[seq, op, *args]`` with a strictly
+increasing sequence number:
+
+    [seq, "create",    config_path, config]
+    [seq, "config",    config_path, config]
+    [seq, "delete",    config_path]
+    [seq, "publish",   data_path, value, content_format]
+    [seq, "unpublish", data_path]
+
+A snapshot records the sequence number it covers. Taking one starts a new
+journal segment first, so the broker keeps appending while the snapshot is
+written, and segments fully covered by the snapshot are removed afterwards.
+On load, records with ``seq`` not above the snapshot's are skipped, which
+makes a crash between any two of those steps harmless.
+"""
+
+import logging
+import os
+
+import cbor2
+
+log = logging.getLogger("pubsub-store")
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+_SNAPSHOT = "snapshot.cbor"
+_SEGMENT_PREFIX = "journal-"
+_SEGMENT_SUFFIX = ".cbor"
+
+
+class TopicStore:
+
+    def __init__(self, data_dir: str, fsync: str = "interval"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}")
+        self.data_dir = data_dir
+        self.fsync = fsync
+        self._seq = 0
+        self._journal = None
+        self._segment_start = 0
+        self._unsynced = False
+        os.makedirs(data_dir, exist_ok=True)
+
+    # -- loading -------------------------------------------------------------
+
+    def load(self) -> tuple[list[list], list[list]]:
+        """Return ``(snapshot_topics, journal_tail)`` and open the journal.
+
+        Snapshot topics are ``[config_path, config, value, content_format]``
+        entries; the tail holds the journal records newer than the snapshot.
+        """
+        topics: list[list] = []
+        snap_seq = 0
+        snap_path = os.path.join(self.data_dir, _SNAPSHOT)
+        if os.path.exists(snap_path):
+            with open(snap_path, "rb") as f:
+                snap = cbor2.load(f)
+            snap_seq = snap["seq"]
+            topics = snap["topics"]
+
+        tail: list[list] = []
+        last_seq = snap_seq
+        for name in self._segments():
+            for record in self._read_segment(os.path.join(self.data_dir, name)):
+                if record[0] > snap_seq:
+                    tail.append(record)
+                last_seq = max(last_seq, record[0])
+
+        self._seq = last_seq
+        self._open_segment()
+        log.info("Loaded %d topics and %d journal records from %s",
+                 len(topics), len(tail), self.data_dir)
+        return topics, tail
+
+    def _segments(self) -> list[str]:
+        return sorted(
+            name for name in os.listdir(self.data_dir)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        )
+
+    @staticmethod
+    def _read_segment(path: str):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            while f.tell() < size:
+                pos = f.tell()
+                try:
+                    yield cbor2.load(f)
+                except (cbor2.CBORDecodeError, EOFError):
+                    # Torn write at the end of a segment from a crash: cut it
+                    # off, or records appended to this segment later would
+                    # follow the garbage and never be read
+                    log.warning("Truncating torn journal record in %s at %d", path, pos)
+                    os.truncate(path, pos)
+                    break
+
+    # -- journal -------------------------------------------------------------
+
+    def _open_segment(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+        self._segment_start = self._seq + 1
+        name = f"{_SEGMENT_PREFIX}{self._segment_start:020d}{_SEGMENT_SUFFIX}"
+        self._journal = open(os.path.join(self.data_dir, name), "ab")
+
+    def append(self, op: str, *args) -> None:
+        self._seq += 1
+        self._journal.write(cbor2.dumps([self._seq, op, *args]))
+        self._journal.flush()
+        if self.fsync == "always":
+            os.fsync(self._journal.fileno())
+        else:
+            self._unsynced = True
+
+    def sync(self) -> None:
+        """fsync the journal if anything was appended since the last sync."""
+        if self._unsynced and self._journal is not None:
+            os.fsync(self._journal.fileno())
+            self._unsynced = False
+
+    @property
+    def journal_length(self) -> int:
+        """Records appended since the last snapshot (or startup)."""
+        return self._seq - self._segment_start + 1
+
+    # -- snapshots -----------------------------------------------------------
+
+    def begin_snapshot(self) -> int:
+        """Start a new journal segment; returns the seq the snapshot covers."""
+        self.sync()
+        seq = self._seq
+        self._open_segment()
+        return seq
+
+    def write_snapshot(self, seq: int, topics: list[list]) -> None:
+        """Write a snapshot covering *seq* and drop the segments it covers.
+
+        This does blocking I/O only and may run in a worker thread.
+        """
+        snap_path = os.path.join(self.data_dir, _SNAPSHOT)
+        tmp_path = snap_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            cbor2.dump({"seq": seq, "topics": topics}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snap_path)
+        self._fsync_dir()
+
+        for name in self._segments():
+            start = int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+            if start <= seq:
+                os.remove(os.path.join(self.data_dir, name))
+        log.info("Snapshot of %d topics written at seq %d", len(topics), seq)
+
+    def _fsync_dir(self) -> None:
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        if self._journal is not None:
+            self.sync()
+            self._journal.close()
+            self._journal = None
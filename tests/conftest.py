@@ -0,0 +1,62 @@
+"""Helpers for tests that talk CoAP to a broker running in the test's loop."""
+
+import asyncio
+import contextlib
+import inspect
+import socket
+
+import aiocoap
+
+import broker
+from pubsub import PubSubClient
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def running_broker(port: int | None = None, **run_kwargs):
+    """A broker on *port* (by default a free one) of localhost, and a client of it."""
+    port = port or free_port()
+    task = asyncio.create_task(broker._run(host="127.0.0.1", port=port, **run_kwargs))
+    try:
+        async with PubSubClient(f"coap://127.0.0.1:{port}") as ps:
+            for _ in range(50):
+                if task.done():
+                    task.result()
+                try:
+                    await asyncio.wait_for(ps.topics(), 0.5)
+                    break
+                except (asyncio.TimeoutError, aiocoap.error.Error):
+                    await asyncio.sleep(0.05)
+            yield ps
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def loop_errors(loop: asyncio.AbstractEventLoop) -> list[dict]:
+    """The contexts of the errors *loop* reports from now on (unretrieved
+    task exceptions among them)."""
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    return errors
+
+
+async def wait_for(condition, timeout: float = 5.0, what: str = "a condition"):
+    """Poll *condition*, a function or coroutine function, until it returns
+    a true value."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        result = condition()
+        if inspect.isawaitable(result):
+            result = await result
+        if result:
+            return result
+        if loop.time() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.05)
@@ -0,0 +1,37 @@
+"""The load generator and the client's bulk create."""
+
+import argparse
+import asyncio
+import json
+
+import pytest
+
+import bench
+import client
+
+from conftest import running_broker
+
+
+async def _publish_limited() -> dict:
+    rates = {"create": None, "publish": (0.001, 5), "fetch": None}
+    async with running_broker(rates=rates) as ps:
+        args = argparse.Namespace(publishers=1, messages=8, inflight=4)
+        return (await bench.bench_publish(ps.broker, args))[0]
+
+
+def test_publish_times_only_values_the_broker_took():
+    result = asyncio.run(_publish_limited())
+    assert result["count"] == 5
+    assert sum(result["failed"].values()) == 3
+    assert all(code.startswith("4.29") for code in result["failed"])
+
+
+@pytest.mark.parametrize("configs", [[{"topic-name": "a"}, 1], [None], {"topic-name": "a"}])
+def test_create_from_file_needs_an_array_of_objects(tmp_path, capsys, configs):
+    path = tmp_path / "topics.json"
+    path.write_text(json.dumps(configs))
+    args = argparse.Namespace(broker="coap://127.0.0.1", from_file=str(path), chunk=10)
+    with pytest.raises(SystemExit) as exit:
+        asyncio.run(client.cmd_create_from_file(args))
+    assert exit.value.code == 2
+    assert "JSON array" in capsys.readouterr().err
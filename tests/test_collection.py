@@ -0,0 +1,63 @@
+"""The collection resource, /ps."""
+
+import asyncio
+import gc
+
+import aiocoap
+import cbor2
+
+from codec import CT_PUBSUB_CBOR, TOPIC_KEYS
+from workers import Shard
+
+from conftest import free_port, loop_errors, running_broker
+
+
+async def _observe_once(ps, code, payload=b"", content_format=None):
+    """Send *code* on /ps with Observe: 0; returns the response and whether
+    the broker took the observation."""
+    msg = aiocoap.Message(code=code, uri=ps.uri("ps"), observe=0, payload=payload)
+    if content_format is not None:
+        msg.opt.content_format = content_format
+    request = ps.context.request(msg)
+    response = await request.response
+    observed = response.opt.observe is not None
+    if not request.observation.cancelled:
+        request.observation.cancel()
+    return response, observed
+
+
+async def _refused_observations(**run_kwargs):
+    loop = asyncio.get_running_loop()
+    errors = loop_errors(loop)
+    async with running_broker(**run_kwargs) as ps:
+        await ps.create({"topic-name": "t", "topic-type": "sensor"})
+        results = [
+            await _observe_once(ps, aiocoap.GET),
+            await _observe_once(ps, aiocoap.FETCH, b"\xff", CT_PUBSUB_CBOR),
+            await _observe_once(ps, aiocoap.FETCH,
+                                cbor2.dumps({TOPIC_KEYS["topic-type"]: "sensor"}),
+                                CT_PUBSUB_CBOR),
+        ]
+        await asyncio.sleep(0.1)
+    gc.collect()
+    await asyncio.sleep(0)
+    return results, errors
+
+
+def test_refused_observations_are_answered_once():
+    results, errors = asyncio.run(_refused_observations())
+    (get, get_observed), (bad, bad_observed), (fetch, fetch_observed) = results
+    assert get.code == aiocoap.CONTENT and not get_observed
+    assert bad.code == aiocoap.BAD_REQUEST and not bad_observed
+    # FETCH is observable on a single process
+    assert fetch.code == aiocoap.CONTENT and fetch_observed
+    assert errors == []
+
+
+def test_fetch_observe_under_sharding_is_answered_once():
+    shard = Shard(0, 1, [free_port()])
+    results, errors = asyncio.run(_refused_observations(shard=shard))
+    fetch, fetch_observed = results[2]
+    assert fetch.code == aiocoap.CONTENT and not fetch_observed
+    assert b"</ps/" in fetch.payload
+    assert errors == []
@@ -0,0 +1,137 @@
+"""Two brokers mirroring each other's topics (--peer)."""
+
+import asyncio
+import contextlib
+
+import aiocoap
+
+import broker
+from federation import Federation
+
+from conftest import free_port, running_broker, wait_for
+
+INTERVAL = 0.1
+
+
+def _links(listing: str) -> list[str]:
+    return [link.split(">")[0].lstrip("<").lstrip("/") for link in listing.split(",") if link]
+
+
+async def _configs(ps) -> list[dict]:
+    return [await ps.config(path) for path in _links(await ps.topics())]
+
+
+async def _mirror_of(ps, name: str) -> dict | None:
+    for config in await _configs(ps):
+        if config.get("topic-name") == name and "origin" in config:
+            return config
+    return None
+
+
+@contextlib.asynccontextmanager
+async def _peered():
+    """Brokers A and B, each mirroring the other."""
+    port_a, port_b = free_port(), free_port()
+    async with contextlib.AsyncExitStack() as stack:
+        a = await stack.enter_async_context(running_broker(
+            port_a, peers=[f"coap://127.0.0.1:{port_b}"], peer_interval=INTERVAL))
+        b = await stack.enter_async_context(running_broker(
+            port_b, peers=[f"coap://127.0.0.1:{port_a}"], peer_interval=INTERVAL))
+        yield a, b
+
+
+async def _mirror_each_other():
+    async with _peered() as (a, b):
+        await a.create({"topic-name": "site-a"})
+        await b.create({"topic-name": "site-b"})
+        await wait_for(lambda: _mirror_of(b, "site-a"), what="A's topic on B")
+        await wait_for(lambda: _mirror_of(a, "site-b"), what="B's topic on A")
+        # Several more listing rounds: mirrors are not mirrored back
+        await asyncio.sleep(10 * INTERVAL)
+        return [len(_links(await ps.topics())) for ps in (a, b)]
+
+
+def test_brokers_mirror_each_other_without_loops():
+    assert asyncio.run(_mirror_each_other()) == [2, 2]
+
+
+async def _values_and_deletion():
+    async with _peered() as (a, b):
+        topic, config = await a.create({"topic-name": "site-a"})
+        await a.publish(config["topic-data"], b"0")
+        mirror = await wait_for(lambda: _mirror_of(b, "site-a"), what="the mirror")
+
+        received = []
+
+        async def observe():
+            async for notification in b.subscribe(mirror["topic-data"]):
+                received.append(bytes(notification.payload))
+        observer = asyncio.create_task(observe())
+        try:
+            await wait_for(lambda: received == [b"0"], what="the first value")
+            for value in (b"1", b"2", b"3"):
+                await a.publish(config["topic-data"], value)
+                await wait_for(lambda: received[-1] == value, what=value)
+        finally:
+            observer.cancel()
+            await asyncio.gather(observer, return_exceptions=True)
+
+        await a.delete(topic)
+
+        async def gone():
+            return await _mirror_of(b, "site-a") is None
+        await wait_for(gone, what="the mirror to be deleted")
+        return received
+
+
+def test_values_reach_mirror_subscribers_and_deletes_propagate():
+    assert asyncio.run(_values_and_deletion()) == [b"0", b"1", b"2", b"3"]
+
+
+async def _local_changes():
+    async with _peered() as (a, b):
+        await a.create({"topic-name": "site-a"})
+        mirror = await wait_for(lambda: _mirror_of(b, "site-a"), what="the mirror")
+        path = _links(await b.topics())[0]
+        codes = []
+        for code, target in ((aiocoap.PUT, mirror["topic-data"]),
+                             (aiocoap.DELETE, mirror["topic-data"]),
+                             (aiocoap.POST, path),
+                             (aiocoap.iPATCH, path),
+                             (aiocoap.DELETE, path)):
+            msg = aiocoap.Message(code=code, uri=b.uri(target), payload=b"{}")
+            msg.opt.content_format = 50
+            codes.append((await b.context.request(msg).response).code)
+        still_there = await _mirror_of(b, "site-a") is not None
+        return codes, still_there
+
+
+def test_mirrors_refuse_local_changes():
+    codes, still_there = asyncio.run(_local_changes())
+    assert codes == [aiocoap.METHOD_NOT_ALLOWED] * 5
+    assert still_there
+
+
+async def _recreate():
+    async with running_broker() as origin:
+        await origin.create({"topic-name": "site-a"})
+        collection = broker.CollectionResource()
+        federation = Federation(collection, [origin.broker], interval=INTERVAL)
+
+        def paths():
+            return [path for path, _ in collection.topics.items()]
+
+        task = asyncio.create_task(federation.run())
+        try:
+            first, = await wait_for(paths, what="the mirror")
+            # Removed behind the federation's back
+            collection.topics.get(first).remove()
+            return await wait_for(lambda: [p for p in paths() if p != first],
+                                  what="the mirror to be created again")
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+def test_missing_mirror_is_created_again():
+    assert len(asyncio.run(_recreate())) == 1
@@ -0,0 +1,54 @@
+"""Per-client rate limits."""
+
+import asyncio
+import json
+
+import aiocoap
+import cbor2
+
+from codec import CT_CBOR, CT_JSON
+from ratelimit import Admission, RateLimiter
+
+from conftest import running_broker
+
+
+def test_take_never_pays_for_more_than_a_full_bucket():
+    limiter = RateLimiter(rate=0.001, burst=3)
+    assert limiter.take("a", 4) > 0
+    # Nothing was taken: the full bucket still pays for three
+    assert limiter.take("a", 3) == 0
+
+
+def test_batch_larger_than_burst_is_too_large():
+    admission = Admission(create=(0.001, 3))
+    assert admission.too_many("create", 3) is None
+    assert admission.too_many("create", 4).code == aiocoap.REQUEST_ENTITY_TOO_LARGE
+    assert admission.too_many("publish", 1000) is None   # unlimited
+
+
+async def _batches() -> list[aiocoap.Message]:
+    rates = {"create": (0.001, 3), "publish": (0.001, 3), "fetch": None}
+    async with running_broker(rates=rates) as ps:
+        responses = []
+        for count in (4, 3):
+            msg = aiocoap.Message(
+                code=aiocoap.POST, uri=ps.uri("ps"),
+                payload=json.dumps([{"topic-name": f"t{count}-{i}"} for i in range(count)]).encode())
+            msg.opt.content_format = CT_JSON
+            responses.append(await ps.context.request(msg).response)
+        paths = [f"ps/data/x{i}" for i in range(4)]
+        msg = aiocoap.Message(code=aiocoap.POST, uri=ps.uri("ps/.publish"),
+                              payload=cbor2.dumps({path: b"v" for path in paths}))
+        msg.opt.content_format = CT_CBOR
+        responses.append(await ps.context.request(msg).response)
+        responses.append(len((await ps.topics()).split(",")))
+        return responses
+
+
+def test_batches_larger_than_burst_are_refused_whole():
+    create_4, create_3, publish_4, topics = asyncio.run(_batches())
+    assert create_4.code == aiocoap.REQUEST_ENTITY_TOO_LARGE
+    # The refused request cost nothing: the next one, at the burst, passes
+    assert create_3.code == aiocoap.CREATED
+    assert publish_4.code == aiocoap.REQUEST_ENTITY_TOO_LARGE
+    assert topics == 3
@@ -0,0 +1,30 @@
+"""Deadline schedulers and observer-checked resources."""
+
+import pytest
+
+import broker
+
+
+def test_scheduler_without_fire_cannot_be_built():
+    class Incomplete(broker.DeadlineScheduler):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(broker.CollectionResource())
+
+
+def test_checked_resource_needs_its_hooks():
+    class Incomplete(broker.CheckedResource):
+        __slots__ = ()
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_expiry_fires_topics_past_their_date():
+    collection = broker.CollectionResource()
+    path, error = collection.create_topic({"topic-name": "t", "expiration-date": 1})
+    assert error is None and path in collection.expiry
+    collection.expiry._run()
+    assert collection.topics.get(path) is None
+    assert collection.expiry.expired == 1
@@ -0,0 +1,38 @@
+"""Topic configuration resources, /ps/<id>."""
+
+import asyncio
+
+import aiocoap
+import pytest
+
+from codec import CT_JSON, CT_PUBSUB_CBOR, decode_topic_payload
+
+from conftest import running_broker
+
+
+@pytest.mark.parametrize("payload", [b"[1]", b"1", b'"x"', b"null"])
+def test_decode_topic_payload_refuses_non_map_json(payload):
+    with pytest.raises(ValueError):
+        decode_topic_payload(payload, CT_JSON)
+
+
+def test_decode_topic_payload_refuses_non_map_cbor():
+    with pytest.raises(ValueError):
+        decode_topic_payload(b"\x81\x01", CT_PUBSUB_CBOR)
+
+
+async def _update_with(payload: bytes) -> list[aiocoap.Message]:
+    async with running_broker() as ps:
+        path, _ = await ps.create({"topic-name": "t"})
+        responses = []
+        for code in (aiocoap.POST, aiocoap.iPATCH):
+            msg = aiocoap.Message(code=code, uri=ps.uri(path), payload=payload)
+            msg.opt.content_format = CT_JSON
+            responses.append(await ps.context.request(msg).response)
+        return responses
+
+
+def test_non_map_json_config_update_is_bad_request():
+    for response in asyncio.run(_update_with(b"[1]")):
+        assert response.code == aiocoap.BAD_REQUEST
+        assert b"JSON object" in response.payload
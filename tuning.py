@@ -0,0 +1,110 @@
+"""Event loop and socket tuning for the CoAP PubSub broker.
+
+Event loop choice and UDP socket options for the broker's command line.
+
+  --loop asyncio | uvloop | auto   event loop implementation; auto uses
+                                   uvloop when it is installed
+  --rcvbuf BYTES, --sndbuf BYTES   SO_RCVBUF / SO_SNDBUF of the UDP sockets
+  --recv-batch N                   datagrams read per socket wake-up
+
+aiocoap creates its UDP sockets itself, so the options are applied to them
+once the server context exists. The kernel may cap the buffer sizes
+(net.core.rmem_max, wmem_max); the sizes it actually granted are logged.
+
+aiocoap's UDP transport reads one datagram per readiness callback, after
+checking the socket's error queue. With --recv-batch N the callback goes on
+reading, up to N datagrams in all, until the socket is empty; a burst of
+requests then costs one trip through the event loop instead of one each.
+"""
+
+import asyncio
+import logging
+import socket
+
+log = logging.getLogger("pubsub-tuning")
+
+LOOPS = ("asyncio", "uvloop", "auto")
+
+
+def loop_factory(name: str):
+    """The event loop factory for *name*, or None for asyncio's default.
+    Raises RuntimeError for uvloop when it is not installed."""
+    if name == "asyncio":
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        if name == "auto":
+            return None
+        raise RuntimeError("--loop uvloop needs uvloop (pip install uvloop)") from None
+    return uvloop.new_event_loop
+
+
+def run(main, loop: str = "asyncio"):
+    """Run the coroutine *main* to completion on a new event loop of kind *loop*."""
+    with asyncio.Runner(loop_factory=loop_factory(loop)) as runner:
+        return runner.run(main)
+
+
+# ---------------------------------------------------------------------------
+# UDP sockets
+# ---------------------------------------------------------------------------
+
+def _udp_transports(context) -> list:
+    """The datagram transports of an aiocoap context's UDP interfaces."""
+    transports = []
+    for interface in context.request_interfaces:
+        manager = getattr(interface, "token_interface", None)
+        transport = getattr(getattr(manager, "message_interface", None), "transport", None)
+        if transport is not None and transport.get_extra_info("socket") is not None:
+            transports.append(transport)
+    return transports
+
+
+def _set_buffer(sock: socket.socket, option: int, size: int, name: str) -> None:
+    sock.setsockopt(socket.SOL_SOCKET, option, size)
+    granted = sock.getsockopt(socket.SOL_SOCKET, option)
+    # Linux reports twice the size asked for, the rest being bookkeeping
+    if granted < size:
+        log.warning("%s of %s is %d bytes, not %d: raise the kernel's limit",
+                    name, sock.getsockname(), granted, size)
+    else:
+        log.info("%s of %s is %d bytes", name, sock.getsockname(), granted)
+
+
+def _batched_read_ready(transport, batch: int):
+    """A readiness callback reading up to *batch* datagrams: the transport's
+    own (error queue, then one datagram), then more while there are any."""
+    sock = transport.get_extra_info("socket")
+    read_one = transport._read_ready
+
+    def read_ready() -> None:
+        read_one()
+        for _ in range(batch - 1):
+            protocol = transport._protocol
+            if protocol is None:   # closed meanwhile
+                return
+            try:
+                data, ancdata, flags, addr = sock.recvmsg(transport.max_size, 1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                protocol.error_received(exc)
+                return
+            protocol.datagram_msg_received(data, ancdata, flags, addr)
+
+    return read_ready
+
+
+def tune_context(context, rcvbuf: int | None = None, sndbuf: int | None = None,
+                 recv_batch: int = 1) -> None:
+    """Apply socket buffer sizes and receive batching to *context*'s UDP sockets."""
+    for transport in _udp_transports(context):
+        sock = transport.get_extra_info("socket")
+        if rcvbuf:
+            _set_buffer(sock, socket.SO_RCVBUF, rcvbuf, "Receive buffer")
+        if sndbuf:
+            _set_buffer(sock, socket.SO_SNDBUF, sndbuf, "Send buffer")
+        if recv_batch > 1:
+            # The transport's reader callback looks the method up on each call
+            transport._read_ready = _batched_read_ready(transport, recv_batch)
@@ -0,0 +1,250 @@
+"""Multi-process mode for the CoAP PubSub broker.
+
+Run N broker processes on one UDP port and shard topics between them.
+
+Every worker binds the public port (aiocoap sets SO_REUSEPORT on its UDP
+sockets, so the kernel spreads clients across workers) and a private
+loopback port that siblings use to reach it. A topic lives on exactly one
+worker, chosen by a stable hash of its paths: topic and topic-data paths
+are generated so that both hash to the creating worker, and a topic with a
+client-provided topic-data path is created on the worker that path hashes
+to.
+
+Requests for a topic that arrive at another worker are forwarded to its
+owner over the loopback port, including Observe: the forwarding worker
+relays the owner's notifications. GET and FETCH on /ps gather the
+listings of all workers.
+"""
+
+import asyncio
+import copy
+import logging
+import multiprocessing
+import os
+import signal
+import zlib
+
+import aiocoap
+from aiocoap import Message
+
+from logconfig import configure_logging
+from tuning import run as run_loop
+
+log = logging.getLogger("pubsub-workers")
+
+# Uri-Query marking a sibling's request for this worker's own topics only
+LOCAL_QUERY = "shard=local"
+
+
+def owner_of(path: str, count: int) -> int:
+    """Worker index owning *path*; stable across processes and restarts."""
+    return zlib.crc32(path.encode("utf-8")) % count
+
+
+class Shard:
+    """This worker's place among its siblings, and the means to reach them."""
+
+    def __init__(self, index: int, count: int, internal_ports: list[int],
+                 internal_host: str = "127.0.0.1"):
+        self.index = index
+        self.count = count
+        self.internal_host = internal_host
+        self.internal_ports = internal_ports
+        self.context: aiocoap.Context | None = None   # set once bound
+
+    def owner(self, path: str) -> int:
+        return owner_of(path, self.count)
+
+    def owns(self, path: str) -> bool:
+        return self.owner(path) == self.index
+
+    @staticmethod
+    def is_internal(request) -> bool:
+        return LOCAL_QUERY in request.opt.uri_query
+
+    def is_sibling(self, remote) -> bool:
+        """Whether *remote* is a sibling worker's forwarding endpoint."""
+        sockaddr = getattr(remote, "sockaddr", None)
+        return (
+            sockaddr is not None
+            and sockaddr[1] in self.internal_ports
+            and sockaddr[0].removeprefix("::ffff:") == self.internal_host
+        )
+
+    def _outgoing(self, request, owner: int, uri_path=None, uri_query=None) -> Message:
+        msg = Message(code=request.code, payload=request.payload)
+        msg.opt = copy.deepcopy(request.opt)
+        msg.opt.uri_host = None
+        msg.opt.uri_port = None
+        # Requests that went through a Site arrive with their path stripped
+        if uri_path is not None:
+            msg.opt.uri_path = uri_path
+        if uri_query is not None:
+            msg.opt.uri_query = uri_query
+        msg.unresolved_remote = f"{self.internal_host}:{self.internal_ports[owner]}"
+        return msg
+
+    @staticmethod
+    def _relay(response: Message) -> Message:
+        relayed = Message(code=response.code, payload=response.payload)
+        relayed.opt = copy.deepcopy(response.opt)
+        return relayed
+
+    async def forward(self, request, owner: int, uri_path) -> Message:
+        """Forward an assembled request for *uri_path* to *owner*; return its response."""
+        msg = self._outgoing(request, owner, uri_path=uri_path)
+        # The request may have arrived blockwise; it goes on as a whole
+        msg.opt.block1 = None
+        msg.opt.block2 = None
+        msg.opt.size1 = None
+        response = await self.context.request(msg).response
+        return self._relay(response)
+
+    async def forward_to_pipe(self, pipe, owner: int) -> None:
+        """Forward a request as-is (blocks included) and relay every response.
+
+        An observation is kept open at the owner for as long as the client
+        observes this worker; cancellation of the render task on the client's
+        loss of interest cancels it at the owner too.
+        """
+        req = self.context.request(self._outgoing(pipe.request, owner),
+                                   handle_blockwise=False)
+        first = await req.response
+        if pipe.request.opt.observe != 0 or first.opt.observe is None:
+            pipe.add_response(self._relay(first), is_last=True)
+            return
+
+        pipe.add_response(self._relay(first), is_last=False)
+        try:
+            async for notification in req.observation:
+                pipe.add_response(self._relay(notification), is_last=False)
+        except aiocoap.error.Error as e:
+            log.info("Forwarded observation to worker %d failed: %s", owner, e)
+        finally:
+            req.observation.cancel()
+        # The owner ended the observation (the topic or its data is gone)
+        pipe.add_response(
+            Message(code=aiocoap.NOT_FOUND, payload=b"Observation ended"),
+            is_last=True,
+        )
+
+    async def gather(self, request) -> list[bytes]:
+        """Payloads of *request* on /ps as answered by every sibling for its own topics."""
+        pending = []
+        for owner in range(self.count):
+            if owner == self.index:
+                continue
+            msg = self._outgoing(request, owner, uri_path=["ps"], uri_query=[LOCAL_QUERY])
+            msg.opt.block2 = None
+            msg.opt.etags = []
+            pending.append(self.context.request(msg).response)
+
+        payloads = []
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, Exception):
+                log.warning("Sibling did not answer %s on /ps: %s", request.code, result)
+            elif result.code.is_successful() and result.payload:
+                payloads.append(result.payload)
+        return payloads
+
+
+class ShardRouter:
+    """Root resource on the public port; forwards requests for foreign topics.
+
+    Everything that is not about a single topic (/ps itself, discovery) is
+    rendered locally; the collection gathers from siblings where needed.
+    """
+
+    def __init__(self, site, shard: Shard):
+        self.site = site
+        self.shard = shard
+
+    def get_resources_as_linkheader(self):
+        return self.site.get_resources_as_linkheader()
+
+    def _owner(self, request) -> int:
+        path = request.opt.uri_path
+        # The collection, discovery and per-worker resources like
+        # /ps/.metrics are local; any other path may be a topic's, even a
+        # one-segment topic-data path a client chose
+        if (
+            path in ((), ("ps",))
+            or path[0] == ".well-known"
+            or path[-1].startswith(".")
+        ):
+            return self.shard.index
+        return self.shard.owner("/".join(path))
+
+    async def render_to_pipe(self, pipe) -> None:
+        owner = self._owner(pipe.request)
+        if owner == self.shard.index:
+            await self.site.render_to_pipe(pipe)
+            return
+        # Rate limits are charged where the client's request arrives
+        rejection = self.site.admit(pipe.request)
+        if rejection is not None:
+            pipe.add_response(rejection, is_last=True)
+        else:
+            await self.shard.forward_to_pipe(pipe, owner)
+
+
+# ---------------------------------------------------------------------------
+# Process management
+# ---------------------------------------------------------------------------
+
+def _worker_main(index: int, count: int, internal_ports: list[int], run_kwargs: dict,
+                 log_options: dict, loop: str) -> None:
+    from broker import _run   # broker imports this module
+
+    listener = configure_logging(worker=index, **log_options)
+    if run_kwargs.get("data_dir") is not None:
+        run_kwargs = dict(run_kwargs, data_dir=os.path.join(run_kwargs["data_dir"], f"worker-{index}"))
+    shard = Shard(index, count, internal_ports)
+    if run_kwargs.get("profile_dir") is not None:
+        # Until the broker takes SIGUSR1 over, a forwarded one must not kill it
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    try:
+        run_loop(_run(shard=shard, **run_kwargs), loop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if listener is not None:
+            listener.stop()
+
+
+def _forward_signal(procs: list, signum: int) -> None:
+    for proc in procs:
+        if proc.pid is not None and proc.is_alive():
+            os.kill(proc.pid, signum)
+
+
+def run_workers(count: int, internal_port_base: int, run_kwargs: dict,
+                log_options: dict | None = None, loop: str = "asyncio") -> None:
+    """Start *count* worker processes and wait for them; each configures
+    logging with *log_options* (see logconfig.configure_logging) and runs
+    on an event loop of kind *loop* (see tuning.LOOPS).
+
+    The topic-to-worker mapping depends on *count*, so a persistent data
+    directory must always be served with the same number of workers.
+    """
+    internal_ports = [internal_port_base + i for i in range(count)]
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=_worker_main,
+                    args=(i, count, internal_ports, run_kwargs, log_options or {}, loop),
+                    name=f"pubsub-worker-{i}")
+        for i in range(count)
+    ]
+    for proc in procs:
+        proc.start()
+    if run_kwargs.get("profile_dir") is not None:
+        # SIGUSR1 to this process toggles profiling in every worker
+        signal.signal(signal.SIGUSR1, lambda signum, frame: _forward_signal(procs, signum))
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()